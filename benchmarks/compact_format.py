@@ -0,0 +1,83 @@
+# Size of Monarch results as sent to the model, in the default "records" format vs the "compact" format
+# (monarch_utils.compact_monarch_data), for a synthetic (disease)-[has_phenotype]->(phenotype) graph and a table result.
+# Tokens are counted with tiktoken if its encoding is available, and estimated (words and punctuation) otherwise:
+#   python benchmarks/compact_format.py --edges 400
+import os
+import re
+import sys
+import copy
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from phenomics_explorer.monarch_utils import munge_monarch_data, compact_monarch_data
+from phenomics_explorer.serialization_utils import dumps
+
+
+def token_counter(encoding):
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(encoding).encode, encoding
+    except Exception:
+        word_or_symbol = re.compile(r"\w+|[^\w\s]")
+        return word_or_symbol.findall, "estimated"
+
+
+def graph_result(num_edges, seed = 0):
+    """A result in the shape _parse_neo4j_result returns, with Monarch-like node and edge properties."""
+    rng = random.Random(seed)
+    num_nodes = max(2, num_edges // 2)
+    nodes = []
+    for i in range(num_nodes):
+        disease = i % 4 == 0
+        node_id = f"MONDO:{i:07d}" if disease else f"HP:{i:07d}"
+        nodes.append({"data": {"id": node_id, "caption": f"entity {i}", "name": f"entity {i}",
+                               "category": ["biolink:Disease"] if disease else ["biolink:PhenotypicFeature"],
+                               "description": f"A description of entity {i}.", "in_taxon_label": "Homo sapiens",
+                               "provided_by": ["phenio_nodes"], "iri": f"http://purl.obolibrary.org/obo/{node_id.replace(':', '_')}"}})
+    edges = []
+    for j in range(num_edges):
+        subject, object = nodes[rng.randrange(num_nodes)]["data"]["id"], nodes[rng.randrange(num_nodes)]["data"]["id"]
+        predicate = rng.choice(["biolink:has_phenotype", "biolink:subclass_of", "biolink:related_to"])
+        edges.append({"data": {"id": f"uuid:{j}", "caption": predicate, "source": subject, "target": object, "label": predicate,
+                               "subject": subject, "predicate": predicate, "object": object,
+                               "primary_knowledge_source": "infores:hpo-annotations", "publications": [f"PMID:{j}"],
+                               "has_evidence": ["ECO:0000304"], "negated": False, "aggregator_knowledge_source": ["infores:monarchinitiative"]}})
+    return {"result_as_graph": {"type": "graph", "data": {"nodes": nodes, "edges": edges}},
+            "result_as_table": {"type": "table", "data": []}}
+
+
+def table_result(num_rows):
+    return {"result_as_graph": {"type": "graph", "data": {"nodes": [], "edges": []}},
+            "result_as_table": {"type": "table", "data": [{"disease_id": f"MONDO:{i:07d}", "disease_name": f"disease {i}", "num_phenotypes": i % 50}
+                                                          for i in range(num_rows)]}}
+
+
+def compare(name, result, count_tokens, max_response_tokens, num_rows):
+    records = munge_monarch_data(copy.deepcopy(result))
+    compact = compact_monarch_data(munge_monarch_data(copy.deepcopy(result)))
+    sizes = {}
+    for fmt, data in (("records", records), ("compact", compact)):
+        text = dumps(data)
+        sizes[fmt] = (len(text), len(count_tokens(text)))
+    records_chars, records_tokens = sizes["records"]
+    compact_chars, compact_tokens = sizes["compact"]
+    print(f"{name}: records {records_chars} chars / {records_tokens} tokens, compact {compact_chars} chars / {compact_tokens} tokens "
+          f"({records_chars / compact_chars:.2f}x fewer chars, {records_tokens / compact_tokens:.2f}x fewer tokens)")
+    print(f"  rows that fit under max_response_tokens = {max_response_tokens}: "
+          f"~{int(num_rows * max_response_tokens / records_tokens)} records vs ~{int(num_rows * max_response_tokens / compact_tokens)} compact")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Compare the records and compact Monarch result formats.")
+    parser.add_argument("--edges", type = int, default = 400)
+    parser.add_argument("--table-rows", type = int, default = 300)
+    parser.add_argument("--encoding", default = "o200k_base", help = "tiktoken encoding, if available.")
+    parser.add_argument("--max-response-tokens", type = int, default = 30000)
+    args = parser.parse_args()
+
+    count_tokens, counted_with = token_counter(args.encoding)
+    print(f"tokens: {counted_with}")
+    compare(f"graph, {args.edges} edges", graph_result(args.edges), count_tokens, args.max_response_tokens, args.edges)
+    compare(f"table, {args.table_rows} rows", table_result(args.table_rows), count_tokens, args.max_response_tokens, args.table_rows)
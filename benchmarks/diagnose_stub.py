@@ -0,0 +1,95 @@
+# Throughput of the diagnose.py experiment runner (run_experiments) at different concurrency levels, offline: engines are
+# stubs that answer after --latency seconds (behind the usual per-model rate limiters), MONDO lookups come from an in-memory
+# table, and no query reaches Neo4j. Results and manifests go to a temporary directory. Run from the repo root:
+#   python benchmarks/diagnose_stub.py --phenopackets 20 --concurrency 1 4 16
+import os
+import sys
+import json
+import glob
+import time
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "eval"))
+
+# agents read the URI when created, but only connect to run queries, which the stub engines never ask for
+os.environ.setdefault("NEO4J_URI", "bolt://localhost:7687")
+
+from kani import ChatMessage
+from kani.engines.base import BaseEngine, Completion
+
+from rate_limiting import RateLimitedEngine, get_rate_limiter
+from manifest import ExperimentManifest, plan_experiments, format_progress, BASE_ENGINES, EVAL_ENGINES
+from mondo_xrefs import phenopacket_diagnosis
+from diagnose import run_experiments
+
+
+class StubEngine(BaseEngine):
+    """Answers every prompt with a fixed differential diagnosis after latency seconds."""
+    max_context_size = 128000
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def prompt_len(self, messages, functions = None, **kwargs):
+        return sum(len(m.text or "") for m in messages) // 4
+
+    async def predict(self, messages, functions = None, **hyperparams):
+        await asyncio.sleep(self.latency)
+        return Completion(ChatMessage.assistant("1. MONDO:0000001 - disease A\n2. MONDO:0000002 - disease B"),
+                          prompt_tokens = 1000, completion_tokens = 20)
+
+
+def stub_engine_factory(latency, rpm, tpm):
+    engines = {}
+
+    def engine_factory(model):
+        if model not in engines:
+            engines[model] = RateLimitedEngine(StubEngine(latency), get_rate_limiter(f"stub/{model}", rpm, tpm))
+        return engines[model]
+
+    return engine_factory
+
+
+def xref_table_for(phenopackets_files):
+    table = {}
+    for phenopacket_file in phenopackets_files:
+        with open(phenopacket_file, "r") as f:
+            table[phenopacket_diagnosis(json.load(f))] = [{"mondo_id": "MONDO:0000001", "disease_name": "disease A"}]
+    return table
+
+
+async def measure(phenopackets_files, concurrency, args):
+    with tempfile.TemporaryDirectory() as results_dir:
+        manifest = ExperimentManifest(os.path.join(results_dir, "manifest.jsonl"))
+        manifest.plan(plan_experiments(phenopackets_files, BASE_ENGINES, EVAL_ENGINES, results_dir))
+        started = time.perf_counter()
+        progress = await run_experiments(manifest, stub_engine_factory(args.latency, args.rpm, args.tpm), neo4j_driver = None,
+                                         xref_table = xref_table_for(phenopackets_files), concurrency = concurrency)
+        elapsed = time.perf_counter() - started
+        manifest.close()
+        # the per-phenopacket directories are named like the files, hence the isfile check
+        written = sum(1 for f in glob.glob(os.path.join(results_dir, "diagnoses", "**", "*.json"), recursive = True) if os.path.isfile(f))
+    return elapsed, progress, written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark the diagnose.py experiment runner with stub engines.")
+    parser.add_argument("--phenopackets-dir", default = os.path.join("eval", "phenopackets"))
+    parser.add_argument("--phenopackets", type = int, default = 20, help = "Number of phenopackets to use.")
+    parser.add_argument("--concurrency", type = int, nargs = "+", default = [1, 4, 16])
+    parser.add_argument("--latency", type = float, default = 0.5, help = "Seconds per stub engine request.")
+    parser.add_argument("--rpm", type = int, default = 500)
+    parser.add_argument("--tpm", type = int, default = None)
+    args = parser.parse_args()
+
+    phenopackets_files = sorted(glob.glob(os.path.join(args.phenopackets_dir, "*.json")))[:args.phenopackets]
+    results = []
+    for concurrency in args.concurrency:
+        # experiment progress goes to stdout; the summary is printed at the end
+        elapsed, progress, written = asyncio.run(measure(phenopackets_files, concurrency, args))
+        results.append(f"concurrency {concurrency}: {elapsed:.1f} s, {progress['done'] / elapsed:.1f} experiments/s, "
+                       f"{written} result files, {format_progress(progress)}")
+    print("\n".join(results))
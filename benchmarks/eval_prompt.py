@@ -0,0 +1,81 @@
+# Time to build the evaluator prompt (EvaluatorAgent.get_eval_query_prompt) in a long conversation, vs serializing the whole
+# history for every evaluation as it used to. The conversation grows by one exchange per evaluation, as in a chat session.
+# Run from the repo root:
+#   python benchmarks/eval_prompt.py --messages 1000
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from kani import ChatMessage, ChatRole
+from kani.engines.base import BaseEngine
+
+from phenomics_explorer.utils import messages_dump
+from phenomics_explorer.agent_kgbase_evaluator import EvaluatorAgent
+
+
+class IdleEngine(BaseEngine):
+    """The prompt is built without calling the model, so the engine is never used."""
+    max_context_size = 128000
+
+    def prompt_len(self, messages, functions = None, **kwargs):
+        return 0
+
+    async def predict(self, messages, functions = None, **hyperparams):
+        raise NotImplementedError
+
+
+def exchange(i, result_chars):
+    return [ChatMessage.user(f"Question {i}: which phenotypes are associated with disease {i}?"),
+            ChatMessage.function("run_query", json.dumps({"rows": [f"HP:{j:07d}" for j in range(result_chars // 14)]})),
+            ChatMessage.assistant(f"Disease {i} is associated with these phenotypes.")]
+
+
+def serialize_full_history(messages_history):
+    """The previous approach: every message dumped (and trimmed) on each evaluation, then the last 10 kept."""
+    strings = []
+    for m in messages_history:
+        dumped = messages_dump(m)
+        content = dumped.get("content")
+        if m.role == ChatRole.FUNCTION and isinstance(content, str) and len(content) > 4000:
+            dumped["content"] = content[:2000] + " ... [result trimmed] ..." + content[-2000:]
+        strings.append(json.dumps(dumped))
+    return strings[-10:]
+
+
+def measure(num_messages, result_chars, evaluations):
+    # the history reaches about num_messages by the last evaluation
+    history = [m for i in range(max(0, num_messages // 3 - evaluations)) for m in exchange(i, result_chars)]
+    agent = EvaluatorAgent(engine = IdleEngine())
+    result = {"result_as_table": {"type": "table", "data": [{"count": 1}]}}
+
+    full, windowed = [], []
+    for i in range(evaluations):
+        history.extend(exchange(len(history) // 3, result_chars))
+
+        started = time.perf_counter()
+        serialize_full_history(history)
+        full.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        agent.get_eval_query_prompt("MATCH (n) RETURN count(n) AS count", result, history)
+        windowed.append(time.perf_counter() - started)
+
+    # the first prompt serializes the whole window; later ones only the new messages
+    print(f"{len(history)} messages, {result_chars}-character function results, {evaluations} evaluations:")
+    print(f"  whole history: {sum(full) / len(full) * 1000:.2f} ms per prompt")
+    print(f"  recent window: {windowed[0] * 1000:.2f} ms for the first prompt, {sum(windowed[1:]) / max(1, len(windowed) - 1) * 1000:.3f} ms per later prompt")
+    assert all(len(m.content) > 4000 for m in history if m.role == ChatRole.FUNCTION), "history messages were modified"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark building the evaluator prompt in long conversations.")
+    parser.add_argument("--messages", type = int, default = 1000)
+    parser.add_argument("--result-chars", type = int, default = 20000)
+    parser.add_argument("--evaluations", type = int, default = 50)
+    args = parser.parse_args()
+
+    measure(args.messages, args.result_chars, args.evaluations)
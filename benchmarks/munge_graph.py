@@ -0,0 +1,30 @@
+# Time of monarch_utils.munge_monarch_graph_result on a synthetic Monarch-shaped graph (see compact_format.graph_result), with
+# node categories as lists like the KG returns. Run from the repo root:
+#   python benchmarks/munge_graph.py --nodes 100000
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from phenomics_explorer.monarch_utils import munge_monarch_graph_result
+
+from compact_format import graph_result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark munging of Monarch graph results.")
+    parser.add_argument("--nodes", type = int, default = 100000)
+    parser.add_argument("--repeat", type = int, default = 5)
+    args = parser.parse_args()
+
+    times = []
+    for _ in range(args.repeat):
+        # munging works in place, so each run gets a fresh result
+        graph = graph_result(args.nodes * 2)["result_as_graph"]["data"]
+        started = time.perf_counter()
+        munge_monarch_graph_result(graph)
+        times.append(time.perf_counter() - started)
+    print(f"{len(graph['nodes'])} nodes, {len(graph['edges'])} edges: median {statistics.median(times):.3f} s over {args.repeat} runs")
@@ -0,0 +1,116 @@
+# Parse time and memory of neo4j_utils._parse_neo4j_result for a (disease)-[has_phenotype]->(phenotype) graph result.
+# Records are hydrated as they stream, through a single hydration scope like the driver's AsyncResult uses, so the driver's
+# per-result Graph holds every Node and Relationship for the whole result, as it does for real queries. Run from the repo root;
+# --against also measures neo4j_utils as of a git revision, e.g. the one before graph results were gathered by element id:
+#   python benchmarks/parse_result.py --edges 20000 100000 --against 3f17766^
+import gc
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+import importlib.util
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from neo4j import Record
+from neo4j._codec.packstream import Structure
+from neo4j._codec.hydration.v2 import HydrationHandler
+
+from phenomics_explorer import neo4j_utils
+
+
+def _fresh(text):
+    # a new string object, as unpacked from the wire (literals would be shared between records)
+    return (text + " ")[:-1]
+
+
+class HydratingResult:
+    """Stands in for an AsyncResult: records are built from wire-format structures as they are iterated, and the hydration
+    scope (and so its Graph) lives as long as the result."""
+    def __init__(self, num_edges, seed = 0):
+        rng = random.Random(seed)
+        self.num_edges = num_edges
+        self.num_nodes = max(1, num_edges // 2)
+        self.pairs = [(rng.randrange(self.num_nodes), rng.randrange(self.num_nodes)) for _ in range(num_edges)]
+        self.scope = HydrationHandler().new_hydration_scope()
+
+    def keys(self):
+        return ["d", "r", "p"]
+
+    def __bool__(self):
+        return True
+
+    def _node(self, i):
+        # property values are fresh objects per record, as unpacked from the wire
+        properties = {_fresh("id"): f"MONDO:{i:07d}", _fresh("name"): f"disease {i}", _fresh("description"): "a description " * 5 + str(i),
+                      _fresh("category"): [_fresh(c) for c in ("biolink:Disease", "biolink:DiseaseOrPhenotypicFeature", "biolink:NamedThing")]}
+        return self.scope.hydration_hooks[Structure](Structure(b"N", i, [_fresh("biolink:Disease")], properties, f"4:db:{i}"))
+
+    def _relationship(self, j, start, end):
+        properties = {_fresh("id"): f"uuid:{j}", _fresh("predicate"): _fresh("biolink:has_phenotype"), _fresh("subject"): f"MONDO:{start:07d}",
+                      _fresh("object"): f"MONDO:{end:07d}", _fresh("primary_knowledge_source"): _fresh("infores:hpo-annotations")}
+        return self.scope.hydration_hooks[Structure](Structure(b"R", j, start, end, _fresh("biolink:has_phenotype"), properties,
+                                                               f"5:db:{j}", f"4:db:{start}", f"4:db:{end}"))
+
+    def __aiter__(self):
+        return self._records()
+
+    async def _records(self):
+        for j, (start, end) in enumerate(self.pairs):
+            yield Record({"d": self._node(start), "r": self._relationship(j, start, end), "p": self._node(end)})
+
+    async def consume(self):
+        pass
+
+
+def load_revision(revision):
+    """Imports src/phenomics_explorer/neo4j_utils.py as of a git revision, as a separate module."""
+    source = subprocess.run(["git", "show", f"{revision}:src/phenomics_explorer/neo4j_utils.py"],
+                            check = True, capture_output = True, text = True).stdout
+    path = os.path.join(tempfile.mkdtemp(), "neo4j_utils_at_revision.py")
+    with open(path, "w") as f:
+        f.write(source)
+    spec = importlib.util.spec_from_file_location("neo4j_utils_at_revision", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+async def measure(module, label, num_edges):
+    # timed without tracing, which slows allocation-heavy code down unevenly
+    started = time.perf_counter()
+    await module._parse_neo4j_result(HydratingResult(num_edges))
+    elapsed = time.perf_counter() - started
+
+    result = HydratingResult(num_edges)
+    tracemalloc.start()
+    parsed = await module._parse_neo4j_result(result)
+    # peak includes the driver's graph, which is alive until the session releases the result; what is left after that is
+    # what a session holds on to
+    peak = tracemalloc.get_traced_memory()[1]
+    del result
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    graph = parsed["result_as_graph"]["data"]
+    print(f"{label}: {num_edges} edges ({len(graph['nodes'])} nodes): {elapsed:.2f} s, peak {peak / 1e6:.0f} MB, retained {retained / 1e6:.0f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark parsing of graph results hydrated like the neo4j driver does.")
+    parser.add_argument("--edges", type = int, nargs = "+", default = [20000, 100000])
+    parser.add_argument("--against", help = "also measure neo4j_utils as of this git revision")
+    args = parser.parse_args()
+
+    modules = [("current", neo4j_utils)]
+    if args.against:
+        modules.insert(0, (args.against, load_revision(args.against)))
+
+    for num_edges in args.edges:
+        for label, module in modules:
+            asyncio.run(measure(module, label, num_edges))
@@ -0,0 +1,72 @@
+# Parse time and memory of neo4j_utils._parse_neo4j_result for table-shaped results (no nodes), with six columns of mixed
+# types: strings, integers with nulls, floats, dates and lists. Records are hydrated as they stream, through the driver's
+# hydration scope (see parse_result.py). Memory is traced with --memory, which slows parsing down considerably:
+#   python benchmarks/parse_table.py --rows 10000 100000 1000000
+#   python benchmarks/parse_table.py --rows 100000 --memory
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from neo4j import Record
+from neo4j._codec.packstream import Structure
+from neo4j._codec.hydration.v2 import HydrationHandler
+
+from phenomics_explorer.neo4j_utils import _parse_neo4j_result
+
+
+_KEYS = ["id", "name", "count", "score", "updated", "synonyms"]
+
+
+class HydratingTableResult:
+    def __init__(self, num_rows):
+        self.num_rows = num_rows
+        self.scope = HydrationHandler().new_hydration_scope()
+
+    def keys(self):
+        return _KEYS
+
+    def __bool__(self):
+        return True
+
+    def __aiter__(self):
+        return self._records()
+
+    async def _records(self):
+        hydrate = self.scope.hydration_hooks[Structure]
+        for i in range(self.num_rows):
+            yield Record(zip(_KEYS, [f"MONDO:{i:07d}", f"disease {i}", None if i % 7 == 0 else i, i / 3,
+                                     hydrate(Structure(b"D", 19000 + i % 1000)), [f"synonym {i}", f"other name {i}"]]))
+
+    async def consume(self):
+        pass
+
+
+async def measure(num_rows, memory):
+    started = time.perf_counter()
+    parsed = await _parse_neo4j_result(HydratingTableResult(num_rows))
+    elapsed = time.perf_counter() - started
+    line = f"{num_rows} rows: {elapsed:.2f} s"
+    del parsed
+
+    if memory:
+        tracemalloc.start()
+        parsed = await _parse_neo4j_result(HydratingTableResult(num_rows))
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        line += f", peak {peak / 1e6:.0f} MB, retained {retained / 1e6:.0f} MB"
+    print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark parsing of table-shaped results.")
+    parser.add_argument("--rows", type = int, nargs = "+", default = [10000, 100000])
+    parser.add_argument("--memory", action = "store_true", help = "Also trace peak and retained memory.")
+    args = parser.parse_args()
+
+    for num_rows in args.rows:
+        asyncio.run(measure(num_rows, args.memory))
@@ -0,0 +1,113 @@
+# Wall time of a table-shaped (no nodes returned) query, executed the way _call_neo4j used to (once for the graph view, and
+# again for the table view when the graph view is empty) vs once with _parse_neo4j_result building both views. Runs against
+# the database at NEO4J_URI, or offline against a stub session that charges --stub-latency seconds per execution:
+#   python benchmarks/table_query.py --repeat 20
+#   python benchmarks/table_query.py --stub-latency 0.2
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from neo4j import Record
+
+from phenomics_explorer.neo4j_utils import _parse_neo4j_result
+
+
+DEFAULT_QUERY = "MATCH (n) RETURN labels(n)[0] AS label, count(*) AS count ORDER BY count DESC"
+
+
+class StubResult:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def keys(self):
+        return list(self._rows[0]) if self._rows else []
+
+    def __bool__(self):
+        return True
+
+    def __aiter__(self):
+        return self._records()
+
+    async def _records(self):
+        for row in self._rows:
+            yield Record(row)
+
+    async def graph(self):
+        return type("StubGraph", (), {"nodes": [], "relationships": []})()
+
+    async def data(self):
+        return self._rows
+
+    async def consume(self):
+        pass
+
+
+class StubSession:
+    """Each run() waits latency seconds, standing in for the server executing the query, and returns table rows."""
+    def __init__(self, latency, num_rows = 50):
+        self.latency = latency
+        self.rows = [{"label": f"biolink:Label{i}", "count": 1000 - i} for i in range(num_rows)]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def run(self, query, parameters = None):
+        await asyncio.sleep(self.latency)
+        return StubResult(self.rows)
+
+
+async def run_twice(session, query):
+    """The previous _call_neo4j: the graph view from one execution, then the table view from a second one."""
+    graph = await (await session.run(query)).graph()
+    if len(graph.nodes) == 0:
+        return await (await session.run(query)).data()
+    return []
+
+
+async def run_once(session, query):
+    return await _parse_neo4j_result(await session.run(query))
+
+
+async def measure(new_session, query, repeat):
+    timings = {}
+    for name, run in (("two executions", run_twice), ("one execution", run_once)):
+        times = []
+        for _ in range(repeat):
+            async with new_session() as session:
+                started = time.perf_counter()
+                await run(session, query)
+                times.append(time.perf_counter() - started)
+        timings[name] = statistics.median(times)
+        print(f"{name}: median {timings[name] * 1000:.1f} ms over {repeat} runs")
+    print(f"speedup: {timings['two executions'] / timings['one execution']:.2f}x")
+
+
+async def main(args):
+    if args.stub_latency is not None:
+        await measure(lambda: StubSession(args.stub_latency), args.query, args.repeat)
+        return
+
+    from neo4j import AsyncGraphDatabase
+    async with AsyncGraphDatabase.driver(os.environ["NEO4J_URI"]) as driver:
+        # one unmeasured run, so both variants see a warm page cache and query plan cache
+        async with driver.session() as session:
+            await run_once(session, args.query)
+        await measure(driver.session, args.query, args.repeat)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark single vs double execution of table-shaped queries.")
+    parser.add_argument("--query", default = DEFAULT_QUERY)
+    parser.add_argument("--repeat", type = int, default = 10)
+    parser.add_argument("--stub-latency", type = float, default = None, help = "Use a stub session with this many seconds per execution instead of NEO4J_URI.")
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
@@ -0,0 +1,251 @@
+# Phenopacket prompts, and a compiled corpus format so experiment runs don't re-parse thousands of phenopacket JSON files.
+# Compile a directory of phenopackets with:
+#   python corpus.py --phenopackets-dir phenopackets_all
+# which writes phenopackets_all.corpus, to pass to diagnose.py with --corpus.
+import os
+import mmap
+import json
+import glob
+import struct
+import argparse
+import isodate
+from collections import OrderedDict
+
+from mondo_xrefs import phenopacket_diagnosis
+
+
+def iso8601_duration_to_human_readable(age):
+    """Convert an ISO 8601 duration to a human-readable format."""
+    duration = isodate.parse_duration(age, as_timedelta_if_possible = False)
+    years = duration.years
+    months = duration.months
+    age_human_readable = age
+    if years > 0:
+        age_human_readable = f"{years} year{'s' if years > 1 else ''}"
+    if months > 0:
+        if years > 0:
+            age_human_readable += f", {months} month{'s' if months > 1 else ''}"
+    if years == 0 and months > 0:
+        age_human_readable = f"{months} month{'s' if months > 1 else ''}"
+
+    if years == 0 and months == 0:
+        age_human_readable = "newborn"
+
+    return age_human_readable
+
+def phenopacket_fields(phenopacket, include_ids = False):
+    """Extract the patient information used in prompts from a phenopacket: subject ID, age, sex and included and excluded features."""
+    age_human_readable = "Unknown"
+    if "subject" in phenopacket and "timeAtLastEncounter" in phenopacket["subject"] and "age" in phenopacket["subject"]["timeAtLastEncounter"]:
+        if "iso8601duration" in phenopacket["subject"]["timeAtLastEncounter"]["age"]:
+            age = phenopacket["subject"]["timeAtLastEncounter"]["age"]["iso8601duration"]
+            age_human_readable = iso8601_duration_to_human_readable(age)
+
+    sex_human_readable = "Unknown"
+    if "subject" in phenopacket and "sex" in phenopacket["subject"]:
+        sex = phenopacket["subject"]["sex"]
+        sex_human_readable = sex.capitalize()
+
+    subject_id = phenopacket.get("subject", {}).get("id", "Unknown")
+
+    include_features = []
+    exclude_features = []
+    for feature in phenopacket["phenotypicFeatures"]:
+        if "onset" in feature and "age" in feature["onset"] and "iso8601duration" in feature["onset"]["age"]:
+            onset_age = "onset " + iso8601_duration_to_human_readable(feature["onset"]["age"]["iso8601duration"])
+        elif "onset" in feature and "ontologyClass" in feature["onset"]:
+            onset_age = feature["onset"]["ontologyClass"]["label"]
+        else:
+            onset_age = ""
+
+        if "excluded" not in feature or not feature["excluded"]:
+            if include_ids:
+                if onset_age != "":
+                    include_features.append(f"{feature['type']['label']} ({feature['type']['id']}, {onset_age})")
+                else:
+                    include_features.append(f"{feature['type']['label']} ({feature['type']['id']})")
+            else:
+                if onset_age != "":
+                    include_features.append(f"{feature['type']['label']} ({onset_age})")
+                else:
+                    include_features.append(feature['type']['label'])
+        else:
+            if include_ids:
+                exclude_features.append(f"{feature['type']['label']} ({feature['type']['id']})")
+            else:
+                exclude_features.append(feature['type']['label'])
+
+
+    return {"subject_id": subject_id,
+            "age": age_human_readable,
+            "sex": sex_human_readable,
+            "included_features": include_features,
+            "excluded_features": exclude_features}
+
+
+def fields_to_prompt(fields):
+    """Convert extracted patient information (see phenopacket_fields) to a prompt string."""
+    subject_id = fields["subject_id"]
+    age_human_readable = fields["age"]
+    sex_human_readable = fields["sex"]
+    include_features = fields["included_features"]
+    exclude_features = fields["excluded_features"]
+
+    if len(include_features) == 0:
+        include_features = ["None"]
+    if len(exclude_features) == 0:
+        exclude_features = ["None"]
+    include_features_str = ", ".join(include_features) + "."
+    exclude_features_str = ", ".join(exclude_features) + "."
+    prompt = f"""
+From the following patient information, what is the most likely diagnosis? Use multiple queries or reasoning steps as necessary, and provide a rank-ordered list of up to 10 diagnoses, even if there is insufficient information to make a definitive diagnosis. If you are unsure, provide a list of possible diagnoses with the most likely one first.
+
+Patient ID: {subject_id}
+Patient age: {age_human_readable}
+Patient sex: {sex_human_readable}
+Patient features: {include_features_str}
+Excluded patient features: {exclude_features_str}
+"""
+    return prompt.strip()
+
+
+def phenopacket_to_prompt(phenopacket, include_ids = False):
+    """Convert a phenopacket to a prompt string."""
+    return fields_to_prompt(phenopacket_fields(phenopacket, include_ids = include_ids))
+
+
+# Corpus file layout (all integers little-endian):
+#   header: magic, format version, number of records, offset of the record index
+#   records: each a sequence of _FIELDS, each field a u32 byte length followed by UTF-8 text (lists joined by _LIST_SEPARATOR)
+#   index: a u64 offset per record
+_MAGIC = b"PXCORPUS"
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct("<8sIIQ")
+_LENGTH = struct.Struct("<I")
+_LIST_SEPARATOR = "\x1f"
+_FIELDS = ("phenopacket_file", "subject_id", "age", "sex", "included_features", "excluded_features", "diagnosis", "prompt", "phenopacket_json")
+_LIST_FIELDS = frozenset(["included_features", "excluded_features"])
+
+
+def _encode_record(record):
+    parts = []
+    for field in _FIELDS:
+        value = record[field]
+        if field in _LIST_FIELDS:
+            value = _LIST_SEPARATOR.join(value)
+        data = (value or "").encode("utf-8")
+        parts.append(_LENGTH.pack(len(data)))
+        parts.append(data)
+    return b"".join(parts)
+
+
+def compile_corpus(phenopackets_dir, path = None):
+    """Compiles the phenopackets in a directory into a corpus file (default: <phenopackets_dir>.corpus), with the patient
+    information, diagnosis, prompt and raw JSON of each, keyed by the phenopacket file path as diagnose.py would glob it."""
+    path = path or phenopackets_dir.rstrip(os.sep) + ".corpus"
+    phenopackets_files = sorted(glob.glob(os.path.join(phenopackets_dir, "*.json")))
+
+    offsets = []
+    with open(path + ".tmp", "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, _FORMAT_VERSION, 0, 0))
+        for phenopacket_file in phenopackets_files:
+            with open(phenopacket_file, "r") as pf:
+                raw_json = pf.read()
+            phenopacket = json.loads(raw_json)
+            record = {"phenopacket_file": phenopacket_file,
+                      **phenopacket_fields(phenopacket, include_ids = False),
+                      "diagnosis": phenopacket_diagnosis(phenopacket),
+                      "prompt": phenopacket_to_prompt(phenopacket, include_ids = False),
+                      "phenopacket_json": raw_json}
+            offsets.append(f.tell())
+            f.write(_encode_record(record))
+
+        index_offset = f.tell()
+        f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+        f.seek(0)
+        f.write(_HEADER.pack(_MAGIC, _FORMAT_VERSION, len(offsets), index_offset))
+    os.replace(path + ".tmp", path)
+
+    print(f"Compiled {len(offsets)} phenopackets into {path}.")
+    return path
+
+
+class CompiledCorpus:
+    """Read-only, memory-mapped access to a compiled corpus. Records are decoded on access, into dicts with the fields of
+    _FIELDS except the raw phenopacket JSON (diagnosis None if the phenopacket has none). The JSON is only read and parsed by
+    phenopacket(), which keeps the last cache_size parsed phenopackets, so the experiments of a phenopacket (which run close
+    together) share one parse."""
+    def __init__(self, path, cache_size = 64):
+        self.path = path
+        self.cache_size = cache_size
+        self._phenopackets = OrderedDict()
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+
+        magic, version, count, index_offset = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC or version != _FORMAT_VERSION:
+            raise ValueError(f"{path} is not a corpus file of format version {_FORMAT_VERSION}; recompile it with corpus.py.")
+        self._offsets = struct.unpack_from(f"<{count}Q", self._mm, index_offset)
+        # the file path is the first field of each record
+        self._index = {self._read_field(offset)[0]: i for i, offset in enumerate(self._offsets)}
+
+    def _read_field(self, offset):
+        (length,) = _LENGTH.unpack_from(self._mm, offset)
+        start = offset + _LENGTH.size
+        return self._mm[start:start + length].decode("utf-8"), start + length
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, i):
+        offset = self._offsets[i]
+        record = {}
+        for field in _FIELDS[:-1]:
+            value, offset = self._read_field(offset)
+            if field in _LIST_FIELDS:
+                value = value.split(_LIST_SEPARATOR) if value else []
+            record[field] = value
+        record["diagnosis"] = record["diagnosis"] or None
+        return record
+
+    def __contains__(self, phenopacket_file):
+        return phenopacket_file in self._index
+
+    def phenopacket_files(self):
+        return list(self._index)
+
+    def get(self, phenopacket_file):
+        """The record for a phenopacket file path, or None."""
+        i = self._index.get(phenopacket_file)
+        return self[i] if i is not None else None
+
+    def phenopacket(self, phenopacket_file):
+        """The parsed phenopacket JSON for a phenopacket file path; shared between callers, so treat it as read-only."""
+        if phenopacket_file in self._phenopackets:
+            self._phenopackets.move_to_end(phenopacket_file)
+            return self._phenopackets[phenopacket_file]
+
+        # the raw JSON is the last field of the record
+        offset = self._offsets[self._index[phenopacket_file]]
+        for _ in _FIELDS[:-1]:
+            (length,) = _LENGTH.unpack_from(self._mm, offset)
+            offset += _LENGTH.size + length
+        phenopacket = json.loads(self._read_field(offset)[0])
+
+        self._phenopackets[phenopacket_file] = phenopacket
+        while len(self._phenopackets) > self.cache_size:
+            self._phenopackets.popitem(last = False)
+        return phenopacket
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Compile a directory of phenopackets into a corpus file for diagnose.py --corpus.")
+    parser.add_argument("--phenopackets-dir", default = "phenopackets_all")
+    parser.add_argument("--path", default = None, help = "Output file (default: <phenopackets-dir>.corpus).")
+    args = parser.parse_args()
+
+    compile_corpus(args.phenopackets_dir, args.path)
@@ -1,9 +1,12 @@
 # for reading API keys from .env file
 import os
 import dotenv # pip install python-dotenv
+import sys
 import json
 import glob
-import isodate
+import time
+import asyncio
+import argparse
 from neo4j import GraphDatabase
 
 # kani imports
@@ -13,172 +16,220 @@ from kani.engines.openai import OpenAIEngine
 import dotenv
 dotenv.load_dotenv(override=True) 
 
-from kani_utils.utils import full_round_sync
 from phenomics_explorer.agent_monarch import MonarchKGAgent
+from phenomics_explorer.agent_monarch_evaluator import MonarchEvaluatorAgent
 from phenomics_explorer.utils import messages_dump
-
-
-neo4j_driver = GraphDatabase.driver(os.environ["NEO4J_URI"])
-
-
-def iso8601_duration_to_human_readable(age):
-    """Convert an ISO 8601 duration to a human-readable format."""
-    duration = isodate.parse_duration(age, as_timedelta_if_possible = False)
-    years = duration.years
-    months = duration.months
-    age_human_readable = age
-    if years > 0:
-        age_human_readable = f"{years} year{'s' if years > 1 else ''}"
-    if months > 0:
-        if years > 0:
-            age_human_readable += f", {months} month{'s' if months > 1 else ''}"
-    if years == 0 and months > 0:
-        age_human_readable = f"{months} month{'s' if months > 1 else ''}"
-
-    if years == 0 and months == 0:
-        age_human_readable = "newborn"
-
-    return age_human_readable
-
-def phenopacket_to_prompt(phenopacket, include_ids = False):
-    """Convert a phenopacket to a prompt string."""
-    age_human_readable = "Unknown"
-    if "subject" in phenopacket and "timeAtLastEncounter" in phenopacket["subject"] and "age" in phenopacket["subject"]["timeAtLastEncounter"]:
-        if "iso8601duration" in phenopacket["subject"]["timeAtLastEncounter"]["age"]:
-            age = phenopacket["subject"]["timeAtLastEncounter"]["age"]["iso8601duration"]
-            age_human_readable = iso8601_duration_to_human_readable(age)
-
-    sex_human_readable = "Unknown"
-    if "subject" in phenopacket and "sex" in phenopacket["subject"]:
-        sex = phenopacket["subject"]["sex"]
-        sex_human_readable = sex.capitalize()
-
-    subject_id = phenopacket.get("subject", {}).get("id", "Unknown")
-
-    include_features = []
-    exclude_features = []
-    for feature in phenopacket["phenotypicFeatures"]:
-        if "onset" in feature and "age" in feature["onset"] and "iso8601duration" in feature["onset"]["age"]:
-            onset_age = "onset " + iso8601_duration_to_human_readable(feature["onset"]["age"]["iso8601duration"])
-        elif "onset" in feature and "ontologyClass" in feature["onset"]:
-            onset_age = feature["onset"]["ontologyClass"]["label"]
-        else:
-            onset_age = ""
-
-        if "excluded" not in feature or not feature["excluded"]:
-            if include_ids:
-                if onset_age != "":
-                    include_features.append(f"{feature['type']['label']} ({feature['type']['id']}, {onset_age})")
-                else:
-                    include_features.append(f"{feature['type']['label']} ({feature['type']['id']})")
-            else:
-                if onset_age != "":
-                    include_features.append(f"{feature['type']['label']} ({onset_age})")
-                else:
-                    include_features.append(feature['type']['label'])
-        else:
-            if include_ids:
-                exclude_features.append(f"{feature['type']['label']} ({feature['type']['id']})")
-            else:
-                exclude_features.append(feature['type']['label'])
-
-
-    if len(include_features) == 0:
-        include_features = ["None"]
-    if len(exclude_features) == 0:
-        exclude_features = ["None"]
-    include_features_str = ", ".join(include_features) + "."
-    exclude_features_str = ", ".join(exclude_features) + "."
-    prompt = f"""
-From the following patient information, what is the most likely diagnosis? Use multiple queries or reasoning steps as necessary, and provide a rank-ordered list of up to 10 diagnoses, even if there is insufficient information to make a definitive diagnosis. If you are unsure, provide a list of possible diagnoses with the most likely one first.
-
-Patient ID: {subject_id}
-Patient age: {age_human_readable}
-Patient sex: {sex_human_readable}
-Patient features: {include_features_str}
-Excluded patient features: {exclude_features_str}
-"""
-    return prompt.strip()
-
-
-base_engines = ["gpt-4.1-2025-04-14", "gpt-4o-2024-11-20"]
-eval_engines = ["gpt-4.1-2025-04-14", "None"]
-
-total_experiments = len(base_engines) * len(eval_engines) * len(glob.glob("phenopackets/*.json"))
-
-phenopackets_dir = "phenopackets"
-phenopackets_files = glob.glob(os.path.join(phenopackets_dir, "*.json"))
-
-for phenopacket_file in phenopackets_files:
-    with open(phenopacket_file, "r") as f:
-        phenopacket = json.load(f)
-    
-    for base_engine_str in base_engines:
-        for eval_engine_str in eval_engines:
-            if eval_engine_str == "None":
-                eval_engine = None
-            else:
-                # 4o has a max context size of 128k; this is built into kani, but 4.1 is not built-in, so we set it to the same as 4o (even though technically it has up to 1M context)
-                # 4os max completion tokens is 16384
-                eval_engine = OpenAIEngine(os.environ["OPENAI_API_KEY"], model=eval_engine_str, temperature=0.0, max_tokens=16000, max_context_size = 128000)
-            
-            engine = OpenAIEngine(os.environ["OPENAI_API_KEY"], model=base_engine_str, temperature=0.0, max_tokens=16000, max_context_size = 128000)
-
-            # define output and skip if already done
-            output_file = f"results/diagnoses/{os.path.basename(phenopacket_file)}/{base_engine_str}/{eval_engine_str if eval_engine else 'None'}/{os.path.basename(phenopacket_file)}"
-            if os.path.exists(output_file):
-                print(f"Skipping {output_file} as it already exists.")
-                continue
-            
-            # create agent and prompt
-            agent = MonarchKGAgent(engine = engine, eval_agent_engine = eval_engine, prompt_tokens_cost = 2, completion_tokens_cost = 8, retry_attempts = 3, interactive = False)
-            prompt = phenopacket_to_prompt(phenopacket, include_ids = False)
-
-            # extract diagnosis and lookup the MONDO ID and name for the diagnosis for later scoring
-            # (I do this here rather than in scoring so we can spot-check results by hand during processing)
-            diagnosis = phenopacket["interpretations"][0]["diagnosis"]["disease"]["id"] if len(phenopacket["interpretations"]) > 0 else None
-            diagnosis_mondo = None
-
-            mondo_query = f"MATCH (d:`biolink:Disease`) WHERE '{diagnosis}' IN d.xref RETURN d.id AS mondo_id, d.name AS disease_name"
-            with neo4j_driver.session() as session:
-                result = session.run(mondo_query)
-                res = result.to_df().to_dict(orient="records")
-            if len(res) > 0:
-                diagnosis_mondo = res
-
-            # run the diagnosis
-            print(f"Running, base: {base_engine_str}, eval: {eval_engine_str}, input: {phenopacket_file}")
-            result_messages = full_round_sync(agent, prompt)
-            result_messages_as_json = [messages_dump(message) for message in result_messages]
-
-
-            # format and output results
-            result_eval_chain = agent.eval_chain
-            result_cost = agent.get_convo_cost()
-            result_tokens_used_prompt = agent.tokens_used_prompt
-            result_tokens_used_completion = agent.tokens_used_completion
-            result_dict = {
-                "phenopacket": phenopacket,
-                "cost_est_base_rate": result_cost,
-                "tokens_used_prompt": result_tokens_used_prompt,
-                "tokens_used_completion": result_tokens_used_completion,
-                "query": prompt,
-                "phenopacket_file": phenopacket_file,
-                "expected_diagnosis": diagnosis,
-                "base_engine": base_engine_str,
-                "eval_engine": eval_engine_str if eval_engine else "None",
-                "eval_chain": result_eval_chain,
-                "messages": result_messages_as_json,
-                "expected_diagnosis_mondo": diagnosis_mondo,
-            }
-
-            # make sure the directory exists
-            output_dir = os.path.dirname(output_file)
-            if not os.path.exists(output_dir):
-                os.makedirs(output_dir)
-            # save the result to a file
-            with open(output_file, "w") as f:
-                json.dump(result_dict, f, indent=4)
-
-            percent_complete = (len(glob.glob("results/*/*.json")) / total_experiments) * 100
-            print(f"Completed {output_file}. ~Cost: {result_cost} File {len(glob.glob('results/*/*.json'))} of {total_experiments} ({percent_complete:.2f}%) complete.")         
\ No newline at end of file
+from phenomics_explorer.cache_utils import DiskQueryCache, make_cache_key
+from phenomics_explorer.neo4j_utils import database_release
+
+from rate_limiting import RateLimitedEngine, get_rate_limiter, MODEL_RATE_LIMITS
+from manifest import ExperimentManifest, format_progress, plan_experiments, parse_shard, in_shard, BASE_ENGINES, EVAL_ENGINES
+from mondo_xrefs import MONDO_XREFS_PATH, load_xref_table, resolve_xrefs, phenopacket_diagnosis
+from corpus import CompiledCorpus, phenopacket_to_prompt
+
+
+def make_engine_factory(rpm = None, tpm = None):
+    """Returns an engine factory, model name -> engine, creating one rate-limited OpenAIEngine per model that is shared by all
+    experiments (and so all agents) using that model. Pass a different factory to run_experiments() to use e.g. a stub engine."""
+    engines = {}
+
+    def engine_factory(model):
+        if model not in engines:
+            default_rpm, default_tpm = MODEL_RATE_LIMITS.get(model, (None, None))
+            # 4o has a max context size of 128k; this is built into kani, but 4.1 is not built-in, so we set it to the same as 4o (even though technically it has up to 1M context)
+            # 4os max completion tokens is 16384
+            engine = OpenAIEngine(os.environ["OPENAI_API_KEY"], model=model, temperature=0.0, max_tokens=16000, max_context_size = 128000)
+            engines[model] = RateLimitedEngine(engine, get_rate_limiter(model, rpm or default_rpm, tpm or default_tpm))
+        return engines[model]
+
+    return engine_factory
+
+
+def lookup_diagnosis_mondo(diagnosis, neo4j_driver, query_cache = None, xref_table = None):
+    """Looks up the MONDO ID and name for a diagnosis ID (by MONDO xrefs), as a list of {"mondo_id", "disease_name"} records.
+    IDs in xref_table (see mondo_xrefs.py) are answered from it; others are queried, and added to it for later experiments."""
+    if diagnosis is None:
+        return []
+    if xref_table is not None and diagnosis in xref_table:
+        return xref_table[diagnosis]
+
+    mondo_cache_key = make_cache_key("mondo_xref", {"id": diagnosis}, namespace = os.environ["NEO4J_URI"])
+    res = query_cache.get(mondo_cache_key) if query_cache is not None else None
+    if res is None:
+        res = resolve_xrefs(neo4j_driver, [diagnosis])[diagnosis]
+        if query_cache is not None:
+            query_cache.put(mondo_cache_key, res)
+    if xref_table is not None:
+        xref_table[diagnosis] = res
+    return res
+
+
+async def run_experiment(experiment, engine_factory, neo4j_driver, query_cache = None, xref_table = None, corpus = None):
+    """Runs one experiment and writes its result file; returns the result dict. With a compiled corpus containing the
+    phenopacket, its prompt and diagnosis come from the corpus rather than the phenopacket file."""
+    phenopacket_file = experiment["phenopacket_file"]
+    base_engine_str = experiment["base_engine"]
+    eval_engine_str = experiment["eval_engine"]
+    output_file = experiment["output_file"]
+
+    record = corpus.get(phenopacket_file) if corpus is not None else None
+    if record is not None:
+        # parsed once per phenopacket, for the copy in the result file
+        phenopacket = corpus.phenopacket(phenopacket_file)
+    else:
+        with open(phenopacket_file, "r") as f:
+            phenopacket = json.load(f)
+
+    # create agent and prompt; the evaluator keeps its own chat history, so each experiment gets a new one
+    eval_agent = None
+    if eval_engine_str != "None":
+        eval_agent = MonarchEvaluatorAgent(engine = engine_factory(eval_engine_str))
+
+    agent_kwargs = {"query_cache": query_cache} if query_cache is not None else {}
+    agent = MonarchKGAgent(engine = engine_factory(base_engine_str), eval_agent = eval_agent, prompt_tokens_cost = 2, completion_tokens_cost = 8, retry_attempts = 3, interactive = False, **agent_kwargs)
+    prompt = record["prompt"] if record is not None else phenopacket_to_prompt(phenopacket, include_ids = False)
+
+    # extract diagnosis and lookup the MONDO ID and name for the diagnosis for later scoring
+    # (I do this here rather than in scoring so we can spot-check results by hand during processing)
+    diagnosis = record["diagnosis"] if record is not None else phenopacket_diagnosis(phenopacket)
+    diagnosis_mondo = None
+    res = await asyncio.to_thread(lookup_diagnosis_mondo, diagnosis, neo4j_driver, query_cache, xref_table)
+    if len(res) > 0:
+        diagnosis_mondo = res
+
+    # run the diagnosis
+    print(f"Running, base: {base_engine_str}, eval: {eval_engine_str}, input: {phenopacket_file}")
+    result_messages = [message async for message in agent.full_round(prompt)]
+    result_messages_as_json = [messages_dump(message) for message in result_messages]
+
+    # format and output results
+    result_eval_chain = agent.eval_chain
+    result_cost = agent.get_convo_cost()
+    result_tokens_used_prompt = agent.tokens_used_prompt
+    result_tokens_used_completion = agent.tokens_used_completion
+    result_dict = {
+        "phenopacket": phenopacket,
+        "cost_est_base_rate": result_cost,
+        "tokens_used_prompt": result_tokens_used_prompt,
+        "tokens_used_completion": result_tokens_used_completion,
+        "query": prompt,
+        "phenopacket_file": phenopacket_file,
+        "expected_diagnosis": diagnosis,
+        "base_engine": base_engine_str,
+        "eval_engine": eval_engine_str,
+        "eval_chain": result_eval_chain,
+        "query_stats": agent.query_stats,
+        "eval_stats": agent.eval_agent.eval_stats if agent.eval_agent is not None else None,
+        "messages": result_messages_as_json,
+        "expected_diagnosis_mondo": diagnosis_mondo,
+    }
+
+    # make sure the directory exists
+    output_dir = os.path.dirname(output_file)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    # save the result to a temporary file first, so an interrupted write never leaves a file that looks finished
+    with open(output_file + ".tmp", "w") as f:
+        json.dump(result_dict, f, indent=4)
+    os.replace(output_file + ".tmp", output_file)
+
+    return result_dict
+
+
+async def run_experiments(manifest, engine_factory, neo4j_driver, query_cache = None, xref_table = None, corpus = None, concurrency = 4, retry_failed = False):
+    """Runs the pending experiments of a manifest concurrently, at most concurrency at a time: planned ones and ones left
+    running by an interrupted run, or with retry_failed only the failed ones. Each state change is recorded in the manifest; a
+    failed experiment is reported and left without an output file, and the rest continue. Returns the manifest progress."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(experiment):
+        output_file = experiment["output_file"]
+        async with semaphore:
+            manifest.start(output_file)
+            started = time.monotonic()
+            try:
+                result_dict = await run_experiment(experiment, engine_factory, neo4j_driver, query_cache, xref_table, corpus)
+            except Exception as e:
+                manifest.fail(output_file, f"{type(e).__name__}: {e}")
+                sys.stderr.write(f"FAILED {output_file}: {type(e).__name__}: {e}\n")
+                return
+
+        manifest.finish(output_file, duration = time.monotonic() - started, cost = result_dict["cost_est_base_rate"])
+        print(f"Completed {output_file}. ~Cost: {result_dict['cost_est_base_rate']} {format_progress(manifest.progress())}.")
+
+    await asyncio.gather(*[run(experiment) for experiment in manifest.pending(retry_failed = retry_failed)])
+    return manifest.progress()
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Run diagnosis experiments over phenopackets for each combination of base and eval engines.")
+    parser.add_argument("--phenopackets-dir", default = "phenopackets")
+    parser.add_argument("--corpus", default = None, help = "Compiled corpus from corpus.py to read phenopackets from, instead of --phenopackets-dir.")
+    parser.add_argument("--results-dir", default = "results")
+    parser.add_argument("--base-engines", nargs = "+", default = BASE_ENGINES)
+    parser.add_argument("--eval-engines", nargs = "+", default = EVAL_ENGINES, help = "Use None for no evaluator.")
+    parser.add_argument("--concurrency", type = int, default = int(os.environ.get("EVAL_CONCURRENCY", 4)), help = "Experiments to run at once.")
+    parser.add_argument("--rpm", type = int, default = None, help = "Requests per minute per model (default: MODEL_RATE_LIMITS).")
+    parser.add_argument("--tpm", type = int, default = None, help = "Tokens per minute per model (default: MODEL_RATE_LIMITS).")
+    parser.add_argument("--manifest", default = None, help = "Experiment manifest (default: <results-dir>/manifest.jsonl, or manifest.shard-<i>-of-<N>.jsonl).")
+    parser.add_argument("--shard", default = None, help = "Only run shard i of N (i/N, 0 <= i < N) of the phenopackets, e.g. 0/4 on the first of four machines; "
+                                                       "phenopackets are assigned by a stable hash of their file name. Combine the results with merge_results.py.")
+    parser.add_argument("--retry-failed", action = "store_true", help = "Only rerun experiments that failed in earlier runs.")
+    parser.add_argument("--xref-table", default = MONDO_XREFS_PATH, help = "Diagnosis ID -> MONDO lookup table built by mondo_xrefs.py.")
+    args = parser.parse_args()
+
+    neo4j_driver = GraphDatabase.driver(os.environ["NEO4J_URI"])
+
+    # optionally replay graph results from a local cache across runs (e.g. EVAL_QUERY_CACHE=results/query_cache.sqlite);
+    # entries are tied to the KG release in MONARCH_KG_RELEASE (or else one identified from the database), and are dropped when
+    # it changes; if neither is available the cache is disabled
+    query_cache = None
+    if os.environ.get("EVAL_QUERY_CACHE"):
+        kg_release = os.environ.get("MONARCH_KG_RELEASE") or database_release(neo4j_driver)
+        query_cache = DiskQueryCache(os.environ["EVAL_QUERY_CACHE"], kg_release = kg_release)
+
+    corpus = None
+    if args.corpus is not None:
+        corpus = CompiledCorpus(args.corpus)
+        phenopackets_files = sorted(corpus.phenopacket_files())
+    else:
+        phenopackets_files = sorted(glob.glob(os.path.join(args.phenopackets_dir, "*.json")))
+    manifest_path = args.manifest or os.path.join(args.results_dir, "manifest.jsonl")
+    if args.shard is not None:
+        try:
+            shard, num_shards = parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+        phenopackets_files = [f for f in phenopackets_files if in_shard(f, shard, num_shards)]
+        # each shard keeps its own manifest, so shards can share a results tree
+        manifest_path = args.manifest or os.path.join(args.results_dir, f"manifest.shard-{shard}-of-{num_shards}.jsonl")
+    experiments = plan_experiments(phenopackets_files, args.base_engines, args.eval_engines, args.results_dir)
+
+    # diagnosis IDs missing from the table are looked up in the graph as needed
+    xref_table = load_xref_table(args.xref_table)
+    if len(xref_table) == 0:
+        print(f"No MONDO xref table at {args.xref_table}; diagnoses will be looked up per phenopacket (build it with mondo_xrefs.py).")
+
+    manifest = ExperimentManifest(manifest_path)
+    manifest.plan(experiments)
+    print(f"Starting: {format_progress(manifest.progress())}.")
+
+    try:
+        progress = asyncio.run(run_experiments(manifest,
+                                               make_engine_factory(args.rpm, args.tpm),
+                                               neo4j_driver,
+                                               query_cache = query_cache,
+                                               xref_table = xref_table,
+                                               corpus = corpus,
+                                               concurrency = args.concurrency,
+                                               retry_failed = args.retry_failed))
+    finally:
+        manifest.close()
+        neo4j_driver.close()
+        if corpus is not None:
+            corpus.close()
+    print(f"Done: {format_progress(progress)}.")
+
+
+if __name__ == "__main__":
+    main()
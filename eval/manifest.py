@@ -0,0 +1,167 @@
+# Bookkeeping for diagnose.py runs: an append-only JSONL log of experiment state changes (planned -> running -> done | failed).
+# Replaying the log gives the current state of every experiment, so a crashed or interrupted run resumes where it left off,
+# failed experiments can be retried on their own, and progress is tracked with counters rather than by scanning results/.
+import os
+import json
+import time
+import hashlib
+
+
+STATES = ("planned", "running", "done", "failed")
+
+# the default experiment grid: each phenopacket is run with each base engine, with each evaluator engine ("None" for none)
+BASE_ENGINES = ["gpt-4.1-2025-04-14", "gpt-4o-2024-11-20"]
+EVAL_ENGINES = ["gpt-4.1-2025-04-14", "None"]
+
+
+def output_path(results_dir, phenopacket_file, base_engine_str, eval_engine_str):
+    """Where the result of an experiment is written; experiments with an existing output file are skipped."""
+    name = os.path.basename(phenopacket_file)
+    return os.path.join(results_dir, "diagnoses", name, base_engine_str, eval_engine_str, name)
+
+
+def plan_experiments(phenopackets_files, base_engines, eval_engines, results_dir):
+    """All (phenopacket file, base engine, eval engine) combinations, as dicts with their output file."""
+    return [{"phenopacket_file": phenopacket_file,
+             "base_engine": base_engine_str,
+             "eval_engine": eval_engine_str,
+             "output_file": output_path(results_dir, phenopacket_file, base_engine_str, eval_engine_str)}
+            for phenopacket_file in phenopackets_files
+            for base_engine_str in base_engines
+            for eval_engine_str in eval_engines]
+
+
+def parse_shard(shard):
+    """Parses a shard spec "i/N" into (i, N), with 0 <= i < N."""
+    try:
+        index, num_shards = (int(part) for part in shard.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard {shard!r}; expected i/N, e.g. 0/4.")
+    if num_shards < 1 or not 0 <= index < num_shards:
+        raise ValueError(f"Invalid shard {shard!r}; expected 0 <= i < N.")
+    return index, num_shards
+
+
+def in_shard(phenopacket_file, shard, num_shards):
+    """Whether a phenopacket belongs to a shard, by a hash of its file name that is stable across machines and runs (unlike
+    hash()), so all combinations for a phenopacket land in the same shard."""
+    digest = hashlib.sha1(os.path.basename(phenopacket_file).encode()).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards == shard
+
+
+class ExperimentManifest:
+    """Experiment states keyed by output file, backed by an append-only JSONL file at path. Each state change is appended and
+    flushed to disk before the call returns; when loading, a partially written last line (from a crash) is ignored.
+    Once plan() is called, pending() and progress() only cover the experiments planned by this run, so leftovers from earlier
+    runs sharing the manifest (e.g. with other engines or phenopackets) are neither run nor counted."""
+    def __init__(self, path):
+        self.path = path
+        self.experiments = {}  # key -> latest record
+        self.counts = {state: 0 for state in STATES}
+        # the keys planned by this run (in order) and their counts per state, once plan() is called
+        self.run_keys = None
+        self.run_counts = None
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        partial_line = False
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    partial_line = not line.endswith("\n")
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self._apply(record)
+
+        self._file = open(path, "a")
+        if partial_line:
+            # start new records on their own line, rather than appending to the partially written one
+            self._file.write("\n")
+        # for the ETA, based on experiments finished by this process
+        self._started_at = time.monotonic()
+        self._finished_here = 0
+
+    def _apply(self, record):
+        previous = self.experiments.get(record["key"])
+        if previous is not None:
+            self.counts[previous["state"]] -= 1
+            if self.run_keys is not None and record["key"] in self.run_keys:
+                self.run_counts[previous["state"]] -= 1
+            record = {**previous, **record}
+        self.experiments[record["key"]] = record
+        self.counts[record["state"]] += 1
+        if self.run_keys is not None and record["key"] in self.run_keys:
+            self.run_counts[record["state"]] += 1
+
+    def _append(self, record):
+        record = {**record, "time": time.time()}
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._apply(record)
+
+    def plan(self, experiments):
+        """Adds experiments (dicts with an "output_file", used as the key) not yet in the manifest. Experiments whose output file
+        already exists (e.g. from runs before the manifest was kept) are recorded as done; this is the only filesystem check.
+        All the given experiments, new or not, become part of this run."""
+        if self.run_keys is None:
+            self.run_keys = {}
+            self.run_counts = {state: 0 for state in STATES}
+        for experiment in experiments:
+            key = experiment["output_file"]
+            if key in self.run_keys:
+                continue
+            self.run_keys[key] = None
+            if key in self.experiments:
+                self.run_counts[self.experiments[key]["state"]] += 1
+            else:
+                state = "done" if os.path.exists(key) else "planned"
+                self._append({"key": key, "state": state, **experiment})
+
+    def start(self, key):
+        self._append({"key": key, "state": "running"})
+
+    def finish(self, key, **info):
+        self._finished_here += 1
+        self._append({"key": key, "state": "done", **info})
+
+    def fail(self, key, error):
+        self._finished_here += 1
+        self._append({"key": key, "state": "failed", "error": error})
+
+    def pending(self, retry_failed = False):
+        """Experiments of this run to run: planned ones, and running ones (interrupted by a crash); with retry_failed, only the
+        failed ones. Before plan() is called, all experiments in the manifest are considered."""
+        states = ("failed",) if retry_failed else ("planned", "running")
+        records = self.experiments.values() if self.run_keys is None else (self.experiments[key] for key in self.run_keys)
+        return [record for record in records if record["state"] in states]
+
+    def progress(self):
+        """Counts per state of this run's experiments (all experiments, before plan() is called) and an ETA in seconds (None
+        until something finishes), from the rate of this process so far."""
+        counts = self.counts if self.run_keys is None else self.run_counts
+        total = len(self.experiments) if self.run_keys is None else len(self.run_keys)
+        remaining = counts["planned"] + counts["running"]
+        eta = None
+        if self._finished_here > 0:
+            rate = self._finished_here / (time.monotonic() - self._started_at)
+            eta = remaining / rate
+        return {"total": total, "remaining": remaining, "eta": eta, **counts}
+
+    def close(self):
+        self._file.close()
+
+
+def format_progress(progress):
+    done = progress["done"]
+    total = progress["total"]
+    percent = (done / total * 100) if total > 0 else 100
+    eta = ""
+    if progress["eta"] is not None:
+        minutes, seconds = divmod(int(progress["eta"]), 60)
+        eta = f", ETA {minutes // 60}:{minutes % 60:02d}:{seconds:02d}"
+    return f"{done} of {total} ({percent:.2f}%) done, {progress['failed']} failed{eta}"
@@ -0,0 +1,74 @@
+# Combines the results trees of sharded diagnose.py runs (see --shard) into one, reporting experiments that were run by more
+# than one shard and experiments that no shard has run:
+#   python merge_results.py results_shard0 results_shard1 ... --into results --phenopackets-dir phenopackets_all
+import os
+import sys
+import json
+import glob
+import shutil
+import filecmp
+import argparse
+
+from manifest import ExperimentManifest, plan_experiments, BASE_ENGINES, EVAL_ENGINES
+
+
+def find_results(results_dir):
+    """Result files in a results tree, keyed by their path relative to the tree (diagnoses/<file>/<base>/<eval>/<file>)."""
+    found = {}
+    for path in glob.glob(os.path.join(results_dir, "diagnoses", "*", "*", "*", "*.json")):
+        found[os.path.relpath(path, results_dir)] = path
+    return found
+
+
+def merge_results(sources, into, expected = None):
+    """Copies the result files of the source trees into the tree at into, and records them as done in its manifest. A result
+    found in more than one source is a duplicate: identical copies are merged silently, differing ones are reported as
+    conflicts and the first is kept. If expected (relative paths of planned experiments) is given, missing ones are reported.
+    Returns a report dict, also saved as merge_report.json in into."""
+    merged = {}
+    conflicts = []
+    for source in sources:
+        for relpath, path in find_results(source).items():
+            if relpath not in merged:
+                merged[relpath] = path
+            elif not filecmp.cmp(merged[relpath], path, shallow = False):
+                conflicts.append({"experiment": relpath, "kept": merged[relpath], "dropped": path})
+
+    manifest = ExperimentManifest(os.path.join(into, "manifest.jsonl"))
+    for relpath, path in merged.items():
+        output_file = os.path.join(into, relpath)
+        if os.path.abspath(path) != os.path.abspath(output_file):
+            os.makedirs(os.path.dirname(output_file), exist_ok = True)
+            shutil.copy2(path, output_file)
+        if manifest.experiments.get(output_file, {}).get("state") != "done":
+            manifest.finish(output_file, merged_from = path)
+    manifest.close()
+
+    missing = sorted(set(expected) - set(merged)) if expected is not None else []
+    report = {"merged": len(merged), "conflicts": conflicts, "missing": missing}
+    with open(os.path.join(into, "merge_report.json"), "w") as f:
+        json.dump(report, f, indent = 4)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Merge the results trees of sharded diagnose.py runs.")
+    parser.add_argument("sources", nargs = "+", help = "Results directories of the shards.")
+    parser.add_argument("--into", required = True, help = "Results directory to merge into (may be one of the sources).")
+    parser.add_argument("--phenopackets-dir", default = None, help = "If given, report experiments for these phenopackets that no shard has run.")
+    parser.add_argument("--base-engines", nargs = "+", default = BASE_ENGINES)
+    parser.add_argument("--eval-engines", nargs = "+", default = EVAL_ENGINES)
+    args = parser.parse_args()
+
+    expected = None
+    if args.phenopackets_dir is not None:
+        phenopackets_files = glob.glob(os.path.join(args.phenopackets_dir, "*.json"))
+        expected = [os.path.relpath(experiment["output_file"], "results")
+                    for experiment in plan_experiments(phenopackets_files, args.base_engines, args.eval_engines, "results")]
+
+    report = merge_results(args.sources, args.into, expected)
+    print(f"Merged {report['merged']} experiments into {args.into}; {len(report['conflicts'])} conflicting duplicates, {len(report['missing'])} missing (see merge_report.json).")
+    for conflict in report["conflicts"][:20]:
+        sys.stderr.write(f"CONFLICT {conflict['experiment']}: kept {conflict['kept']}, dropped {conflict['dropped']}\n")
+    for missing in report["missing"][:20]:
+        sys.stderr.write(f"MISSING {missing}\n")
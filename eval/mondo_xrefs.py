@@ -0,0 +1,101 @@
+# A local lookup table from phenopacket diagnosis IDs (e.g. OMIM:123456) to the MONDO diseases that list them as xrefs, so
+# diagnose.py and score.py don't need a graph query per phenopacket. Build (or extend) it once for the corpus with:
+#   python mondo_xrefs.py --phenopackets-dir phenopackets_all phenopackets
+import os
+import sys
+import json
+import glob
+import argparse
+
+
+MONDO_XREFS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "mondo_xrefs.json")
+
+# one scan of the disease nodes per batch of ids, rather than one per id
+_XREF_QUERY = """
+MATCH (d:`biolink:Disease`)
+WHERE d.xref IS NOT NULL
+UNWIND d.xref AS xref
+WITH d, xref
+WHERE xref IN $ids
+RETURN xref, d.id AS mondo_id, d.name AS disease_name
+"""
+
+
+def phenopacket_diagnosis(phenopacket):
+    """The diagnosis ID of a phenopacket (from its first interpretation), or None."""
+    if len(phenopacket.get("interpretations", [])) == 0:
+        return None
+    return phenopacket["interpretations"][0]["diagnosis"]["disease"]["id"]
+
+
+def corpus_diagnosis_ids(phenopackets_dirs):
+    ids = set()
+    for phenopackets_dir in phenopackets_dirs:
+        for phenopacket_file in glob.glob(os.path.join(phenopackets_dir, "*.json")):
+            with open(phenopacket_file, "r") as f:
+                diagnosis = phenopacket_diagnosis(json.load(f))
+            if diagnosis is not None:
+                ids.add(diagnosis)
+    return ids
+
+
+def resolve_xrefs(neo4j_driver, ids, batch_size = 1000):
+    """Looks up the MONDO diseases for each id, in batches; returns {id: [{"mondo_id", "disease_name"}, ...]}, with an
+    empty list for ids that no disease lists as an xref."""
+    ids = sorted(ids)
+    table = {xref: [] for xref in ids}
+    with neo4j_driver.session() as session:
+        for start in range(0, len(ids), batch_size):
+            for record in session.run(_XREF_QUERY, ids = ids[start:start + batch_size]):
+                table[record["xref"]].append({"mondo_id": record["mondo_id"], "disease_name": record["disease_name"]})
+    return table
+
+
+def load_xref_table(path = MONDO_XREFS_PATH, kg_release = None):
+    """Returns the saved lookup table, or an empty one if it hasn't been built. The table is only used if it was built for
+    kg_release (default: MONARCH_KG_RELEASE); if no release is given, it is used with a warning that it can't be checked."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        saved = json.load(f)
+
+    kg_release = kg_release or os.environ.get("MONARCH_KG_RELEASE")
+    table_release = saved.get("kg_release", "unversioned")
+    if kg_release is None:
+        sys.stderr.write(f"WARNING: MONARCH_KG_RELEASE is not set, so the MONDO xref table at {path} (built for KG release {table_release}) can't be checked against the KG.\n")
+    elif table_release != kg_release:
+        sys.stderr.write(f"WARNING: Ignoring the MONDO xref table at {path}: it was built for KG release {table_release}, not {kg_release}. Rebuild it with mondo_xrefs.py.\n")
+        return {}
+    return saved["xrefs"]
+
+
+def build_xref_table(neo4j_driver, phenopackets_dirs, path = MONDO_XREFS_PATH):
+    """Resolves the diagnosis IDs of all phenopackets in phenopackets_dirs that aren't in the saved table yet, and saves the
+    extended table. A table built for another KG release (see load_xref_table) is rebuilt from scratch."""
+    table = load_xref_table(path)
+    missing = corpus_diagnosis_ids(phenopackets_dirs) - set(table)
+    table.update(resolve_xrefs(neo4j_driver, missing))
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"kg_release": os.environ.get("MONARCH_KG_RELEASE", "unversioned"), "xrefs": table}, f, indent = 1, sort_keys = True)
+    os.replace(path + ".tmp", path)
+
+    print(f"Resolved {len(missing)} new diagnosis IDs; {sum(1 for v in table.values() if len(v) > 0)} of {len(table)} have a MONDO match. Saved to {path}.")
+    return table
+
+
+if __name__ == "__main__":
+    import dotenv
+    from neo4j import GraphDatabase
+    dotenv.load_dotenv(override=True)
+
+    parser = argparse.ArgumentParser(description = "Build the diagnosis ID -> MONDO lookup table for phenopacket corpora.")
+    parser.add_argument("--phenopackets-dir", nargs = "+", default = ["phenopackets_all", "phenopackets"])
+    parser.add_argument("--path", default = MONDO_XREFS_PATH)
+    args = parser.parse_args()
+
+    with GraphDatabase.driver(os.environ["NEO4J_URI"]) as neo4j_driver:
+        build_xref_table(neo4j_driver, args.phenopackets_dir, args.path)
@@ -0,0 +1,153 @@
+# Client-side rate limiting for eval runs, so concurrent experiments stay under each model's requests-per-minute (RPM) and
+# tokens-per-minute (TPM) limits instead of hammering the API into 429s.
+import asyncio
+import inspect
+import random
+import time
+
+from kani.engines.base import WrapperEngine
+
+
+# default per-model (requests per minute, tokens per minute) limits; override with --rpm / --tpm to match your API tier
+MODEL_RATE_LIMITS = {
+    "gpt-4.1-2025-04-14": (500, 30000),
+    "gpt-4o-2024-11-20": (500, 30000),
+}
+
+
+class TokenBucket:
+    """Allows up to per_minute units per minute, refilled continuously; acquire() waits until enough units are available."""
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.available = per_minute
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount = 1):
+        # requests larger than the whole bucket would never fit, so they wait for a full bucket instead
+        amount = min(amount, self.capacity)
+        # the lock keeps waiters in order, so large requests aren't starved by small ones
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+                await asyncio.sleep((amount - self.available) / self.rate)
+
+    def adjust(self, amount):
+        """Returns (positive) or charges (negative) units after the fact, e.g. when actual token usage differs from the estimate.
+        Charges can take the bucket below zero, delaying later requests."""
+        self._refill()
+        self.available = min(self.capacity, self.available + amount)
+
+
+class RateLimiter:
+    """Request and token buckets for one model; shared by all engines using that model (see get_rate_limiter)."""
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+
+    async def acquire(self, estimated_tokens):
+        if self.requests is not None:
+            await self.requests.acquire(1)
+        if self.tokens is not None:
+            await self.tokens.acquire(estimated_tokens)
+
+    def settle(self, estimated_tokens, actual_tokens):
+        if self.tokens is not None:
+            self.tokens.adjust(estimated_tokens - actual_tokens)
+
+
+_rate_limiters = {}
+
+
+def get_rate_limiter(model, rpm, tpm):
+    """Returns the shared RateLimiter for model, creating it with the given limits on first use."""
+    if model not in _rate_limiters:
+        _rate_limiters[model] = RateLimiter(rpm, tpm)
+    return _rate_limiters[model]
+
+
+def is_rate_limit_error(e):
+    # openai.RateLimitError (and other clients' equivalents) carry the HTTP status
+    return getattr(e, "status_code", None) == 429 or type(e).__name__ == "RateLimitError"
+
+
+def _retry_after(e):
+    """Seconds to wait according to the error's Retry-After header, if any."""
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimitedEngine(WrapperEngine):
+    """Wraps an engine so each request first waits on the model's rate limiter, with the prompt length plus
+    expected_completion_tokens as the token estimate (corrected with the actual usage afterwards). Rate limit errors that
+    still happen are retried up to max_retries times, waiting per the Retry-After header or with jittered exponential backoff."""
+    def __init__(self, engine, limiter, *args, expected_completion_tokens = 1000, max_retries = 6, base_delay = 2, max_delay = 60, **kwargs):
+        super().__init__(engine, *args, **kwargs)
+        self.limiter = limiter
+        self.expected_completion_tokens = expected_completion_tokens
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = {"requests": 0, "rate_limit_retries": 0}
+
+    async def _estimate_tokens(self, messages, functions):
+        prompt_tokens = self.engine.prompt_len(messages, functions)
+        if inspect.isawaitable(prompt_tokens):
+            prompt_tokens = await prompt_tokens
+        return prompt_tokens + self.expected_completion_tokens
+
+    async def _backoff(self, e, attempt):
+        delay = _retry_after(e)
+        if delay is None:
+            delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1)
+        self.stats["rate_limit_retries"] += 1
+        await asyncio.sleep(delay)
+
+    async def predict(self, messages, functions = None, **hyperparams):
+        estimated_tokens = await self._estimate_tokens(messages, functions)
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(estimated_tokens)
+            self.stats["requests"] += 1
+            try:
+                completion = await self.engine.predict(messages, functions, **hyperparams)
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self.max_retries:
+                    raise
+                await self._backoff(e, attempt)
+                continue
+
+            if completion.prompt_tokens is not None and completion.completion_tokens is not None:
+                self.limiter.settle(estimated_tokens, completion.prompt_tokens + completion.completion_tokens)
+            return completion
+
+    async def stream(self, messages, functions = None, **hyperparams):
+        estimated_tokens = await self._estimate_tokens(messages, functions)
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(estimated_tokens)
+            self.stats["requests"] += 1
+            started = False
+            try:
+                async for elem in self.engine.stream(messages, functions, **hyperparams):
+                    started = True
+                    yield elem
+                return
+            except Exception as e:
+                # once output has been passed on, the request can't be transparently retried
+                if started or not is_rate_limit_error(e) or attempt == self.max_retries:
+                    raise
+                await self._backoff(e, attempt)
@@ -3,7 +3,8 @@ import os
 import dotenv # pip install python-dotenv
 import json
 import glob
-import isodate
+import asyncio
+import argparse
 from neo4j import GraphDatabase
 import sys
 import pandas as pd
@@ -21,10 +22,30 @@ from kani import AIParam, ai_function, ChatMessage, ChatRole
 import dotenv
 dotenv.load_dotenv(override=True) 
 
-from kani_utils.utils import full_round_sync
-
 from kani_utils.base_kanis import EnhancedKani
 
+from mondo_xrefs import load_xref_table
+from rate_limiting import RateLimitedEngine, get_rate_limiter, MODEL_RATE_LIMITS
+
+
+def score_candidates(candidates, correct_diagnosis):
+    """Scores an ordered list of candidate MONDO IDs against the correct diagnosis."""
+    # top_1_score is 1 if the first candidate is the correct diagnosis, 0 otherwise
+    top_1_score = 1 if (len(candidates) > 0 and candidates[0] == correct_diagnosis) else 0
+    # top_3_score is 1 if the correct diagnosis is in the top 3 candidates, 0 otherwise
+    top_3_score = 1 if (correct_diagnosis in candidates[:3]) else 0
+    # top_10_score is 1 if the correct diagnosis is in the top 10 candidates, 0 otherwise
+    top_10_score = 1 if (correct_diagnosis in candidates[:10]) else 0
+
+    res = {
+        "candidates": candidates,
+        "top_1_score": top_1_score,
+        "top_3_score": top_3_score,
+        "top_10_score": top_10_score,
+    }
+
+    return res
+
 
 class ScoringAgent(EnhancedKani):
     """Agent for scoring results in the results/ directory. To be used once."""
@@ -66,19 +87,7 @@ Call: process_candidates([])  # No candidates to extract
         if not all(isinstance(c, str) and c.startswith("MONDO:") and c[6:].isdigit() for c in candidates):
             raise ValueError("All candidates must be valid MONDO IDs in the format 'MONDO:1234567'. Please try again, and if no MONDO IDs are identified as candidates, call this function with an empty list.")
 
-        # top_1_score is 1 if the first candidate is the correct diagnosis, 0 otherwise
-        top_1_score = 1 if (len(candidates) > 0 and candidates[0] == self.correct_diagnosis) else 0
-        # top_3_score is 1 if the correct diagnosis is in the top 3 candidates, 0 otherwise
-        top_3_score = 1 if (self.correct_diagnosis in candidates[:3]) else 0
-        # top_10_score is 1 if the correct diagnosis is in the top 10 candidates, 0 otherwise
-        top_10_score = 1 if (self.correct_diagnosis in candidates[:10]) else 0
-
-        res = {
-            "candidates": candidates,
-            "top_1_score": top_1_score,
-            "top_3_score": top_3_score,
-            "top_10_score": top_10_score,
-        }
+        res = score_candidates(candidates, self.correct_diagnosis)
 
         self.score = res
         return res
@@ -97,68 +106,123 @@ def gen_score_row(file, score_dict, expected_diagnosis):
         "eval_agent": file.split(os.sep)[-2],  # extract eval agent name from file path
     }
 
+SCORING_MODEL = "gpt-4o-2024-11-20"
+
+
+def make_scoring_engine(model = SCORING_MODEL, rpm = None, tpm = None):
+    """One rate-limited OpenAIEngine, and so one HTTP client, shared by all scoring agents."""
+    default_rpm, default_tpm = MODEL_RATE_LIMITS.get(model, (None, None))
+    engine = OpenAIEngine(os.environ["OPENAI_API_KEY"], model=model, temperature=0.0, max_tokens=16000)
+    return RateLimitedEngine(engine, get_rate_limiter(model, rpm or default_rpm, tpm or default_tpm))
+
+
+def load_results_to_score(results_file, xref_table):
+    """Loads a results file, returning (results, expected MONDO ID), or None (with a warning) if it can't be scored."""
+    with open(results_file, "r") as f:
+        results = json.load(f)
+
+    if results.get("expected_diagnosis") in xref_table:
+        results["expected_diagnosis_mondo"] = xref_table[results["expected_diagnosis"]]
+
+    # if a correct diagnosis exists, if will be at results["expected_diagnosis_mondo"][0]["mondo_id"]
+    # if it isn't there, is the wrong format, OR if there is more than one, we skip the file and log a big warning to stderr
+    if "expected_diagnosis_mondo" not in results or len(results["expected_diagnosis_mondo"]) != 1:
+        sys.stderr.write(f"WARNING: Skipping {results_file}, REASON: expected_diagnosis_mondo is missing or has more than one entry.\n")
+        return None
+
+    expected_diagnosis = results["expected_diagnosis_mondo"][0]["mondo_id"]
+
+    if not expected_diagnosis.startswith("MONDO:") or not expected_diagnosis[6:].isdigit():
+        sys.stderr.write(f"WARNING: Skipping {results_file}, REASON: expected_diagnosis_mondo is not a valid MONDO ID: {expected_diagnosis}\n")
+        return None
+
+    return results, expected_diagnosis
+
+
+def save_results(results_file, results):
+    """Saves results via a temporary file, so an interrupted write never leaves a broken file."""
+    with open(results_file + ".tmp", "w") as f:
+        json.dump(results, f, indent=4)
+    os.replace(results_file + ".tmp", results_file)
+
+
+async def score_results_file(results_file, engine, xref_table):
+    """Scores one results file in place (unless it already has a score); returns its score row, or None if it was skipped."""
+    loaded = await asyncio.to_thread(load_results_to_score, results_file, xref_table)
+    if loaded is None:
+        return None
+    results, expected_diagnosis = loaded
+
+    if "score" in results:
+        print(f"Skipping already score {results_file}.")
+        # the expected diagnosis may have been re-resolved since the file was scored, so the top-N scores are recomputed from
+        # the saved candidates (and saved if they changed); we still need to return the score row, so we can later save it to a CSV
+        score = score_candidates(results["score"]["candidates"], expected_diagnosis)
+        if score != results["score"]:
+            results["score"] = score
+            await asyncio.to_thread(save_results, results_file, results)
+        return gen_score_row(results_file, score, expected_diagnosis)
+
+    # the answer we want to score is in the last message of the results
+    if len(results["messages"]) == 0 or results["messages"][-1]["role"] != "assistant":
+        sys.stderr.write(f"WARNING: Skipping {results_file}, REASON: last message is not from the assistant or there are no messages.\n")
+        return None
+
+    answer_text = results["messages"][-1]["content"]
+
+    # calculate the score; agents are cheap, and each needs its own chat history and correct diagnosis, but they share the engine
+    agent = ScoringAgent(engine=engine, correct_diagnosis = expected_diagnosis)
+    async for _ in agent.full_round("Please process candidate diagnoses from the following answer:\n\n" + answer_text):
+        pass
+
+    # the score is in the agent's score attribute (and the last message of the result)
+    score = agent.score
+    if score is None:
+        sys.stderr.write(f"WARNING: Skipping {results_file}, REASON: the scoring agent did not submit candidates.\n")
+        return None
+
+    # add the score to the results, and save them
+    results["score"] = score
+    await asyncio.to_thread(save_results, results_file, results)
+
+    scores_str = f"t1: {score['top_1_score']}, t3: {score['top_3_score']}, t10: {score['top_10_score']}"
+    print(f"Score: {scores_str}\t{results_file}")
+    return gen_score_row(results_file, score, expected_diagnosis)
+
+
 # we're going to modify-in-place the .json files in the results/ directory, which will be in deeper subdirectories
-def add_scores_to_results():
-    """Add scores to the results in the eval/results/diagnoses directory and subdirectories. We only want files, not directories (even if they have a .json extension)."""
-    results_files = glob.glob("eval/results/diagnoses/**/*.json", recursive=True)
+async def add_scores_to_results(results_dir = "eval/results", engine = None, concurrency = 8):
+    """Add scores to the results in the <results_dir>/diagnoses directory and subdirectories, at most concurrency files at a
+    time, with one engine shared by all (by default make_scoring_engine(); pass e.g. a stub engine for testing). We only want
+    files, not directories (even if they have a .json extension). Files that fail to score are reported and left unscored."""
+    results_files = glob.glob(os.path.join(results_dir, "diagnoses", "**", "*.json"), recursive=True)
     results_files = [f for f in results_files if os.path.isfile(f)]
-    results_rows = []
+    engine = engine or make_scoring_engine()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    # expected diagnoses are resolved from the lookup table built by mondo_xrefs.py where possible, falling back to the
+    # resolution saved in each result file (so re-resolving after a KG update doesn't require rerunning experiments)
+    xref_table = load_xref_table()
 
     total_files = len(results_files)
     num_processed = 0
-    
-    for results_file in results_files:
+
+    async def score(results_file):
+        nonlocal num_processed
+        async with semaphore:
+            try:
+                row = await score_results_file(results_file, engine, xref_table)
+            except Exception as e:
+                sys.stderr.write(f"FAILED {results_file}: {type(e).__name__}: {e}\n")
+                row = None
         num_processed += 1
+        if num_processed % 100 == 0 or num_processed == total_files:
+            print(f"Processed {num_processed}/{total_files} ({num_processed / total_files * 100:.2f}%).")
+        return row
+
+    # rows are gathered in file order, whatever order the files finish in
+    results_rows = [row for row in await asyncio.gather(*[score(f) for f in results_files]) if row is not None]
 
-        with open(results_file, "r") as f:
-            results = json.load(f)
-
-        # if a correct diagnosis exists, if will be at results["expected_diagnosis_mondo"][0]["mondo_id"]
-        # if it isn't there, is the wrong format, OR if there is more than one, we skip the file and log a big warning to stderr
-        if "expected_diagnosis_mondo" not in results or len(results["expected_diagnosis_mondo"]) != 1:
-            sys.stderr.write(f"WARNING: Skipping {results_file}, REASON: expected_diagnosis_mondo is missing or has more than one entry.\n")
-            continue
-
-        expected_diagnosis = results["expected_diagnosis_mondo"][0]["mondo_id"]
-        
-        if not expected_diagnosis.startswith("MONDO:") or not expected_diagnosis[6:].isdigit():
-            sys.stderr.write(f"WARNING: Skipping {results_file}, REASON: expected_diagnosis_mondo is not a valid MONDO ID: {expected_diagnosis}\n")
-            continue
-
-        if "score" in results:
-            print(f"Skipping already score {results_file}.")
-            # we still need to save the score to the results_rows, so we can later save it to a CSV
-            scores_str = f"t1: {results['score']['top_1_score']}, t3: {results['score']['top_3_score']}, t10: {results['score']['top_10_score']}"
-            results_rows.append(gen_score_row(results_file, results["score"], expected_diagnosis))
-            continue  # skip files that already have a score
-
-        # the answer we want to score is in the last message of the results
-        if len(results["messages"]) == 0 or results["messages"][-1]["role"] != "assistant":
-            sys.stderr.write(f"WARNING: Skipping {results_file}, REASON: last message is not from the assistant or there are no messages.\n")
-            continue
-
-        answer_text = results["messages"][-1]["content"]
-
-        # calculate the score
-        engine4 = OpenAIEngine(os.environ["OPENAI_API_KEY"], model="gpt-4o-2024-11-20", temperature=0.0, max_tokens=16000)
-        agent = ScoringAgent(engine=engine4, correct_diagnosis = expected_diagnosis)
-        result = full_round_sync(agent, "Please process candidate diagnoses from the following answer:\n\n" + answer_text)
-
-        # the score is in the agent's score attribute (and the last message of the result)
-        score = agent.score
-        
-        # add the score to the results
-        results["score"] = score
-        
-        # save the updated results
-        with open(results_file, "w") as f:
-            json.dump(results, f, indent=4)
-        
-        scores_str = f"t1: {score['top_1_score']}, t3: {score['top_3_score']}, t10: {score['top_10_score']}"
-        print(f"Score: {scores_str}\tProcessed {num_processed}/{total_files}: {results_file} ({num_processed / total_files * 100:.2f}%).")
-
-        results_rows.append(gen_score_row(results_file, score, expected_diagnosis))
-    
     print(f"Scores added to {len(results_files)} files.")
     # conver to pandas DataFrame and return
     df = pd.DataFrame(results_rows)
@@ -166,11 +230,21 @@ def add_scores_to_results():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Score diagnosis results in place, and summarize the scores.")
+    parser.add_argument("--results-dir", default = "eval/results")
+    parser.add_argument("--concurrency", type = int, default = int(os.environ.get("EVAL_CONCURRENCY", 8)), help = "Files to score at once.")
+    parser.add_argument("--model", default = SCORING_MODEL)
+    parser.add_argument("--rpm", type = int, default = None, help = "Requests per minute (default: MODEL_RATE_LIMITS).")
+    parser.add_argument("--tpm", type = int, default = None, help = "Tokens per minute (default: MODEL_RATE_LIMITS).")
+    args = parser.parse_args()
+
     # run the scoring on the results/ directory
-    df = add_scores_to_results()
-    # save the results to eval/results/scores.csv
+    engine = make_scoring_engine(args.model, args.rpm, args.tpm)
+    df = asyncio.run(add_scores_to_results(args.results_dir, engine, args.concurrency))
+    print(f"Engine stats: {engine.stats}")
+    # save the results to <results_dir>/scores.csv
 
-    output_file = "eval/results/scores.csv"
+    output_file = os.path.join(args.results_dir, "scores.csv")
     df.to_csv(output_file, index=False)
 
     # make a quick faceted histogram of the scores, broken down by base agent, eval agent, and top N score
@@ -206,7 +280,7 @@ if __name__ == "__main__":
     plt.ylim(0, 1)  # Since your scores are in [0,1]; multiply by 100 if you want percentage
     plt.legend(title='Model')
     plt.tight_layout()
-    plt.savefig("eval/results/scores_plot.png")
+    plt.savefig(os.path.join(args.results_dir, "scores_plot.png"))
 
 
     print("Scoring completed.")
\ No newline at end of file
@@ -4,13 +4,21 @@ from kani_utils.base_kanis import StreamlitKani
 import streamlit as st
 from kani.exceptions import WrappedCallException
 import asyncio
-from phenomics_explorer.neo4j_utils import _parse_neo4j_result
+from phenomics_explorer.neo4j_utils import _parse_neo4j_result, ResultTooLargeError, summarize_plan, add_limit, get_schema_snapshot, neo4j_drivers
 from phenomics_explorer.monarch_utils import fix_biolink_labels
+from phenomics_explorer.cache_utils import make_cache_key
+from phenomics_explorer.serialization_utils import as_envelope
 import yaml
-from phenomics_explorer.neo4j_utils import summarize_structure
 import json
-from neo4j import AsyncGraphDatabase
+from neo4j import Query
+from neo4j.exceptions import Neo4jError
 import os
+import uuid
+import logging
+
+
+logger = logging.getLogger(__name__)
+
 
 class BaseKGAgent(StreamlitKani):
     """Agent for interacting with the Monarch knowledge graph; extends KGAgent with keyword search (using Monarch API) system prompt with cypher examples."""
@@ -18,6 +26,15 @@ class BaseKGAgent(StreamlitKani):
                  *args,
                  eval_agent = None,
                  max_response_tokens = 30000,
+                 query_timeout = 6,
+                 timeout_mode = "server",
+                 timeout_grace = 2,
+                 tool_timeouts = None,
+                 fetch_budget_factor = 3,
+                 explain_guard = "reject",
+                 max_estimated_rows = 1000000,
+                 auto_limit = 1000,
+                 schema_refresh_interval = 3600,
                  **kwargs):
 
         kwargs['system_prompt'] = kwargs.get(
@@ -36,9 +53,44 @@ class BaseKGAgent(StreamlitKani):
         
         self.eval_agent = eval_agent
         self.max_response_tokens = max_response_tokens
-
+        # records are streamed from the database until their estimated size passes max_response_tokens * fetch_budget_factor
+        # (raw records carry properties that are later dropped, so the raw budget is more generous than the final token check)
+        self.fetch_budget_factor = fetch_budget_factor
+
+        # timeout_mode "server" sets the timeout on the transaction itself, so neo4j kills runaway queries;
+        # the client still waits timeout + timeout_grace seconds as a backstop, and explicitly terminates the
+        # transaction if the server hasn't stopped it by then. "client" only stops waiting on the client side.
+        if timeout_mode not in ("server", "client"):
+            raise ValueError(f"Unknown timeout_mode: {timeout_mode}. Expected 'server' or 'client'.")
+        self.query_timeout = query_timeout
+        self.timeout_mode = timeout_mode
+        self.timeout_grace = timeout_grace
+        # per-tool overrides of query_timeout, e.g. {"run_query": 10, "get_entity_types": 20}
+        # (loading the schema snapshot runs a count query per label and relationship type, so it gets more time by default)
+        self.tool_timeouts = {"schema_refresh": 30, **(tool_timeouts or {})}
+
+        # queries from run_query are EXPLAINed before running; explain_guard "reject" rejects queries with risky plans
+        # (cartesian products, or unbounded variable-length paths from unbound nodes or over max_estimated_rows, see
+        # neo4j_utils.summarize_plan) or more than max_estimated_rows estimated rows, "limit" instead adds LIMIT auto_limit
+        # to queries that are only too large, None disables the check
+        if explain_guard not in ("reject", "limit", None):
+            raise ValueError(f"Unknown explain_guard: {explain_guard}. Expected 'reject', 'limit' or None.")
+        self.explain_guard = explain_guard
+        self.max_estimated_rows = max_estimated_rows
+        self.auto_limit = auto_limit
+
+        # counters for query execution, reported with eval results
+        self.query_stats = {"queries": 0, "client_timeouts": 0, "server_timeouts": 0, "server_terminations": 0,
+                            "explain_rejections": 0, "auto_limits": 0, "duplicate_rejections": 0, "termination_failures": 0}
+
+        # queries (with parameters) rejected by the evaluator since the last user message; resubmitting one is rejected immediately
+        self.rejected_queries = {}
+
+        # the driver (and its connection pool) is shared with other agents, see neo4j_utils.DriverRegistry
         self.neo4j_uri = os.environ["NEO4J_URI"]  # default bolt protocol port
-        self.neo4j_driver = AsyncGraphDatabase.driver(self.neo4j_uri)
+
+        # labels, relationship types etc. are loaded once and shared by all agents for the same database
+        self.schema = get_schema_snapshot(self.neo4j_uri, refresh_interval = schema_refresh_interval)
 
         super().__init__(*args, **kwargs)
         
@@ -71,6 +123,12 @@ class BaseKGAgent(StreamlitKani):
     # we override this so that we can clear the status box after each user-entered message;
     # this also clears the eval chain; if we're not running interactively, we don't clear this out for later evaluation
     async def add_to_history(self, message, *args, **kwargs):
+        # evaluations depend on the user question, so previous verdicts don't carry over to a new one
+        if message.role == ChatRole.USER:
+            self.rejected_queries = {}
+            if self.eval_agent is not None:
+                self.eval_agent.clear_verdict_cache()
+
         if self.interactive:
             if message.role == ChatRole.USER:
                 self._clear_status()
@@ -167,40 +225,149 @@ class BaseKGAgent(StreamlitKani):
     #### Query execution
     #######################
 
+    def _tool_timeout(self, tool_name):
+        """Returns the query timeout (in seconds) for the given tool, falling back to the agent-wide query_timeout."""
+        return self.tool_timeouts.get(tool_name, self.query_timeout)
+
+    @property
+    def neo4j_driver(self):
+        """The shared driver for this agent's database, borrowed from the process-wide registry."""
+        return neo4j_drivers.get_driver(self.neo4j_uri)
+
+    def _session(self):
+        """Borrows a session from the shared driver for this agent's database."""
+        return neo4j_drivers.session(self.neo4j_uri)
+
+    async def get_schema(self):
+        """Returns the shared schema snapshot, loading it on first use and refreshing it periodically."""
+        await asyncio.wait_for(self.schema.ensure_loaded(self.neo4j_driver), timeout = self._tool_timeout("schema_refresh"))
+        return self.schema
+
+    def _fetch_budget_chars(self):
+        """Size budget (in characters of serialized records) for streaming a query result, roughly 4 characters per token."""
+        return self.max_response_tokens * 4 * self.fetch_budget_factor
+
+    def _cached_result(self, query, parameters = None):
+        """Returns the cached result of a query, or None if it isn't cached. run_query checks this before the query plan, so
+        agents that cache results in _call_neo4j should override it; the base agent doesn't cache."""
+        return None
+
     # this sync/async stuff to get the timeout working, along with the return type from neo4j is some dark magic stuff
-    async def _call_neo4j(self, query, parameters = None, timeout = 6):
+    async def _call_neo4j(self, query, parameters = None, timeout = None, max_chars = None):
         self._status("Running query...")
+        if timeout is None:
+            timeout = self.query_timeout
+
+        self.query_stats["queries"] += 1
+
+        # tag the transaction so we can find it again (SHOW TRANSACTIONS) if it needs to be terminated
+        query_id = uuid.uuid4().hex
+        if self.timeout_mode == "server":
+            tx_query = Query(query, metadata = {"phenomics_query_id": query_id}, timeout = timeout)
+            client_timeout = timeout + self.timeout_grace
+        else:
+            tx_query = query
+            client_timeout = timeout
 
         async def internal_run_query():
-            async with self.neo4j_driver.session() as session:
-                # apparently both of these need to be awaited?
-                raw_result1 = await session.run(query, parameters = parameters)
-                result_graph = await _parse_neo4j_result(raw_result1, expected_type = "graph")
-                # if there aren't any nodes, we need to compute the table result
-                if len(result_graph['data']['nodes']) == 0:
-                    raw_result2 = await session.run(query)
-                    result_table = await _parse_neo4j_result(raw_result2, expected_type = "table")
-                # if there *are* nodes, the table view should be empty
-                else:
-                    result_table = {"type": "table", "data": []}
-
-            return {"result_as_graph": result_graph, "result_as_table": result_table}
+            async with self._session() as session:
+                # the query is run once; both the graph and table views are built from the same records
+                raw_result = await session.run(tx_query, parameters = parameters)
+                result_dict = await _parse_neo4j_result(raw_result, max_chars = max_chars)
+
+            return result_dict
         
         try:
-            result_dict = await asyncio.wait_for(internal_run_query(), timeout=timeout)
+            result_dict = await asyncio.wait_for(internal_run_query(), timeout=client_timeout)
         except asyncio.TimeoutError:
-            self._status("Query timed out.")
+            self.query_stats["client_timeouts"] += 1
+            if self.timeout_mode == "server":
+                # the server didn't stop the transaction on its own, make sure it doesn't keep running
+                await self._terminate_query(query_id)
+            self._raise_timeout(query, timeout)
+        except Neo4jError as e:
+            if not _is_server_timeout(e):
+                raise
+            self.query_stats["server_timeouts"] += 1
+            self._raise_timeout(query, timeout)
+
+        return result_dict
+
+    async def _explain_neo4j(self, query, parameters = None, timeout = None):
+        """Runs EXPLAIN on a query (planning it without executing it) and returns a summary of the plan, see summarize_plan()."""
+        if timeout is None:
+            timeout = self.query_timeout
+
+        async def internal_explain():
+            async with self._session() as session:
+                result = await session.run("EXPLAIN " + query, parameters = parameters)
+                summary = await result.consume()
+            return summarize_plan(summary.plan, self.max_estimated_rows)
+
+        return await asyncio.wait_for(internal_explain(), timeout=timeout)
+
+    async def _terminate_query(self, query_id, timeout = 5):
+        """Terminates any server-side transactions tagged with the given query id. This is best-effort cleanup: failures are
+        logged and counted in query_stats, but not raised."""
+        async def internal_terminate():
+            async with self._session() as session:
+                result = await session.run("SHOW TRANSACTIONS YIELD transactionId, metaData "
+                                           "WHERE metaData.phenomics_query_id = $query_id "
+                                           "RETURN transactionId", query_id = query_id)
+                tx_ids = await result.value("transactionId")
+                if len(tx_ids) > 0:
+                    result = await session.run("TERMINATE TRANSACTIONS $tx_ids", tx_ids = tx_ids)
+                    await result.consume()
+                return len(tx_ids)
+
+        try:
+            num_terminated = await asyncio.wait_for(internal_terminate(), timeout=timeout)
+            self.query_stats["server_terminations"] += num_terminated
+        except (asyncio.TimeoutError, Neo4jError) as e:
+            self.query_stats["termination_failures"] += 1
+            logger.warning("Could not terminate timed out query %s: %s", query_id, e)
+
+    def _raise_timeout(self, query, timeout):
+        self._status("Query timed out.")
+        report = {
+            "query": fix_biolink_labels(query),
+            "accept_query": False,
+            "suggestion": f"The query took longer than the alloted time of {timeout} seconds and was terminated."
+            }
+         
+        self.eval_chain.append(report)
+        raise WrappedCallException(retry = True, original = ValueError("The query timed out. Try again, reducing query computation."))
+    
+    async def _check_query_plan(self, query, parameters = None):
+        """Pre-flight check of a query's plan via EXPLAIN, which doesn't spend DB time executing it. Risky queries are rejected through
+        the usual retryable WrappedCallException; returns the query to run, which may have a LIMIT added if explain_guard is "limit"."""
+        self._status("Checking query plan...")
+        plan = await self._explain_neo4j(query, parameters = parameters, timeout = self._tool_timeout("run_query"))
+
+        if plan['too_many_rows'] and len(plan['risks']) == 0 and self.explain_guard == "limit":
+            limited_query = add_limit(query, self.auto_limit)
+            if limited_query != query:
+                self.query_stats["auto_limits"] += 1
+            return limited_query
+
+        if plan['too_many_rows'] or len(plan['risks']) > 0:
+            self.query_stats["explain_rejections"] += 1
+            risks = list(plan['risks'])
+            if plan['too_many_rows']:
+                risks.append(f"The planner estimates {plan['estimated_rows']:.0f} result rows, more than the maximum allowable of {self.max_estimated_rows}.")
+            error_message = ("The query was rejected before running, based on its query plan:\n\n" + "\n".join(f"- {r}" for r in risks) +
+                             "\n\nPlease revise the query (e.g. bound variable-length paths, connect all MATCH patterns, or add a LIMIT) and try again.")
+            self._status("Query plan rejected.")
             report = {
                 "query": fix_biolink_labels(query),
                 "accept_query": False,
-                "suggestion": f"The query took longer than the alloted time of f{timeout} seconds and was terminated."
+                "suggestion": error_message
                 }
-             
             self.eval_chain.append(report)
-            raise WrappedCallException(retry = True, original = ValueError("The query timed out. Try again, reducing query computation."))
+            raise WrappedCallException(retry = True, original = ValueError(error_message))
+
+        return query
 
-        return result_dict
-    
     @ai_function(after = ChatRole.ASSISTANT)
     async def run_query(self, 
                         query: Annotated[str, AIParam(desc="""Cypher query to evaluate.""")],
@@ -209,8 +376,46 @@ class BaseKGAgent(StreamlitKani):
 
         self._status("Running query...")
         display_query = fix_biolink_labels(query)
+        auto_limited = False
+
+        rejection_key = make_cache_key(display_query, parameters)
+        if rejection_key in self.rejected_queries:
+            self.query_stats["duplicate_rejections"] += 1
+            self._status("Query was already rejected.")
+            error_message = "This query is identical to one that already did not pass evaluation; please revise it based on the previous evaluation:\n\n" + yaml.dump(self.rejected_queries[rejection_key])
+            report = {
+                "query": display_query,
+                "accept_query": False,
+                "suggestion": error_message
+                }
+            self.eval_chain.append(report)
+            raise WrappedCallException(retry = True, original = ValueError(error_message))
+
         try:
-            neo4j_result = await self._call_neo4j(query, parameters = parameters)
+            # cached results already ran (and passed the plan check), so they skip the database entirely
+            neo4j_result = self._cached_result(query, parameters = parameters)
+            if neo4j_result is None and self.explain_guard is not None:
+                checked_query = await self._check_query_plan(query, parameters = parameters)
+                if checked_query != query:
+                    auto_limited = True
+                    query = checked_query
+                    display_query = fix_biolink_labels(query)
+                    neo4j_result = self._cached_result(query, parameters = parameters)
+
+            if neo4j_result is None:
+                neo4j_result = await self._call_neo4j(query, parameters = parameters, timeout = self._tool_timeout("run_query"), max_chars = self._fetch_budget_chars())
+        except ResultTooLargeError as e:
+            self._status("Query result too large.")
+            error_message = f"The query result was too large: {e.num_rows}+ rows were returned before exceeding the maximum allowable of {self.max_response_tokens} tokens. Please try a smaller search."
+            report = {
+                "query": display_query,
+                "accept_query": False,
+                "suggestion": error_message
+                }
+            self.eval_chain.append(report)
+            raise WrappedCallException(retry = True, original = ValueError(error_message))
+        except WrappedCallException:
+            raise
         except Exception as e:
             self._status("Query failed.")
             report = {
@@ -221,10 +426,23 @@ class BaseKGAgent(StreamlitKani):
             self.eval_chain.append(report)
             raise WrappedCallException(retry = True, original = e)
 
+        if auto_limited:
+            # results may be shared through a cache, so we add the note to a copy
+            neo4j_result = {**neo4j_result, "note": f"The query planner estimated a large result, so the query was automatically limited to {self.auto_limit} rows: {display_query}"}
+
+        # the result is serialized once, and the text reused for the evaluator, the token count and the return value
+        neo4j_result = as_envelope(neo4j_result)
+
         if self.eval_agent is not None:
             self._status("Evaluating query and result...")
-            result_summary = summarize_structure(neo4j_result)
-            eval_result = self.eval_agent.evaluate_query(query, result_summary, self.chat_history)
+            result_summary = neo4j_result.summary
+            try:
+                schema = await self.get_schema()
+            except Exception as e:
+                # the evaluator can work without the schema, it just skips the label checks
+                logger.warning("Could not load schema snapshot for evaluation: %s", e)
+                schema = None
+            eval_result = await self.eval_agent.evaluate_query_async(query, result_summary, self.chat_history, schema = schema)
 
             report = {
                 "query": display_query,
@@ -233,10 +451,11 @@ class BaseKGAgent(StreamlitKani):
             self.eval_chain.append(report)
 
             if not eval_result['accept_query']:
+                self.rejected_queries[rejection_key] = eval_result
                 self._status("Query did not pass evaluation.")
                 raise WrappedCallException(retry = True, original = ValueError("The query did not pass evaluation; please review the suggestions and try again. Evaluation:\n\n" + yaml.dump(eval_result)))
 
-        tokens = self.message_token_len(ChatMessage.user(json.dumps(neo4j_result)))
+        tokens = neo4j_result.token_len(lambda text: self.message_token_len(ChatMessage.user(text)), key = getattr(self.engine, "model", None))
         if tokens > self.max_response_tokens:
             error_message = f"The search result contained {tokens} tokens, greater than the maximum allowable of {self.max_response_tokens}. Please try a smaller search."
             report = {
@@ -248,4 +467,11 @@ class BaseKGAgent(StreamlitKani):
             raise WrappedCallException(retry = True, original = ValueError(error_message))
         else:
             self._status("Generating Answer...")
-            return neo4j_result    
+            # returned as text, so kani passes it on as-is rather than serializing the result again
+            return neo4j_result.text
+
+
+def _is_server_timeout(e):
+    """Whether a neo4j error indicates the server stopped the transaction for running past its timeout."""
+    code = e.code or ""
+    return "TransactionTimedOut" in code or code == "Neo.TransientError.Transaction.Terminated"
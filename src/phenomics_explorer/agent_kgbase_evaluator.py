@@ -2,6 +2,11 @@ from typing_extensions import Annotated
 from typing import Optional
 from kani import AIParam, ai_function, ChatMessage, ChatRole
 from phenomics_explorer.utils import messages_dump
+from phenomics_explorer.lint_utils import lint_query
+from phenomics_explorer.cache_utils import normalize_query
+from phenomics_explorer.serialization_utils import as_envelope
+from collections import OrderedDict
+import hashlib
 import json
 import yaml
 from kani_utils.base_kanis import StreamlitKani
@@ -9,7 +14,7 @@ from kani_utils.utils import full_round_sync
 
 class EvaluatorAgent(StreamlitKani):
     """Agent for interacting with the Monarch knowledge graph; extends KGAgent with keyword search (using Monarch API) system prompt with cypher examples."""
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, lint = True, verdict_cache_size = 256, **kwargs):
 
         # this needs to stay as an instance variable so that the UI can edit it
         self.eval_message_template = """\
@@ -55,6 +60,19 @@ You are the Phenomics Evaluator, designed to evaluate cypher queries against the
 
         super().__init__(*args, **kwargs)
 
+        # clear-cut cases are decided by fast local checks (see lint_utils), only ambiguous ones go to the LLM
+        self.lint = lint
+
+        # LLM verdicts keyed on the normalized query and a hash of the (summarized) result, so resubmissions of the same query
+        # (modulo whitespace) get the same verdict without another evaluator round; cleared with clear_verdict_cache()
+        self.verdict_cache = OrderedDict()
+        self.verdict_cache_size = verdict_cache_size
+
+        # serialized context messages by their position in the history, see _serialize_history_message()
+        self._history_cache = {}
+
+        self.eval_stats = {"lint_rejected": 0, "lint_accepted": 0, "llm_evaluations": 0, "cached_verdicts": 0}
+
 
 
     @ai_function(after = ChatRole.USER)
@@ -81,20 +99,103 @@ You are the Phenomics Evaluator, designed to evaluate cypher queries against the
     def evaluate_query(self,
                        query: Annotated[str, AIParam(desc="The cypher query to evaluate.")], 
                        result_dict: Annotated[dict, AIParam(desc="The result of the cypher query, in dictionary format.")], 
-                       context_history: Optional[Annotated[list[ChatMessage], AIParam(desc="The chat history, which is a list of ChatMessage objects. This is used to provide context for the evaluation.")]] = None):
+                       context_history: Optional[Annotated[list[ChatMessage], AIParam(desc="The chat history, which is a list of ChatMessage objects. This is used to provide context for the evaluation.")]] = None,
+                       schema = None):
         """Evaluate a query in the context of its result and the context history (the agent's .history) using the evaluator agent. This can be called externally (it is not available for the agent to call), which will trigger this agent to evaluate """
 
-        
+        evaluation = self._evaluation(query, result_dict, context_history, schema)
+        try:
+            prompt = next(evaluation)
+            # this method is called externally but belongs to to the agent, which chats with itself
+            # to trigger running report_evaluation() with structured input enforced; the last
+            # message will be the result of the function call for extraction
+            # (this is how pydandic.ai implements structured tool output interally: https://ai.pydantic.dev/output/#tool-output)
+            evaluation.send([m.content for m in full_round_sync(self, prompt)])
+        except StopIteration as done:
+            return done.value
+
+    async def evaluate_query_async(self,
+                                   query: Annotated[str, AIParam(desc="The cypher query to evaluate.")], 
+                                   result_dict: Annotated[dict, AIParam(desc="The result of the cypher query, in dictionary format.")], 
+                                   context_history: Optional[Annotated[list[ChatMessage], AIParam(desc="The chat history, which is a list of ChatMessage objects. This is used to provide context for the evaluation.")]] = None,
+                                   schema = None):
+        """Awaitable version of evaluate_query(); runs the evaluator round on the caller's event loop, so other coroutines (DB work, status updates, other sessions) keep making progress during evaluation."""
+
+        evaluation = self._evaluation(query, result_dict, context_history, schema)
+        try:
+            prompt = next(evaluation)
+            evaluation.send([m.content async for m in self.full_round(prompt)])
+        except StopIteration as done:
+            return done.value
+
+    def _evaluation(self, query, result_dict, context_history, schema):
+        """The steps of an evaluation shared by evaluate_query() and evaluate_query_async(), as a generator: if the LLM
+        evaluator is needed, it yields the prompt and is sent the contents of the messages of the evaluator round. The
+        verdict is the generator's return value."""
+        cache_key = self._verdict_cache_key(query, result_dict)
+        cached_result = self._cached_verdict(cache_key)
+        if cached_result is not None:
+            return cached_result
+
+        lint_result = self.lint_query(query, result_dict, schema)
+        if lint_result is not None:
+            return lint_result
 
         prompt = self.get_eval_query_prompt(query, result_dict, context_history)
 
-        # this method is called externally but belongs to to the agent, which chats with itself
-        # to trigger running report_evaluation() with structured input enforced; the last
-        # message will be the result of the function call for extraction
-        # (this is how pydandic.ai implements structured tool output interally: https://ai.pydantic.dev/output/#tool-output)
-        eval_chat_log = full_round_sync(self, prompt)
-        eval_chat_log = [m.content for m in eval_chat_log]
+        self.eval_stats["llm_evaluations"] += 1
+        eval_chat_log = yield prompt
+
+        result = self._parse_eval_chat_log(eval_chat_log)
+        self._cache_verdict(cache_key, result)
+        return result
 
+    def _verdict_cache_key(self, query, result_dict):
+        result_hash = hashlib.sha1(as_envelope(result_dict).text.encode()).hexdigest()
+        return (normalize_query(self._query_text(query)), result_hash)
+
+    def _cached_verdict(self, cache_key):
+        if cache_key not in self.verdict_cache:
+            return None
+        self.verdict_cache.move_to_end(cache_key)
+        self.eval_stats["cached_verdicts"] += 1
+        return {**self.verdict_cache[cache_key], "cached_verdict": True}
+
+    def _cache_verdict(self, cache_key, result):
+        self.verdict_cache[cache_key] = result
+        while len(self.verdict_cache) > self.verdict_cache_size:
+            self.verdict_cache.popitem(last = False)
+
+    def clear_verdict_cache(self):
+        """Verdicts depend on the conversation context, so the agent clears them for each new user message."""
+        self.verdict_cache.clear()
+
+    def lint_query(self, query, result_dict, schema = None):
+        """Runs the local pre-evaluation checks, returning a verdict for clear-cut cases or None if the LLM evaluator is needed.
+        Label and relationship type checks use the live schema snapshot, if given (and loaded)."""
+        if not self.lint:
+            return None
+
+        known_labels = None
+        known_relationship_types = None
+        if schema is not None and schema.loaded:
+            known_labels = self._known_labels(schema)
+            known_relationship_types = set(schema.relationship_types)
+
+        result = lint_query(self._query_text(query), result_dict, known_labels, known_relationship_types)
+        if result is not None:
+            self.eval_stats["lint_accepted" if result["accept_query"] else "lint_rejected"] += 1
+        return result
+
+    def _known_labels(self, schema):
+        return set(schema.labels)
+
+    def _query_text(self, query):
+        """The query as it is actually run, for checking labels against the schema and normalizing for the verdict cache."""
+        return query
+
+    def _parse_eval_chat_log(self, eval_chat_log):
+        """Extracts the evaluation from the contents of the messages of an evaluation round."""
         # if eval_chat_log has 2 or more elements, the eval agent called a tool and the second element is the result
         if len(eval_chat_log) > 1:
             result = json.loads(eval_chat_log[1])
@@ -105,25 +206,41 @@ You are the Phenomics Evaluator, designed to evaluate cypher queries against the
         return result
     
 
+    def _serialize_history_message(self, position, m):
+        """JSON line for a message in the evaluation context, with long function results trimmed. Cached by the message's
+        position in the history (the message itself is left untouched), so repeated evaluations in a long conversation only
+        serialize new messages."""
+        entry = self._history_cache.get(position)
+        # the cache holds on to the message, so the identity checks catch a history that was changed at this position
+        if entry is not None and entry[0] is m and entry[1] is m.content:
+            return entry[2]
+
+        dumped = messages_dump(m)
+        content = dumped.get("content")
+        # truncate function results to ~1000 tokens; providing the entirety of all function results is too much.
+        if m.role == ChatRole.FUNCTION and isinstance(content, str) and len(content) > 4000:
+            dumped["content"] = content[:2000] + " ... [result trimmed] ..." + content[-2000:]  # keep the first and last 2000 characters
+
+        serialized = json.dumps(dumped)
+        self._history_cache[position] = (m, m.content, serialized)
+        return serialized
+
     def get_eval_query_prompt(self, query, result_dict, messages_history):
         """Generate a prompt for evaluating a query result."""
         template = self.eval_message_template
 
-        cleaned_history = []
-        for m in messages_history:
-            # truncate function results to 1000 characters; providing the entirety of all function results is too much.
-            if m.role == ChatRole.FUNCTION and len(m.content) > 4000: # ~ 1000 tokens
-                m.content = m.content[:2000] + " ... [result trimmed] ..." + m.content[-2000:]  # keep the first and last 2000 characters
-            
-            cleaned_history.append(m)
+        # only keep the last 10 messages for context
+        messages_history = messages_history or []
+        window = range(max(len(messages_history) - 10, 0), len(messages_history))
+        cleaned_history_strings = [self._serialize_history_message(i, messages_history[i]) for i in window]
 
-        cleaned_history_strings = [json.dumps(messages_dump(m)) for m in cleaned_history]
-        cleaned_history_strings = cleaned_history_strings[-10:]  # only keep the last 10 messages for context
+        # drop cached entries that fell out of the window, keeping the cache bounded
+        for key in [key for key in self._history_cache if key not in window]:
+            del self._history_cache[key]
 
         res = (template.replace("%QUERY%", query)
-               .replace("%QUERY_RESULT%", json.dumps(result_dict, indent=2))
+               .replace("%QUERY_RESULT%", as_envelope(result_dict).indented_text)
                .replace("%MESSAGES_HISTORY%", "\n".join(cleaned_history_strings))
                )
 
         return res
-   
@@ -1,17 +1,52 @@
 from kani import AIParam, ai_function, ChatMessage
 from kani.exceptions import WrappedCallException
 from typing import Annotated, List
-from phenomics_explorer.monarch_utils import fix_biolink_labels, munge_monarch_data
+from phenomics_explorer.monarch_utils import fix_biolink_labels, munge_monarch_data, compact_monarch_data, monarch_api_search, MONARCH_API_URL
 from phenomics_explorer.agent_kgbase import BaseKGAgent
+from phenomics_explorer.cache_utils import query_result_cache, make_cache_key
+from phenomics_explorer.neo4j_utils import table_result
+from phenomics_explorer.serialization_utils import ResultEnvelope
+from phenomics_explorer.monarch_search_index import get_search_index, MONARCH_SEARCH_INDEX
+import asyncio
+import os
 import phenomics_explorer.monarch_constants as C
 import json
-import httpx
 
 class MonarchKGAgent(BaseKGAgent):
     """Agent for interacting with the Monarch knowledge graph; extends KGAgent with keyword search (using Monarch API) system prompt with cypher examples."""
-    def __init__(self, *args, **kwargs):
+    def __init__(self,
+                 *args,
+                 query_cache = query_result_cache,
+                 monarch_api_url = MONARCH_API_URL,
+                 search_concurrency = 4,
+                 search_timeout = 10,
+                 search_backend = os.environ.get("MONARCH_SEARCH_BACKEND", "api"),
+                 search_index_path = MONARCH_SEARCH_INDEX,
+                 result_format = os.environ.get("MONARCH_RESULT_FORMAT", "records"),
+                 **kwargs):
         super().__init__(*args, **kwargs)
 
+        # results (after munging) are cached process-wide by default; pass query_cache = None to bypass the cache
+        self.query_cache = query_cache
+        self.query_stats["cache_hits"] = 0
+
+        # search terms are looked up concurrently, up to search_concurrency at a time, each limited to search_timeout seconds
+        self.monarch_api_url = monarch_api_url
+        self.search_concurrency = search_concurrency
+        self.search_timeout = search_timeout
+
+        # search_backend "api" uses the Monarch search API, "local" a full-text index built from the graph (see monarch_search_index)
+        if search_backend not in ("api", "local"):
+            raise ValueError(f"Unknown search_backend: {search_backend}. Expected 'api' or 'local'.")
+        self.search_backend = search_backend
+        self.search_index_path = search_index_path
+
+        # result_format "records" returns nodes, edges and table rows as dicts, "compact" as header-plus-rows tables with
+        # dictionary-encoded categories and predicates (see monarch_utils.compact_monarch_data), which takes fewer tokens
+        if result_format not in ("records", "compact"):
+            raise ValueError(f"Unknown result_format: {result_format}. Expected 'records' or 'compact'.")
+        self.result_format = result_format
+
         self.greeting = C.monarch_greeting
 
         self.description = "Queries the Monarch KG with graph queries and contextual information."
@@ -25,9 +60,10 @@ class MonarchKGAgent(BaseKGAgent):
     @ai_function()
     async def get_entity_types(self):
         """Get the types of entities in the graph. If displaying the result to the user, format them as a multi-column table organized by theme."""
-        
-        query = "CALL db.labels() YIELD label RETURN label"
-        res = await self._call_neo4j(query)
+
+        # answered from the in-memory schema snapshot, in the same shape as running CALL db.labels()
+        schema = await self.get_schema()
+        res = table_result([{"label": label} for label in schema.labels])
 
         return res
     
@@ -35,9 +71,10 @@ class MonarchKGAgent(BaseKGAgent):
     @ai_function()
     async def get_relationship_types(self):
         """Get the types of relationships in the graph. If displaying the result to the user, format them as a multi-column table organized by theme."""
-        
-        query = "CALL db.relationshipTypes() YIELD relationshipType RETURN relationshipType"
-        res = await self._call_neo4j(query)
+
+        # answered from the in-memory schema snapshot, in the same shape as running CALL db.relationshipTypes()
+        schema = await self.get_schema()
+        res = table_result([{"relationshipType": rel_type} for rel_type in schema.relationship_types])
 
         return res
         
@@ -48,13 +85,38 @@ class MonarchKGAgent(BaseKGAgent):
         
         return C.implementation_notes
 
-    # override the basic neo4j call to fix and munge the result for monarch biolink labels
-    async def _call_neo4j(self, query, parameters = None, timeout = 6):
+    def _cache_key(self, query, parameters = None):
+        return make_cache_key(fix_biolink_labels(query), parameters, namespace = f"{self.neo4j_uri}/{self.result_format}")
+
+    def _cached_result(self, query, parameters = None):
+        if self.query_cache is None:
+            return None
+
+        res = self.query_cache.get(self._cache_key(query, parameters))
+        if res is not None:
+            self.query_stats["cache_hits"] += 1
+        return res
+
+    # override the basic neo4j call to fix and munge the result for monarch biolink labels; the cache is checked
+    # beforehand, by run_query (see _cached_result)
+    async def _call_neo4j(self, query, parameters = None, timeout = None, max_chars = None):
         query = fix_biolink_labels(query)
-        res = await super()._call_neo4j(query, parameters = parameters, timeout = timeout)
+
+        res = await super()._call_neo4j(query, parameters = parameters, timeout = timeout, max_chars = max_chars)
+        # cached as an envelope, so cache hits also reuse the serialized text and token count
         res = munge_monarch_data(res)
+        if self.result_format == "compact":
+            res = compact_monarch_data(res)
+        res = ResultEnvelope(res)
+
+        if self.query_cache is not None:
+            self.query_cache.put(self._cache_key(query, parameters), res)
         return res
 
+    async def _explain_neo4j(self, query, parameters = None, timeout = None):
+        query = fix_biolink_labels(query)
+        return await super()._explain_neo4j(query, parameters = parameters, timeout = timeout)
+
 
     # we also need to override display_report to fix the query
     def display_report(self, report):
@@ -69,19 +131,15 @@ class MonarchKGAgent(BaseKGAgent):
 
         self._status(f"Searching for terms {search_terms}...")
 
-        results = {}
-        ids = []
-
-        for term in search_terms:
-            url = f"https://api-v3.monarchinitiative.org/v3/api/search?q={term}&limit=5&offset=0"
-            response = httpx.get(url)
-            resp_json = response.json()
-            items_slim = []
-            if 'items' in resp_json:
-                for item in resp_json['items']:
-                    items_slim.append({k: v for k, v in item.items() if k in ['id', 'category', 'name', 'in_taxon_label']})
-                    ids.append(item['id'])
-            results[term] = items_slim
+        if self.search_backend == "local":
+            index = get_search_index(self.search_index_path)
+            # sqlite lookups are quick, but they are blocking, so we keep them off the event loop
+            results = await asyncio.to_thread(lambda: {term: index.search(term) for term in search_terms})
+        else:
+            results = await monarch_api_search(search_terms,
+                                               base_url = self.monarch_api_url,
+                                               max_concurrency = self.search_concurrency,
+                                               timeout = self.search_timeout)
 
         # again, if self.message_token_len reports more than 10000 tokens in the result, we need to ask the agent to make the request smaller
         tokens = self.message_token_len(ChatMessage.user(json.dumps(results)))
@@ -0,0 +1,172 @@
+from collections import OrderedDict
+import threading
+import sqlite3
+import json
+import time
+import os
+import re
+import logging
+
+from phenomics_explorer.serialization_utils import ResultEnvelope, dumps
+
+
+logger = logging.getLogger(__name__)
+
+# quoted strings and backticked names, which must be left as-is when normalizing whitespace
+_QUOTED = re.compile(r'''('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`)''')
+
+
+def normalize_query(query):
+    """Collapses runs of whitespace outside of string literals and backticked names, so that queries differing only in formatting share a cache key."""
+    parts = _QUOTED.split(query.strip())
+    # split() with a capturing group alternates unquoted and quoted segments
+    return "".join(part if i % 2 == 1 else re.sub(r'\s+', ' ', part) for i, part in enumerate(parts))
+
+
+def make_cache_key(query, parameters = None, namespace = ""):
+    """Builds a cache key from a (label-fixed) query and its parameters; namespace separates e.g. different databases."""
+    params = json.dumps(parameters or {}, sort_keys = True, default = str)
+    return f"{namespace}\x00{normalize_query(query)}\x00{params}"
+
+
+class QueryResultCache:
+    """Thread-safe, size-bounded LRU cache of query results with a time-to-live. Cached results are shared between
+    callers (and Streamlit sessions) and must be treated as read-only."""
+    def __init__(self, maxsize = 256, ttl = 3600, enabled = True):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # set to False to bypass the cache entirely (gets always miss, puts are ignored)
+        self.enabled = enabled
+
+        self._entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """Returns the cached value for key, or None if it is missing or expired."""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at is not None and time.monotonic() > expires_at:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last = False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"enabled": self.enabled,
+                    "size": len(self._entries),
+                    "maxsize": self.maxsize,
+                    "ttl": self.ttl,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "expirations": self.expirations}
+
+
+class DiskQueryCache:
+    """Persistent query result cache in a SQLite file, with the get/put interface of QueryResultCache, for replaying results
+    across eval runs. Entries are scoped to a KG release (kg_release or MONARCH_KG_RELEASE), and the cache is disabled without
+    one. Values are stored as JSON (envelopes as their serialized text) and come back as plain dicts."""
+    # bump this if the cached value format changes, to invalidate older entries
+    FORMAT_VERSION = 1
+
+    def __init__(self, path, kg_release = None, enabled = True):
+        self.path = path
+        self.kg_release = kg_release or os.environ.get("MONARCH_KG_RELEASE")
+        self.version = f"{self.kg_release}/v{self.FORMAT_VERSION}"
+        self.enabled = enabled
+        if self.kg_release is None and enabled:
+            logger.warning("No KG release given for the query cache at %s (set MONARCH_KG_RELEASE); the cache is disabled.", path)
+            self.enabled = False
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout = 30, check_same_thread = False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS query_cache (key TEXT PRIMARY KEY, version TEXT NOT NULL, value TEXT NOT NULL, created REAL NOT NULL)")
+            # entries of other releases are only dropped by a cache that knows its own
+            if self.kg_release is not None:
+                self._conn.execute("DELETE FROM query_cache WHERE version != ?", (self.version,))
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM query_cache WHERE key = ? AND version = ?", (key, self.version)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+
+        value = value.text if isinstance(value, ResultEnvelope) else dumps(value)
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO query_cache (key, version, value, created) VALUES (?, ?, ?, ?)",
+                               (key, self.version, value, time.time()))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM query_cache")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM query_cache").fetchone()[0]
+            return {"enabled": self.enabled,
+                    "path": self.path,
+                    "kg_release": self.kg_release,
+                    "size": size,
+                    "hits": self.hits,
+                    "misses": self.misses}
+
+
+# process-wide cache shared by all agents (and so all Streamlit sessions)
+query_result_cache = QueryResultCache(maxsize = int(os.environ.get("QUERY_CACHE_SIZE", 256)),
+                                      ttl = float(os.environ.get("QUERY_CACHE_TTL", 3600)),
+                                      enabled = os.environ.get("QUERY_CACHE_ENABLED", "1") != "0")
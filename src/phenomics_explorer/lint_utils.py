@@ -0,0 +1,82 @@
+import re
+
+
+# string literals, removed before looking for labels and clauses so their contents can't match
+_STRING_LITERAL = re.compile(r'''('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")''')
+_NAME = r'(?:`[^`]+`|[A-Za-z_]\w*)'
+# (n:Label:Other ...) - the labels directly following the (optional) variable of a node pattern
+_NODE_LABELS = re.compile(r'\(\s*\w*\s*((?::\s*' + _NAME + r'\s*)+)')
+# WHERE n:Label, AND n:A|B, ... - label predicates on a variable (label expressions may combine labels with | and &)
+_LABEL_PREDICATES = re.compile(r'\b(?:WHERE|AND|OR|XOR|NOT|WHEN)\s+\w+\s*(:\s*' + _NAME + r'(?:\s*[:|&]\s*!?\s*' + _NAME + r')*)', re.IGNORECASE)
+# [r:TYPE|OTHER ...] - the types directly following the (optional) variable of a relationship pattern
+_REL_TYPES = re.compile(r'\[\s*\w*\s*:\s*(' + _NAME + r'(?:\s*\|\s*:?\s*' + _NAME + r')*)')
+_RELATIONSHIP_PATTERN = re.compile(r'-\[|\]-|--|->|<-')
+_ID_LOOKUP = re.compile(r'\.id\s*(=|IN)\s*|\{\s*id\s*:', re.IGNORECASE)
+_LIMIT_1 = re.compile(r'\bLIMIT\s+1\s*;?\s*$', re.IGNORECASE)
+_AGGREGATION = re.compile(r'\b(count|collect|sum|avg|min|max)\s*\(', re.IGNORECASE)
+
+
+def _names(group):
+    return [n.strip().strip('`') for n in re.findall(_NAME, group)]
+
+
+def query_labels(query):
+    """Returns the node labels and relationship types used in the patterns of a query (ignoring string literals)."""
+    query = _STRING_LITERAL.sub("''", query)
+    labels = {name for group in _NODE_LABELS.findall(query) + _LABEL_PREDICATES.findall(query) for name in _names(group)}
+    rel_types = {name for group in _REL_TYPES.findall(query) for name in _names(group)}
+    return labels, rel_types
+
+
+def _num_rows(data):
+    # compact results (see monarch_utils.compact_monarch_data) are header-plus-rows tables
+    if isinstance(data, dict) and 'rows' in data:
+        return len(data['rows'])
+    return len(data)
+
+
+def _result_is_empty(result_dict):
+    try:
+        graph = result_dict['result_as_graph']
+        table = result_dict['result_as_table']
+        return (graph['type'] in ('graph', 'graph_compact') and _num_rows(graph['data']['nodes']) == 0
+                and _num_rows(table['data']) == 0)
+    except (KeyError, TypeError):
+        return False
+
+
+def _verdict(accept_query, query_summary, suggestion):
+    return {"query_summary": query_summary, "accept_query": accept_query, "suggestion": suggestion, "evaluated_by": "lint"}
+
+
+def lint_query(query, result_dict, known_labels = None, known_relationship_types = None):
+    """Fast local checks of a query and its (possibly summarized) result, in front of the LLM evaluator. Returns a verdict in the
+    same format as the evaluator's report_evaluation() for clear-cut cases, or None if the query needs a full evaluation.
+    Label and relationship type checks are skipped if known_labels / known_relationship_types are not given."""
+    stripped = _STRING_LITERAL.sub("''", query)
+    labels, rel_types = query_labels(query)
+
+    if known_labels:
+        unknown = sorted(labels - set(known_labels))
+        if len(unknown) > 0:
+            return _verdict(False, "The query uses node labels that do not exist in the graph.",
+                            f"The label(s) {', '.join(unknown)} do not exist in the graph. Use get_entity_types() to see the available labels.")
+
+    if known_relationship_types:
+        unknown = sorted(rel_types - set(known_relationship_types))
+        if len(unknown) > 0:
+            return _verdict(False, "The query uses relationship types that do not exist in the graph.",
+                            f"The relationship type(s) {', '.join(unknown)} do not exist in the graph. Use get_relationship_types() to see the available types.")
+
+    if _result_is_empty(result_dict):
+        return _verdict(False, "The query returned no results.",
+                        "Check that the node ids, labels and relationship directions are correct (search for ids if needed), and consider OPTIONAL MATCH or a less restrictive query.")
+
+    # a direct lookup of nodes by id, with no relationships to traverse or aggregate, that found something; other LIMITs (e.g.
+    # without an ORDER BY, or added by the agent's explain guard) may or may not matter, which is left to the LLM evaluator
+    unlimited = _LIMIT_1.sub("", stripped)
+    if (_ID_LOOKUP.search(stripped) and not _RELATIONSHIP_PATTERN.search(stripped) and not _AGGREGATION.search(stripped)
+            and not re.search(r'\b(LIMIT|WITH|UNWIND|CALL)\b', unlimited, re.IGNORECASE)):
+        return _verdict(True, "The query looks up nodes directly by id, and found them.", "None.")
+
+    return None
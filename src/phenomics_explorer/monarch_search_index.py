@@ -0,0 +1,172 @@
+# Local full-text search over Monarch KG nodes, as an alternative to the Monarch search API.
+# Build (or refresh) the index from the graph with:
+#   python -m phenomics_explorer.monarch_search_index build --path monarch_search.sqlite
+import argparse
+import threading
+import sqlite3
+import json
+import os
+import re
+
+from phenomics_explorer.monarch_utils import primary_category
+
+
+MONARCH_SEARCH_INDEX = os.environ.get("MONARCH_SEARCH_INDEX", "monarch_search.sqlite")
+
+_NODES_QUERY = """
+MATCH (n)
+WHERE n.id IS NOT NULL
+RETURN n.id AS id, n.name AS name, n.symbol AS symbol, n.synonym AS synonyms, n.category AS category, n.in_taxon_label AS in_taxon_label
+"""
+
+_SCHEMA = """
+CREATE TABLE nodes (rowid INTEGER PRIMARY KEY, id TEXT NOT NULL, name TEXT, symbol TEXT, synonyms TEXT, category TEXT, in_taxon_label TEXT);
+CREATE INDEX nodes_id ON nodes (id);
+CREATE VIRTUAL TABLE nodes_fts USING fts5(name, symbol, synonyms, id, content='nodes', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2', prefix='2 3');
+CREATE VIRTUAL TABLE nodes_trigram USING fts5(name, symbol, content='nodes', content_rowid='rowid', tokenize='trigram');
+"""
+
+
+def _as_text(value):
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return " | ".join(str(v) for v in value)
+    return str(value)
+
+
+def build_search_index(uri, path = MONARCH_SEARCH_INDEX, batch_size = 10000):
+    """Builds the search index at path from all nodes with an id in the graph at uri. The index is written to a temporary
+    file and moved into place at the end, so a running app keeps serving the previous index until the new one is complete."""
+    from neo4j import GraphDatabase
+
+    tmp_path = path + ".building"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    conn.executescript(_SCHEMA)
+
+    num_nodes = 0
+    with GraphDatabase.driver(uri) as driver, driver.session() as session:
+        batch = []
+        for record in session.run(_NODES_QUERY):
+            batch.append((record["id"],
+                          _as_text(record["name"]),
+                          _as_text(record["symbol"]),
+                          _as_text(record["synonyms"]),
+                          primary_category(record["category"]),
+                          _as_text(record["in_taxon_label"])))
+            if len(batch) >= batch_size:
+                conn.executemany("INSERT INTO nodes (id, name, symbol, synonyms, category, in_taxon_label) VALUES (?, ?, ?, ?, ?, ?)", batch)
+                num_nodes += len(batch)
+                batch = []
+                print(f"Indexed {num_nodes} nodes...")
+        conn.executemany("INSERT INTO nodes (id, name, symbol, synonyms, category, in_taxon_label) VALUES (?, ?, ?, ?, ?, ?)", batch)
+        num_nodes += len(batch)
+
+    conn.execute("INSERT INTO nodes_fts (nodes_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO nodes_trigram (nodes_trigram) VALUES ('rebuild')")
+    conn.execute("INSERT INTO nodes_fts (nodes_fts) VALUES ('optimize')")
+    conn.commit()
+    conn.close()
+
+    os.replace(tmp_path, path)
+    print(f"Indexed {num_nodes} nodes into {path}.")
+    return num_nodes
+
+
+class MonarchSearchIndex:
+    """Ranked search over the local node index: exact id matches first, then prefix matches on names, symbols, synonyms and ids
+    (ranked by bm25, with exact name/symbol matches first), then fuzzy matches on shared character trigrams to fill up to the
+    limit. Results have the same slimmed shape as the Monarch API search. The index is reopened if the file is rebuilt."""
+    def __init__(self, path = MONARCH_SEARCH_INDEX):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No search index at {path}; build it with: python -m phenomics_explorer.monarch_search_index build --path {path}")
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._mtime = None
+
+    def _connection(self):
+        mtime = os.path.getmtime(self.path)
+        if self._conn is None or mtime != self._mtime:
+            if self._conn is not None:
+                self._conn.close()
+            self._conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri = True, check_same_thread = False)
+            self._mtime = mtime
+        return self._conn
+
+    def search(self, term, limit = 5):
+        with self._lock:
+            conn = self._connection()
+            rows = []
+            seen = set()
+
+            def add(new_rows):
+                for row in new_rows:
+                    if row[0] not in seen and len(rows) < limit:
+                        seen.add(row[0])
+                        rows.append(row)
+
+            add(conn.execute("SELECT rowid, id, category, name, in_taxon_label FROM nodes WHERE id = ? LIMIT ?", (term, limit)))
+
+            words = re.findall(r'\w+', term)
+            if len(rows) < limit and len(words) > 0:
+                match = " ".join(f'"{w}"*' for w in words)
+                add(conn.execute("""SELECT nodes.rowid, nodes.id, nodes.category, nodes.name, nodes.in_taxon_label
+                                    FROM nodes_fts JOIN nodes ON nodes.rowid = nodes_fts.rowid
+                                    WHERE nodes_fts MATCH ?
+                                    ORDER BY (lower(nodes.name) = lower(?) OR lower(nodes.symbol) = lower(?)) DESC,
+                                             bm25(nodes_fts, 10.0, 10.0, 2.0, 1.0)
+                                    LIMIT ?""", (match, term, term, limit)))
+
+            trigrams = {term.lower()[i:i + 3] for i in range(len(term) - 2)}
+            trigrams = [t for t in trigrams if '"' not in t]
+            if len(rows) < limit and len(trigrams) > 0:
+                match = " OR ".join(f'"{t}"' for t in trigrams)
+                add(conn.execute("""SELECT nodes.rowid, nodes.id, nodes.category, nodes.name, nodes.in_taxon_label
+                                    FROM nodes_trigram JOIN nodes ON nodes.rowid = nodes_trigram.rowid
+                                    WHERE nodes_trigram MATCH ?
+                                    ORDER BY rank
+                                    LIMIT ?""", (match, limit)))
+
+        return [{k: v for k, v in zip(['id', 'category', 'name', 'in_taxon_label'], row[1:]) if v is not None} for row in rows]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_search_index(path = MONARCH_SEARCH_INDEX):
+    """Returns the shared MonarchSearchIndex for path."""
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = MonarchSearchIndex(path)
+        return _indexes[path]
+
+
+if __name__ == "__main__":
+    import dotenv
+    dotenv.load_dotenv(override=True)
+
+    parser = argparse.ArgumentParser(description = "Build or query the local Monarch search index.")
+    subparsers = parser.add_subparsers(dest = "command", required = True)
+
+    build_parser = subparsers.add_parser("build", help = "Build (or rebuild) the index from the graph at --uri (default: $NEO4J_URI).")
+    build_parser.add_argument("--path", default = MONARCH_SEARCH_INDEX)
+    build_parser.add_argument("--uri", default = os.environ.get("NEO4J_URI"))
+
+    search_parser = subparsers.add_parser("search", help = "Search the index, for checking results.")
+    search_parser.add_argument("terms", nargs = "+")
+    search_parser.add_argument("--path", default = MONARCH_SEARCH_INDEX)
+    search_parser.add_argument("--limit", type = int, default = 5)
+
+    args = parser.parse_args()
+    if args.command == "build":
+        if args.uri is None:
+            parser.error("--uri is required if NEO4J_URI is not set")
+        build_search_index(args.uri, args.path)
+    else:
+        index = MonarchSearchIndex(args.path)
+        print(json.dumps({term: index.search(term, limit = args.limit) for term in args.terms}, indent = 2))
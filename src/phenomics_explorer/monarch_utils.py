@@ -7,10 +7,27 @@ import yaml
 import json
 import importlib.resources
 import os
+import asyncio
+import weakref
+import threading
+import httpx
 
 from phenomics_explorer.monarch_constants import categories
 
 
+MONARCH_API_URL = os.environ.get("MONARCH_API_URL", "https://api-v3.monarchinitiative.org/v3/api")
+
+# the fields of search results we pass on to the agent
+SEARCH_RESULT_FIELDS = ['id', 'category', 'name', 'in_taxon_label']
+
+# HTTP/2 needs the optional h2 package (httpx[http2]); without it we fall back to HTTP/1.1 keep-alive
+try:
+    import h2  # noqa: F401
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+
 def munge_monarch_data(data):
     """Takes the result of parse_neo4j_result and selects and replaces some fields and values specifically of interest for the Monarch KG."""
     data['result_as_graph']['data'] = munge_monarch_graph_result(data['result_as_graph']['data'])
@@ -26,32 +43,128 @@ def munge_monarch_table_result(result_data):
     return result_data
 
 
-def munge_monarch_graph_result(result_data):
-    """Takes a graph result from a neo4j query selects specific properties of interest, reducing the size and making it more interpretable for the LLM."""
-    # ... we don't want to keep all of the node and edge properties - it's too much info
-    import pprint
-    pprint.pprint(result_data, indent=2)
-    for node in result_data['nodes']:
-        node['data'] = {k: v for k, v in node['data'].items() if k in ['id', 'name', 'symbol', 'description', 'full_name', 'in_taxon_label', 'caption', 'category']}
-    for edge in result_data['edges']:
-        edge['data'] = {k: v for k, v in edge['data'].items() if k in ['id', 'subject', 'predicate', 'object', 'primary_knowledge_source', 'publications', 'has_evidence', 'caption', 'source', 'target', 'label'] or 'negated' in k or 'qualifier' in k}
+# node and edge properties we keep (plus any edge properties about negation or qualifiers); the rest is too much info
+_NODE_KEYS = frozenset(['id', 'name', 'symbol', 'description', 'full_name', 'in_taxon_label', 'caption', 'category'])
+_EDGE_KEYS = frozenset(['id', 'subject', 'predicate', 'object', 'primary_knowledge_source', 'publications', 'has_evidence', 'caption', 'source', 'target', 'label'])
 
-    # we want to keep *one* category to represent each node, from the ordered list of categories above
-    for node in result_data['nodes']:
-        for cat in categories:
-            if 'category' in node['data'] and node['data']['category'] is not None:
-                if cat in node['data']['category']:
-                    node['data']['category'] = cat
-                    break
+# position of each category in the ordered categories list, lower is preferred
+_CATEGORY_RANK = {cat: rank for rank, cat in enumerate(categories)}
+
+
+def _ranked_category(node_categories):
+    """The first of a node's categories in the ordered categories list, or None if none of them are in it."""
+    best = None
+    for cat in node_categories:
+        rank = _CATEGORY_RANK.get(cat)
+        if rank is not None and (best is None or rank < best):
+            best = rank
+    return categories[best] if best is not None else None
+
+
+def munge_monarch_graph_result(result_data, debug = False):
+    """Takes a graph result from a neo4j query selects specific properties of interest, reducing the size and making it more interpretable for the LLM.
+    Each node keeps *one* category to represent it (the first of its categories in the ordered categories list), which is also
+    set as its label. Nodes and edges are updated in place, in a single pass; debug = True prints the raw result first."""
+    if debug:
+        import pprint
+        pprint.pprint(result_data, indent=2)
 
-    # set each nodes' label attribute to be the category
     for node in result_data['nodes']:
-        if 'category' in node['data'] and node['data']['category'] is not None:
-            node['data']['label'] = node['data']['category']
+        data = {k: v for k, v in node['data'].items() if k in _NODE_KEYS}
+        category = data.get('category')
+        if category is not None:
+            if not isinstance(category, str):
+                # nodes with none of the listed categories keep all of theirs
+                category = _ranked_category(category) or category
+                data['category'] = category
+            data['label'] = category
+        node['data'] = data
+
+    for edge in result_data['edges']:
+        edge['data'] = {k: v for k, v in edge['data'].items() if k in _EDGE_KEYS or 'negated' in k or 'qualifier' in k}
 
     return result_data
 
 
+# keys of munged nodes and edges that repeat other keys (caption and label are the name and category of nodes, and the
+# type of edges; source and target are the subject and object ids), dropped from the compact format
+_COMPACT_REDUNDANT_NODE_KEYS = frozenset(['caption', 'label'])
+_COMPACT_REDUNDANT_EDGE_KEYS = frozenset(['caption', 'label', 'source', 'target'])
+
+COMPACT_FORMAT_NOTE = ("Nodes, edges and table rows are given as lists of values in the order of their columns; node categories "
+                       "and edge predicates are given as indices into the categories and predicates lists.")
+
+
+def _rows_to_columns(rows, first_columns = (), skip = frozenset(), encode = None):
+    """Converts a list of dicts into a header-plus-rows table {"columns": [...], "rows": [[...], ...]}. Columns are the
+    first_columns that occur followed by the other keys in first-seen order; missing values are None. encode maps column names
+    to functions applied to their values (e.g. for dictionary-encoding)."""
+    columns = {}
+    for row in rows:
+        for k in row:
+            if k not in skip and k not in columns:
+                columns[k] = None
+    columns = [k for k in first_columns if k in columns] + [k for k in columns if k not in first_columns]
+    encode = encode or {}
+    encoders = [encode.get(k) for k in columns]
+
+    table_rows = []
+    for row in rows:
+        values = []
+        for k, encoder in zip(columns, encoders):
+            value = row.get(k)
+            values.append(encoder(value) if encoder is not None and value is not None else value)
+        table_rows.append(values)
+    return {"columns": columns, "rows": table_rows}
+
+
+def compact_monarch_data(data):
+    """Re-encodes a munged result (see munge_monarch_data) compactly for the LLM: nodes, edges and table rows become
+    header-plus-rows tables (so property names appear once rather than per element), keys that repeat other keys are
+    dropped, and node categories and edge predicates are dictionary-encoded as indices into shared lists."""
+    category_index = {}
+    predicate_index = {}
+
+    def index_of(index, value):
+        if value not in index:
+            index[value] = len(index)
+        return index[value]
+
+    graph = data['result_as_graph']
+    if graph.get('type') == 'graph':
+        nodes = [node['data'] for node in graph['data']['nodes']]
+        # edges without a predicate property use their type
+        edges = [{'predicate': edge['data'].get('label'), **edge['data']} for edge in graph['data']['edges']]
+        graph = {"type": "graph_compact",
+                 "data": {"nodes": _rows_to_columns(nodes,
+                                                    first_columns = ['id', 'category', 'name'],
+                                                    skip = _COMPACT_REDUNDANT_NODE_KEYS,
+                                                    # nodes with none of the listed categories still have a list of them
+                                                    encode = {'category': lambda v: index_of(category_index, primary_category(v))}),
+                          "edges": _rows_to_columns(edges,
+                                                    first_columns = ['subject', 'predicate', 'object'],
+                                                    skip = _COMPACT_REDUNDANT_EDGE_KEYS,
+                                                    encode = {'predicate': lambda v: index_of(predicate_index, v)}),
+                          "categories": list(category_index),
+                          "predicates": list(predicate_index)}}
+
+    table = data['result_as_table']
+    if table.get('type') == 'table':
+        table = {"type": "table_compact", "data": _rows_to_columns(table['data'])}
+
+    return {**data, "result_as_graph": graph, "result_as_table": table, "format": COMPACT_FORMAT_NOTE}
+
+
+def primary_category(node_categories):
+    """Picks the single category representing a node, the first of its categories in the ordered categories list."""
+    if node_categories is None or isinstance(node_categories, str):
+        return node_categories
+    ranked = _ranked_category(node_categories)
+    if ranked is not None:
+        return ranked
+    return node_categories[0] if len(node_categories) > 0 else None
+
+
 def fix_biolink_labels(query):
     # Regular expression to match (g:biolink_somelabel)
     pattern = r'biolink_([a-zA-Z0-9_]+)'
@@ -61,3 +174,49 @@ def fix_biolink_labels(query):
 
     res = re.sub(pattern, replacement, query)
     return res
+
+
+# like neo4j drivers, httpx async clients are bound to an event loop, so we keep one shared client per loop
+_http_clients = weakref.WeakKeyDictionary()
+_http_clients_lock = threading.Lock()
+
+
+def get_http_client():
+    """Returns the shared httpx.AsyncClient (keep-alive, HTTP/2 where available) for the running event loop."""
+    loop = asyncio.get_running_loop()
+    with _http_clients_lock:
+        client = _http_clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(http2 = _HTTP2,
+                                       limits = httpx.Limits(max_connections = 20, max_keepalive_connections = 10))
+            _http_clients[loop] = client
+        return client
+
+
+async def monarch_api_search(search_terms, base_url = MONARCH_API_URL, limit = 5, max_concurrency = 4, timeout = 10, client = None):
+    """Searches the Monarch API for each term concurrently (at most max_concurrency requests at a time), returning a dictionary
+    of term -> list of slimmed result items (the first page of up to limit items), in the order of search_terms. Each request is
+    limited to timeout seconds; terms whose request times out or fails with an error status map to {"error": message} instead,
+    so that one slow or failing term doesn't lose the results of the others."""
+    if client is None:
+        client = get_http_client()
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def search_term(term):
+        try:
+            async with semaphore:
+                response = await client.get(f"{base_url}/search", params = {"q": term, "limit": limit, "offset": 0}, timeout = timeout)
+            response.raise_for_status()
+        except httpx.TimeoutException:
+            return {"error": f"The search for this term timed out after {timeout} seconds."}
+        except httpx.HTTPStatusError as e:
+            return {"error": f"The search for this term failed with HTTP status {e.response.status_code}."}
+        resp_json = response.json()
+        items_slim = []
+        if 'items' in resp_json:
+            for item in resp_json['items']:
+                items_slim.append({k: v for k, v in item.items() if k in SEARCH_RESULT_FIELDS})
+        return items_slim
+
+    items = await asyncio.gather(*[search_term(term) for term in search_terms])
+    return dict(zip(search_terms, items))
@@ -1,105 +1,199 @@
 import json
+import sys
+import re
+import os
+import time
+import atexit
+import asyncio
+import weakref
+import threading
+import logging
+import contextlib
 import yaml
+import neo4j.time
+import neo4j.spatial
+from neo4j import AsyncGraphDatabase
+from neo4j.graph import Node, Relationship, Path
 
 
-async def _parse_neo4j_result(result, expected_type = "graph"):
-    # ok, we can get a graph with result.graph(), but this might have 0 nodes; if so we 
+logger = logging.getLogger(__name__)
+
+
+class ResultTooLargeError(Exception):
+    """Raised when a result exceeds its size budget while being streamed; records beyond the budget are never fetched."""
+    def __init__(self, num_rows, num_chars, max_chars):
+        self.num_rows = num_rows
+        self.num_chars = num_chars
+        self.max_chars = max_chars
+        super().__init__(f"The result exceeded the size budget of ~{max_chars} characters after {num_rows} rows ({num_rows}+ rows in total).")
+
+
+async def _parse_neo4j_result(result, max_chars = None):
+    """Reads the records of a neo4j result exactly once, building both the graph view and the table view from them.
+    The table view is only populated if the graph view has no nodes (if there *are* nodes, the table view is empty).
+
+    Records are streamed from the driver with a running estimate of the serialized result size; if max_chars is given
+    and the estimate exceeds it, the rest of the result is discarded and ResultTooLargeError is raised."""
     if not result:
-        return {"type": "error", "data": "No result from Neo4j query."}
-    
-    if expected_type == "table":
-        # looks like [{}]
-        parsed = await result.to_df()
-        parsed = parsed.to_dict(orient="records")
+        error = {"type": "error", "data": "No result from Neo4j query."}
+        return {"result_as_graph": error, "result_as_table": error}
 
-        return {"type": "table", "data": parsed}
+    keys = result.keys()
+    # table rows are converted as records arrive, until the first node shows up (after which the table view stays empty)
+    rows = []
+    num_rows = 0
+    # nodes and relationships by element id, in first-seen order; the driver keeps them alive until the result is released
+    # anyway (and updates repeated nodes in place), so the graph view is only built from them once all records are read
+    nodes = {}
+    edges = {}
+    bare_nodes = set()
+    num_chars = 0
+    async for record in result:
+        num_rows += 1
+        values = record.values()
+        for value in values:
+            num_chars += _collect_graph_entities(value, nodes, edges, bare_nodes)
+        if len(nodes) == 0:
+            rows.append(_values_to_row(keys, values))
 
-    elif expected_type == "graph":
-        parsed = await result.graph()
+        if max_chars is not None and num_chars > max_chars:
+            # discards the remaining records without fetching them
+            await result.consume()
+            raise ResultTooLargeError(num_rows, num_chars, max_chars)
 
-        node_list = [node for node in parsed.nodes]
-        edge_list = [edge for edge in parsed.relationships]
+    result_graph = _entities_to_graph(nodes, edges)
+
+    if len(result_graph['data']['nodes']) == 0:
+        result_table = {"type": "table", "data": rows}
+    else:
+        result_table = {"type": "table", "data": []}
+
+    return {"result_as_graph": result_graph, "result_as_table": result_table}
 
-        graph_data = {"nodes": [], "edges": []}
-        known_node_ids = set()
-        known_edge_ids = set()
 
-        for node in node_list:
-            add_node_to_graph_data(graph_data, node, known_node_ids)
+def _values_to_row(keys, values):
+    """Converts the values of a record into a row of the table view, {key: value}, with neo4j types coerced to plain values."""
+    return {key: _coerce_value(value) for key, value in zip(keys, values)}
 
-        for edge in edge_list:
-            add_relationship_to_graph_data(graph_data, edge, known_edge_ids, known_node_ids)
 
-        return {"type": "graph", "data": graph_data}
+def _coerce_value(value):
+    """Converts neo4j values into JSON-friendly python values: temporal types to ISO 8601 strings and points to maps; lists
+    and maps are converted recursively. (Graph entities never reach the table view, see _parse_neo4j_result.)"""
+    if value is None or type(value) in _SCALAR_TYPES:
+        return value
+    elif isinstance(value, list):
+        return [_coerce_value(item) for item in value]
+    elif isinstance(value, dict):
+        return {k: _coerce_value(v) for k, v in value.items()}
+    elif isinstance(value, (neo4j.time.Date, neo4j.time.Time, neo4j.time.DateTime, neo4j.time.Duration)):
+        return value.iso_format()
+    elif isinstance(value, neo4j.spatial.Point):
+        return {"srid": value.srid, "coordinates": list(value)}
     else:
-        raise ValueError(f"Unknown expected type: {expected_type}. Expected 'graph' or 'table'.")
-
-
-
-def add_node_to_graph_data(graph_data, node, known_node_ids):
-    """
-    Helper to add a node to graph_data if it's not already known.
-    """
-    # We can use either the Neo4j internal ID or a property-based ID
-    node_props = dict(node)
-    node_internal_id = node.get("id")  # The numeric internal id
-    # Or use the 'id' property if you prefer:
-    # node_id = node_props.get("id", str(node_internal_id))
-    
-    if node_internal_id in known_node_ids:
-        return  # skip duplicates
-    known_node_ids.add(node_internal_id)
-    
-    # Choose a caption
-    caption = node_props.get("name") or node_props.get("symbol") or f"{node_internal_id}"
-    
-    # Build node data
-    node_data = {
-        "id": str(node_internal_id),  # or node_props.get("id", str(node_internal_id))
-        "caption": caption
-    }
-    
-    # Merge remaining props
-    for k, v in node_props.items():
-        node_data[k] = v
-
-
-    graph_data["nodes"].append({"data": node_data})
-
-
-def add_relationship_to_graph_data(graph_data, relationship, known_edge_ids, known_node_ids):
-    """
-    Helper to add a relationship to graph_data if it's not already known.
-    Also ensures the relationship's start and end nodes exist in graph_data.
-    """
-
-    # 1) Ensure the start and end nodes exist in the graph data
-    add_node_to_graph_data(graph_data, relationship.start_node, known_node_ids)
-    add_node_to_graph_data(graph_data, relationship.end_node, known_node_ids)
-
-    # 2) Check if we've seen this relationship before
-    rel_id = relationship.get("id")
-    if rel_id in known_edge_ids:
-        return
-    known_edge_ids.add(rel_id)
-
-    # 3) Build the edge data
-    rel_props = dict(relationship)
-    edge_data = {
-        "id": str(rel_id),
-        "caption": relationship.type,  # relationship type as the "caption"
-        "source": str(relationship.start_node.get("id")),
-        "target": str(relationship.end_node.get("id")),
-        "label": relationship.type,  # relationship type as the "label"
-    }
-    
-    # 4) Include any additional relationship properties
-    for k, v in rel_props.items():
-        if k not in ["id", "type"]:
-            edge_data[k] = v
-
-    # 5) Append the edge
-    graph_data["edges"].append({"data": edge_data})
+        return value
+
+
+_SCALAR_TYPES = frozenset([str, int, float, bool])
+
+
+def _collect_graph_entities(value, nodes, edges, bare_nodes):
+    """Recursively gathers nodes and relationships (including those nested in paths, lists and maps) from a record value,
+    keyed by element id. Returns the approximate serialized size of the content not seen before."""
+    # checked first, as most values are scalars and the graph types are (slower to check) abstract classes
+    if value is None or type(value) in _SCALAR_TYPES:
+        return _json_size(value)
+    elif isinstance(value, Node):
+        return _collect_node(value, nodes, bare_nodes)
+    elif isinstance(value, Relationship):
+        size = _collect_node(value.start_node, nodes, bare_nodes) + _collect_node(value.end_node, nodes, bare_nodes)
+        if value.element_id not in edges:
+            edges[value.element_id] = value
+            size += _properties_size(value)
+        return size
+    elif isinstance(value, Path):
+        return (sum(_collect_graph_entities(node, nodes, edges, bare_nodes) for node in value.nodes) +
+                sum(_collect_graph_entities(rel, nodes, edges, bare_nodes) for rel in value.relationships))
+    elif isinstance(value, list):
+        return sum(_collect_graph_entities(item, nodes, edges, bare_nodes) for item in value)
+    elif isinstance(value, dict):
+        return sum(_collect_graph_entities(item, nodes, edges, bare_nodes) for item in value.values())
+    else:
+        return _json_size(value)
+
+
+def _collect_node(node, nodes, bare_nodes):
+    # relationships returned without their nodes carry nodes without properties (bare_nodes); the driver fills them in (in
+    # place) if the full node shows up later, which adds to the result size
+    element_id = node.element_id
+    if element_id in nodes:
+        if element_id not in bare_nodes or len(node) == 0:
+            return 0
+        bare_nodes.discard(element_id)
+    else:
+        nodes[element_id] = node
+        if len(node) == 0:
+            bare_nodes.add(element_id)
+    return _properties_size(node)
+
+
+def _json_size(value):
+    # an estimate is enough, so common scalars skip the encoder (strings are counted without escapes)
+    if isinstance(value, str):
+        return len(value) + 2
+    elif value is None or isinstance(value, (bool, int, float)):
+        return 4 if value is None else len(str(value))
+    return len(json.dumps(value, default=str))
+
+
+def _properties_size(entity):
+    return sum(len(k) + 4 + _json_size(v) for k, v in entity.items()) + 2
+
+
+def _entities_to_graph(nodes, edges):
+    """Builds the graph view from the nodes and relationships collected from a result's records (by element id). Nodes are
+    captioned by name (or symbol, or id) and edges by type; the "id" property identifies nodes and edges. Property names and
+    repeated values are interned, as results are held in sessions and most of their entities share them."""
+    graph_data = {"nodes": [], "edges": []}
+    node_ids = {}  # element id -> "id" of the node in the graph view
+
+    for element_id, node in nodes.items():
+        node_id = node.get("id")
+        node_ids[element_id] = str(node_id)
+        node_data = {"id": node_ids[element_id], "caption": node.get("name") or node.get("symbol") or f"{node_id}"}
+        for k, v in node.items():
+            node_data[sys.intern(k)] = _intern_repeated(k, v)
+        graph_data["nodes"].append({"data": node_data})
+
+    for relationship in edges.values():
+        rel_type = sys.intern(relationship.type)
+        edge_data = {
+            "id": str(relationship.get("id")),
+            "caption": rel_type,  # relationship type as the "caption"
+            "source": node_ids[relationship.start_node.element_id],
+            "target": node_ids[relationship.end_node.element_id],
+            "label": rel_type,  # relationship type as the "label"
+        }
+        for k, v in relationship.items():
+            if k not in ["id", "type"]:
+                edge_data[sys.intern(k)] = _intern_repeated(k, v)
+        graph_data["edges"].append({"data": edge_data})
+
+    return {"type": "graph", "data": graph_data}
+
+
+# properties whose values repeat across most entities of a result
+_REPEATED_PROPERTIES = frozenset(["category", "predicate", "primary_knowledge_source"])
+
+
+def _intern_repeated(key, value):
+    if key not in _REPEATED_PROPERTIES:
+        return value
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, list):
+        # interned in place, as the graph view shares the driver's lists (which nothing else sees) rather than copying them
+        value[:] = [sys.intern(v) if isinstance(v, str) else v for v in value]
+    return value
 
 
 def summarize_structure(d):
@@ -112,3 +206,293 @@ def summarize_structure(d):
         return d
 
 
+# variable-length relationship patterns without an upper bound, e.g. [*], [r:REL*1..] or [*..]
+_UNBOUNDED_VAR_LENGTH = re.compile(r'\*\s*(\d+\s*)?\.\.\s*\]|\*\s*\]')
+# unbounded traversals of the subclass hierarchy only, e.g. [:`biolink:subclass_of`*0..], which the system prompt recommends
+_SUBCLASS_TRAVERSAL = re.compile(r'\[\s*\w*\s*:\s*`?biolink[:_]subclass_of`?\s*\*\s*[01]?\s*(\.\.\s*)?\]')
+
+
+def _operator_name(op):
+    return op.get('operatorType', '').split('@')[0]
+
+
+def _starts_unbound(op):
+    """Whether the rows an operator expands from come from a scan of all nodes, with no filter along the way (so the start node
+    isn't bound by a label, an id or a property). Index seeks, label scans and arguments from an enclosing plan all bind it."""
+    for child in op.get('children', []):
+        operator = _operator_name(child)
+        if operator == 'AllNodesScan':
+            return True
+        if operator != 'Filter' and _starts_unbound(child):
+            return True
+    return False
+
+
+def summarize_plan(plan, max_estimated_rows):
+    """Summarizes a query plan (from EXPLAIN, as given by the result summary's .plan) for a pre-flight cost check.
+    Returns the estimated rows of the plan root, whether that is over max_estimated_rows, and a list of risks:
+    cartesian products estimated at more than max_estimated_rows rows, and unbounded variable-length expansions that
+    start from an unbound node or are estimated at more than max_estimated_rows rows. Unbounded traversals of the
+    subclass hierarchy from a bound node are expected (and usually small, whatever the planner estimates), so they are not risks."""
+    risks = []
+
+    def walk(op):
+        operator = _operator_name(op)
+        args = op.get('arguments', {})
+        estimated_rows = args.get('EstimatedRows', 0)
+        details = str(args.get('Details', ''))
+        if operator == 'CartesianProduct' and estimated_rows > max_estimated_rows:
+            risks.append(f"The query contains a cartesian product (disconnected MATCH patterns) estimated at {estimated_rows:.0f} rows.")
+        if operator.startswith('VarLengthExpand') and _UNBOUNDED_VAR_LENGTH.search(details):
+            if _starts_unbound(op):
+                risks.append(f"The query contains an unbounded variable-length path from a node not bound by a label, id or property: {details}")
+            elif estimated_rows > max_estimated_rows and not _SUBCLASS_TRAVERSAL.search(details):
+                risks.append(f"The query contains an unbounded variable-length path estimated at {estimated_rows:.0f} rows: {details}")
+        for child in op.get('children', []):
+            walk(child)
+
+    if plan is None:
+        return {"estimated_rows": 0, "too_many_rows": False, "risks": []}
+
+    walk(plan)
+    estimated_rows = plan.get('arguments', {}).get('EstimatedRows', 0)
+    return {"estimated_rows": estimated_rows, "too_many_rows": estimated_rows > max_estimated_rows, "risks": risks}
+
+
+def add_limit(query, limit):
+    """Adds a LIMIT clause to the end of a query, unless it already ends with one."""
+    query = query.strip().rstrip(';').rstrip()
+    if re.search(r'\bLIMIT\s+\S+$', query, flags = re.IGNORECASE):
+        return query
+    return f"{query}\nLIMIT {limit}"
+
+
+def table_result(rows):
+    """Wraps a list of rows in the same structure _parse_neo4j_result returns for table-shaped results."""
+    return {"result_as_graph": {"type": "graph", "data": {"nodes": [], "edges": []}},
+            "result_as_table": {"type": "table", "data": rows}}
+
+
+def _quote_name(name):
+    """Backtick-quotes a label or relationship type for use in a query."""
+    return "`" + name.replace("`", "``") + "`"
+
+
+class SchemaSnapshot:
+    """In-memory snapshot of a graph's schema: labels, relationship types, property keys and per-label/per-type counts.
+    Loaded on first use and refreshed when older than refresh_interval seconds (None to never refresh automatically),
+    or explicitly with refresh(). Shared by all agents for the same database, see get_schema_snapshot()."""
+    def __init__(self, refresh_interval = 3600):
+        self.refresh_interval = refresh_interval
+        self.labels = []
+        self.relationship_types = []
+        self.property_keys = []
+        self.label_counts = {}
+        self.relationship_type_counts = {}
+        self.loaded_at = None
+        # asyncio locks are bound to an event loop, and the snapshot is shared by agents on different loops, so each loop gets one
+        self._refresh_locks = weakref.WeakKeyDictionary()  # event loop -> asyncio.Lock
+        self._refresh_locks_lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self.loaded_at is not None
+
+    def is_stale(self):
+        if not self.loaded:
+            return True
+        return self.refresh_interval is not None and time.monotonic() - self.loaded_at > self.refresh_interval
+
+    async def refresh(self, driver):
+        """Reloads the snapshot from the database. Counts come from the count store, so this is cheap even for large graphs."""
+        async with driver.session() as session:
+            result = await session.run("CALL db.labels() YIELD label RETURN label")
+            labels = await result.value("label")
+            result = await session.run("CALL db.relationshipTypes() YIELD relationshipType RETURN relationshipType")
+            relationship_types = await result.value("relationshipType")
+            result = await session.run("CALL db.propertyKeys() YIELD propertyKey RETURN propertyKey")
+            property_keys = await result.value("propertyKey")
+
+            label_counts = {}
+            for label in labels:
+                result = await session.run(f"MATCH (n:{_quote_name(label)}) RETURN count(n) AS count")
+                label_counts[label] = (await result.single())["count"]
+
+            relationship_type_counts = {}
+            for rel_type in relationship_types:
+                result = await session.run(f"MATCH ()-[r:{_quote_name(rel_type)}]->() RETURN count(r) AS count")
+                relationship_type_counts[rel_type] = (await result.single())["count"]
+
+        # readers may be using the snapshot concurrently, so everything is swapped in at once
+        (self.labels, self.relationship_types, self.property_keys,
+         self.label_counts, self.relationship_type_counts) = (labels, relationship_types, property_keys,
+                                                              label_counts, relationship_type_counts)
+        self.loaded_at = time.monotonic()
+
+    def _refresh_lock(self):
+        loop = asyncio.get_running_loop()
+        with self._refresh_locks_lock:
+            if loop not in self._refresh_locks:
+                self._refresh_locks[loop] = asyncio.Lock()
+            return self._refresh_locks[loop]
+
+    async def ensure_loaded(self, driver):
+        """Loads the snapshot if it hasn't been yet, or refreshes it if it is older than refresh_interval. If a periodic refresh
+        fails, the previous snapshot is kept. Concurrent callers wait for a single refresh rather than each running one."""
+        if not self.is_stale():
+            return
+        async with self._refresh_lock():
+            # another caller may have refreshed the snapshot while this one waited for the lock
+            if not self.is_stale():
+                return
+            try:
+                await self.refresh(driver)
+            except Exception as e:
+                if not self.loaded:
+                    raise
+                logger.warning("Could not refresh schema snapshot, keeping the previous one: %s", e)
+
+    def as_dict(self):
+        return {"labels": self.labels,
+                "relationship_types": self.relationship_types,
+                "property_keys": self.property_keys,
+                "label_counts": self.label_counts,
+                "relationship_type_counts": self.relationship_type_counts}
+
+
+_schema_snapshots = {}
+_schema_snapshots_lock = threading.Lock()
+
+
+def database_release(neo4j_driver):
+    """An identifier of the graph loaded in a database, for tagging persistent caches when no KG release is configured: the
+    database id and creation date, which change whenever the database is recreated, as when a new KG release is loaded.
+    Takes a synchronous driver; returns None if the database doesn't provide them."""
+    try:
+        with neo4j_driver.session() as session:
+            record = session.run("CALL db.info() YIELD id, creationDate RETURN id, toString(creationDate) AS created").single()
+    except Exception as e:
+        logger.warning("Could not identify the database release: %s", e)
+        return None
+    if record is None:
+        return None
+    return f"db:{record['id']}@{record['created']}"
+
+
+def get_schema_snapshot(uri, refresh_interval = 3600):
+    """Returns the process-wide SchemaSnapshot for the database at uri, creating it (unloaded) if needed."""
+    with _schema_snapshots_lock:
+        if uri not in _schema_snapshots:
+            _schema_snapshots[uri] = SchemaSnapshot(refresh_interval = refresh_interval)
+        return _schema_snapshots[uri]
+
+
+class DriverRegistry:
+    """Process-wide registry of async neo4j drivers, so that agents (and Streamlit sessions) share one connection pool per
+    database rather than each creating their own. Async drivers are bound to the event loop they are used from, so there is one
+    driver per database per event loop. A loop's drivers are closed when it shuts down (as asyncio.run() does on return), or
+    explicitly with close(); close_all() closes the rest at interpreter exit."""
+    def __init__(self, max_connection_pool_size = 100, connection_acquisition_timeout = 60, max_connection_lifetime = 3600):
+        self.driver_config = {"max_connection_pool_size": max_connection_pool_size,
+                              "connection_acquisition_timeout": connection_acquisition_timeout,
+                              "max_connection_lifetime": max_connection_lifetime}
+
+        self._drivers = weakref.WeakKeyDictionary()  # event loop -> {uri: driver}
+        self._shutdown_hooks = weakref.WeakKeyDictionary()  # event loop -> started _close_at_shutdown() generator
+        self._lock = threading.Lock()
+        self.sessions_in_use = 0
+        self.peak_sessions_in_use = 0
+        self.sessions_opened = 0
+
+    def get_driver(self, uri):
+        """Returns the shared driver for uri on the running event loop, creating it if needed."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            loop_drivers = self._drivers.setdefault(loop, {})
+            if uri not in loop_drivers:
+                loop_drivers[uri] = AsyncGraphDatabase.driver(uri, **self.driver_config)
+            if loop not in self._shutdown_hooks:
+                self._shutdown_hooks[loop] = self._start_shutdown_hook()
+            return loop_drivers[uri]
+
+    def _start_shutdown_hook(self):
+        # event loops close the async generators started on them when shutting down (loop.shutdown_asyncgens(), which
+        # asyncio.run() calls), while they can still run coroutines; a generator paused at its yield thus closes the loop's
+        # drivers then. The registry holds it, as loops only keep weak references to their generators.
+        hook = self._close_at_shutdown()
+        try:
+            # runs it up to the yield (there's nothing to wait on before it), registering it with the running loop
+            hook.asend(None).send(None)
+        except StopIteration:
+            pass
+        return hook
+
+    async def _close_at_shutdown(self):
+        try:
+            yield
+        finally:
+            await self.close()
+
+    @contextlib.asynccontextmanager
+    async def session(self, uri, **kwargs):
+        """Borrows a session (and so a pooled connection) from the shared driver for uri, tracking pool utilization."""
+        driver = self.get_driver(uri)
+        with self._lock:
+            self.sessions_in_use += 1
+            self.sessions_opened += 1
+            self.peak_sessions_in_use = max(self.peak_sessions_in_use, self.sessions_in_use)
+        try:
+            async with driver.session(**kwargs) as session:
+                yield session
+        finally:
+            with self._lock:
+                self.sessions_in_use -= 1
+
+    async def close(self):
+        """Closes the drivers belonging to the running event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            # the loop's shutdown hook stays registered, and closes any drivers created after this
+            loop_drivers = self._drivers.pop(loop, {})
+        for driver in loop_drivers.values():
+            try:
+                await driver.close()
+            except Exception as e:
+                logger.warning("Could not close neo4j driver: %s", e)
+
+    def close_all(self):
+        """Closes all drivers whose event loops can still run them; called at interpreter exit."""
+        with self._lock:
+            drivers = [(loop, driver) for loop, loop_drivers in self._drivers.items() for driver in loop_drivers.values()]
+            self._drivers.clear()
+            self._shutdown_hooks.clear()
+
+        for loop, driver in drivers:
+            try:
+                if loop.is_closed():
+                    continue
+                elif loop.is_running():
+                    asyncio.run_coroutine_threadsafe(driver.close(), loop).result(timeout = 5)
+                else:
+                    loop.run_until_complete(driver.close())
+            except Exception as e:
+                logger.warning("Could not close neo4j driver: %s", e)
+
+    def stats(self):
+        with self._lock:
+            num_drivers = sum(len(loop_drivers) for loop_drivers in self._drivers.values())
+            pool_size = self.driver_config["max_connection_pool_size"]
+            return {"drivers": num_drivers,
+                    "sessions_in_use": self.sessions_in_use,
+                    "peak_sessions_in_use": self.peak_sessions_in_use,
+                    "sessions_opened": self.sessions_opened,
+                    "max_connection_pool_size": pool_size,
+                    # sessions in use relative to the total pool capacity of all drivers
+                    "pool_utilization": self.sessions_in_use / (pool_size * max(num_drivers, 1)),
+                    }
+
+
+neo4j_drivers = DriverRegistry(max_connection_pool_size = int(os.environ.get("NEO4J_MAX_POOL_SIZE", 100)),
+                               connection_acquisition_timeout = float(os.environ.get("NEO4J_CONNECTION_ACQUISITION_TIMEOUT", 60)),
+                               max_connection_lifetime = float(os.environ.get("NEO4J_MAX_CONNECTION_LIFETIME", 3600)))
+atexit.register(neo4j_drivers.close_all)
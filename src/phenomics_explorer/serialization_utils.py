@@ -0,0 +1,80 @@
+import json
+import neo4j.time
+import neo4j.spatial
+
+from phenomics_explorer.neo4j_utils import summarize_structure
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the standard library encoder is used if it isn't installed
+    orjson = None
+
+
+def _default(value):
+    """Encodes the non-JSON values that can appear in neo4j results: temporal types as ISO 8601 strings, points as maps."""
+    if isinstance(value, (neo4j.time.Date, neo4j.time.Time, neo4j.time.DateTime, neo4j.time.Duration)):
+        return value.iso_format()
+    if isinstance(value, neo4j.spatial.Point):
+        return {"srid": value.srid, "coordinates": list(value)}
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    return str(value)
+
+
+def dumps(value, indent = False):
+    """Serializes value to a compact (or, with indent = True, 2-space indented) JSON string, using orjson if available."""
+    if orjson is not None:
+        try:
+            option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+            return orjson.dumps(value, default = _default, option = option).decode()
+        except TypeError:
+            # orjson rejects e.g. integers beyond 64 bits, which json handles
+            pass
+    if indent:
+        return json.dumps(value, default = _default, indent = 2)
+    return json.dumps(value, default = _default, separators = (",", ":"))
+
+
+class ResultEnvelope(dict):
+    """A query result that serializes itself at most once: the compact JSON text (as returned to the model), the indented
+    JSON text (as shown to the evaluator), the structure summary and the token count are computed on first use and cached.
+    Like cached results, envelopes are shared and must be treated as read-only; copy into a plain dict to modify."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._text = None
+        self._indented_text = None
+        self._summary = None
+        self._token_lens = {}
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = dumps(self)
+        return self._text
+
+    @property
+    def indented_text(self):
+        if self._indented_text is None:
+            self._indented_text = dumps(self, indent = True)
+        return self._indented_text
+
+    @property
+    def summary(self):
+        """The summarize_structure() of the result, itself as an envelope."""
+        if self._summary is None:
+            self._summary = ResultEnvelope(summarize_structure(self))
+        return self._summary
+
+    def token_len(self, count_tokens, key = None):
+        """The number of tokens in the compact text, according to count_tokens(text); cached per key (e.g. the model name,
+        as different models count differently)."""
+        if key not in self._token_lens:
+            self._token_lens[key] = count_tokens(self.text)
+        return self._token_lens[key]
+
+
+def as_envelope(value):
+    """Returns value as a ResultEnvelope, wrapping it if it isn't one already."""
+    if isinstance(value, ResultEnvelope):
+        return value
+    return ResultEnvelope(value)
@@ -0,0 +1,74 @@
+import time
+
+from phenomics_explorer.cache_utils import DiskQueryCache, QueryResultCache, make_cache_key
+
+
+def test_lru_eviction_keeps_recently_used_entries():
+    cache = QueryResultCache(maxsize = 2, ttl = None)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats()["size"] == 2 and cache.evictions == 1
+
+    for i in range(10):
+        cache.put(f"key {i}", i)
+    assert cache.stats()["size"] == 2 and cache.evictions == 11
+
+
+def test_expired_and_disabled_entries_miss():
+    cache = QueryResultCache(ttl = 0.01)
+    cache.put("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a") is None and cache.expirations == 1
+
+    cache = QueryResultCache(enabled = False)
+    cache.put("a", 1)
+    assert cache.get("a") is None and cache.stats()["size"] == 0
+
+
+def test_cache_keys_ignore_formatting_but_not_literals():
+    query = "MATCH (g:Gene {symbol: 'A  B'})\n  RETURN g"
+    assert make_cache_key(query) == make_cache_key("  MATCH (g:Gene {symbol: 'A  B'}) RETURN g ")
+    assert make_cache_key(query) != make_cache_key("MATCH (g:Gene {symbol: 'A B'}) RETURN g")
+    assert make_cache_key("MATCH (`a  b`) RETURN 1") != make_cache_key("MATCH (`a b`) RETURN 1")
+
+    # parameters are part of the key, whatever their order; so is the namespace
+    assert make_cache_key(query, {"a": 1, "b": 2}) == make_cache_key(query, {"b": 2, "a": 1})
+    assert make_cache_key(query, {"a": 1}) != make_cache_key(query, {"a": 2})
+    assert make_cache_key(query, namespace = "bolt://one") != make_cache_key(query, namespace = "bolt://two")
+
+
+def test_disk_cache_is_scoped_to_the_kg_release(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = DiskQueryCache(path, kg_release = "2025-01-01")
+    cache.put("key", {"rows": [1]})
+    cache.close()
+
+    cache = DiskQueryCache(path, kg_release = "2025-01-01")
+    assert cache.get("key") == {"rows": [1]}
+    cache.close()
+
+    cache = DiskQueryCache(path, kg_release = "2025-06-01")
+    assert cache.get("key") is None
+    assert cache.stats()["size"] == 0
+    cache.close()
+
+
+def test_disk_cache_without_a_release_is_disabled(tmp_path, monkeypatch):
+    monkeypatch.delenv("MONARCH_KG_RELEASE", raising = False)
+    path = str(tmp_path / "cache.sqlite")
+    cache = DiskQueryCache(path, kg_release = "2025-01-01")
+    cache.put("key", {"rows": [1]})
+    cache.close()
+
+    cache = DiskQueryCache(path)
+    assert not cache.enabled
+    cache.put("other", {"rows": [2]})
+    assert cache.get("key") is None
+    # entries of known releases are left alone
+    assert cache.stats()["size"] == 1
+    cache.close()
@@ -0,0 +1,65 @@
+import os
+import json
+import glob
+import shutil
+
+import pytest
+
+from corpus import CompiledCorpus, compile_corpus, phenopacket_fields, phenopacket_to_prompt
+from mondo_xrefs import phenopacket_diagnosis
+
+
+EXAMPLE_PHENOPACKETS = os.path.join(os.path.dirname(__file__), "..", "eval", "phenopackets")
+
+
+@pytest.fixture
+def phenopackets_dir(tmp_path):
+    directory = tmp_path / "phenopackets"
+    directory.mkdir()
+    for path in sorted(glob.glob(os.path.join(EXAMPLE_PHENOPACKETS, "*.json")))[:5]:
+        shutil.copy(path, directory)
+    # one without a diagnosis, and with text beyond ASCII
+    with open(directory / "undiagnosed.json", "w") as f:
+        json.dump({"subject": {"id": "patient ü", "sex": "FEMALE"},
+                   "phenotypicFeatures": [{"type": {"id": "HP:0001250", "label": "Seizure – focal"}}]}, f, ensure_ascii = False)
+    return str(directory)
+
+
+def test_records_match_the_phenopackets(phenopackets_dir, tmp_path):
+    corpus = CompiledCorpus(compile_corpus(phenopackets_dir, str(tmp_path / "test.corpus")))
+    files = sorted(glob.glob(os.path.join(phenopackets_dir, "*.json")))
+    assert len(corpus) == len(files) and sorted(corpus.phenopacket_files()) == files
+
+    for phenopacket_file in files:
+        with open(phenopacket_file) as f:
+            phenopacket = json.load(f)
+        record = corpus.get(phenopacket_file)
+        assert record == {"phenopacket_file": phenopacket_file,
+                          **phenopacket_fields(phenopacket),
+                          "diagnosis": phenopacket_diagnosis(phenopacket),
+                          "prompt": phenopacket_to_prompt(phenopacket)}
+        assert corpus.phenopacket(phenopacket_file) == phenopacket
+
+    assert corpus.get(os.path.join(phenopackets_dir, "undiagnosed.json"))["diagnosis"] is None
+    assert corpus.get("missing.json") is None and "missing.json" not in corpus
+    corpus.close()
+
+
+def test_parsed_phenopackets_are_shared_within_the_cache_size(phenopackets_dir, tmp_path):
+    corpus = CompiledCorpus(compile_corpus(phenopackets_dir, str(tmp_path / "test.corpus")), cache_size = 2)
+    first, second, third = corpus.phenopacket_files()[:3]
+
+    assert corpus.phenopacket(first) is corpus.phenopacket(first)
+    corpus.phenopacket(second)
+    corpus.phenopacket(third)
+    # the least recently used one was dropped, and is parsed again
+    assert list(corpus._phenopackets) == [second, third]
+    assert corpus.phenopacket(first) == corpus.phenopacket(first)
+    corpus.close()
+
+
+def test_other_files_are_rejected(tmp_path):
+    path = tmp_path / "not.corpus"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        CompiledCorpus(str(path))
@@ -0,0 +1,36 @@
+import asyncio
+
+from phenomics_explorer.neo4j_utils import DriverRegistry
+
+
+# creating (and closing) a driver doesn't connect to the database, so no server is needed
+
+
+def test_drivers_are_shared_within_a_loop_and_closed_when_it_shuts_down():
+    registry = DriverRegistry()
+    drivers = []
+
+    async def use_driver():
+        driver = registry.get_driver("bolt://localhost:7687")
+        assert registry.get_driver("bolt://localhost:7687") is driver
+        drivers.append(driver)
+
+    for _ in range(3):
+        asyncio.run(use_driver())
+
+    assert len(set(map(id, drivers))) == 3
+    assert all(driver._closed for driver in drivers)
+    assert registry.stats()["drivers"] == 0
+
+
+def test_explicit_close_and_reuse():
+    registry = DriverRegistry()
+
+    async def close_and_reopen():
+        first = registry.get_driver("bolt://localhost:7687")
+        await registry.close()
+        second = registry.get_driver("bolt://localhost:7687")
+        assert first._closed and second is not first and not second._closed
+        return second
+
+    assert asyncio.run(close_and_reopen())._closed
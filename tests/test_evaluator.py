@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+from kani import ChatMessage, ToolCall
+from kani.engines.base import BaseEngine, Completion
+
+pytest.importorskip("kani_utils")
+import phenomics_explorer.agent_kgbase_evaluator as evaluator
+
+
+_QUERY = "MATCH (d:Disease)-[:has_phenotype]->(p) RETURN d, p\nLIMIT 1000"
+_FOUND = {"result_as_graph": {"type": "graph", "data": {"nodes": [{"data": {"id": "MONDO:1"}}], "edges": []}},
+          "result_as_table": {"type": "table", "data": []}}
+
+
+class ReportingEngine(BaseEngine):
+    """Calls report_evaluation() once per round, accepting every query; counts the rounds."""
+    max_context_size = 100000
+
+    def __init__(self):
+        self.rounds = 0
+
+    def prompt_len(self, messages, functions = None, **kwargs):
+        return sum(len(m.text or "") for m in messages) // 4
+
+    async def predict(self, messages, functions = None, **hyperparams):
+        if messages[-1].role.value == "function":
+            return Completion(ChatMessage.assistant("Done."))
+        self.rounds += 1
+        call = ToolCall.from_function("report_evaluation", query_summary = "Lists phenotypes.", accept_query = True, suggestion = "None.")
+        return Completion(ChatMessage.assistant(None, tool_calls = [call]))
+
+
+async def collect(round):
+    return [m async for m in round]
+
+
+def test_sync_and_async_evaluations_share_verdicts(monkeypatch):
+    # full_round_sync drives the agent's round from synchronous code
+    monkeypatch.setattr(evaluator, "full_round_sync", lambda agent, prompt: asyncio.run(collect(agent.full_round(prompt))))
+    engine = ReportingEngine()
+    agent = evaluator.EvaluatorAgent(engine)
+
+    verdict = agent.evaluate_query(_QUERY, _FOUND)
+    assert verdict == {"query_summary": "Lists phenotypes.", "accept_query": True, "suggestion": "None."}
+
+    # the same query, modulo whitespace, gets the cached verdict from either entry point
+    cached = asyncio.run(agent.evaluate_query_async(_QUERY.replace("\n", "  "), _FOUND))
+    assert cached == {**verdict, "cached_verdict": True}
+    assert engine.rounds == 1
+    assert agent.eval_stats["llm_evaluations"] == 1 and agent.eval_stats["cached_verdicts"] == 1
+
+    agent.clear_verdict_cache()
+    assert asyncio.run(agent.evaluate_query_async(_QUERY, _FOUND)) == verdict
+    assert engine.rounds == 2
+
+
+def test_lint_verdicts_skip_the_evaluator_round():
+    engine = ReportingEngine()
+    agent = evaluator.EvaluatorAgent(engine)
+    verdict = asyncio.run(agent.evaluate_query_async("MATCH (g) WHERE g.id = 'HGNC:1' RETURN g.name LIMIT 1", _FOUND))
+    assert verdict["accept_query"] and engine.rounds == 0
+
+
+def test_history_messages_are_serialized_once_per_position(monkeypatch):
+    agent = evaluator.EvaluatorAgent(ReportingEngine())
+    dumped = []
+    monkeypatch.setattr(evaluator, "messages_dump", lambda m: dumped.append(m.text) or {"role": m.role.value, "content": m.text})
+
+    history = [ChatMessage.user(f"message {i}") for i in range(12)]
+    prompt = agent.get_eval_query_prompt(_QUERY, _FOUND, history)
+    assert "message 1\"" not in prompt and "message 2\"" in prompt and "message 11\"" in prompt
+    assert len(dumped) == 10 and sorted(agent._history_cache) == list(range(2, 12))
+
+    # only the new message is serialized; entries that fell out of the window are dropped
+    history.append(ChatMessage.user("message 12"))
+    agent.get_eval_query_prompt(_QUERY, _FOUND, history)
+    assert dumped[10:] == ["message 12"] and sorted(agent._history_cache) == list(range(3, 13))
+
+    # a message replaced at a cached position is serialized again
+    history[-1] = ChatMessage.user("message 12, edited")
+    assert "message 12, edited" in agent.get_eval_query_prompt(_QUERY, _FOUND, history)
+    assert dumped[11:] == ["message 12, edited"]
@@ -0,0 +1,23 @@
+from phenomics_explorer.lint_utils import lint_query, query_labels
+
+
+_FOUND = {"result_as_graph": {"type": "graph", "data": {"nodes": [{"data": {"id": "HGNC:1"}}], "edges": []}},
+          "result_as_table": {"type": "table", "data": [{"g.name": "A1BG"}]}}
+
+
+def test_limit_1_lookup_is_accepted():
+    verdict = lint_query("MATCH (g) WHERE g.id = 'HGNC:1' RETURN g.name LIMIT 1", _FOUND)
+    assert verdict is not None and verdict["accept_query"]
+
+
+def test_limit_without_order_by_is_left_to_the_evaluator():
+    # e.g. as added by the explain guard with explain_guard = "limit"
+    assert lint_query("MATCH (d:Disease)-[:has_phenotype]->(p) RETURN d, p\nLIMIT 1000", _FOUND) is None
+
+
+def test_where_label_predicates():
+    labels, _ = query_labels("MATCH (n)-[r]->(m) WHERE n:Disease AND m:`biolink:Gene`|Protein RETURN n")
+    assert labels == {"Disease", "biolink:Gene", "Protein"}
+
+    verdict = lint_query("MATCH (n) WHERE n:Nope RETURN n", _FOUND, known_labels = {"Disease"})
+    assert verdict is not None and not verdict["accept_query"]
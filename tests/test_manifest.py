@@ -0,0 +1,27 @@
+from manifest import ExperimentManifest, plan_experiments
+
+
+def test_pending_and_progress_only_cover_this_run(tmp_path):
+    path = str(tmp_path / "manifest.jsonl")
+    results_dir = str(tmp_path / "results")
+
+    earlier = ExperimentManifest(path)
+    earlier.plan(plan_experiments(["a.json", "b.json"], ["base-1"], ["None"], results_dir))
+    earlier.close()
+
+    manifest = ExperimentManifest(path)
+    experiments = plan_experiments(["a.json"], ["base-2"], ["None"], results_dir)
+    manifest.plan(experiments)
+
+    assert [record["key"] for record in manifest.pending()] == [experiments[0]["output_file"]]
+    progress = manifest.progress()
+    assert (progress["total"], progress["remaining"]) == (1, 1)
+
+    manifest.start(experiments[0]["output_file"])
+    manifest.finish(experiments[0]["output_file"])
+    progress = manifest.progress()
+    assert (progress["done"], progress["remaining"]) == (1, 0)
+    assert manifest.pending() == []
+    # the earlier run's experiments are still in the manifest, for a run that plans them again
+    assert manifest.counts["planned"] == 2
+    manifest.close()
@@ -0,0 +1,83 @@
+import asyncio
+
+import httpx
+
+from phenomics_explorer.monarch_utils import monarch_api_search
+
+
+BASE_URL = "http://monarch.test/v3/api"
+
+
+def _item(i, term):
+    return {"id": f"MONDO:{i:07d}", "category": "biolink:Disease", "name": f"{term} {i}", "in_taxon_label": None,
+            "highlight": "dropped", "description": "dropped"}
+
+
+class StandInAPI:
+    """Serves /search like the Monarch API, paginated by limit and offset, with per-term error statuses and delays (a delay
+    past the request's read timeout raises ReadTimeout, as the transport would)."""
+    def __init__(self, total = 12, status = None, delay = None):
+        self.total = total
+        self.status = status or {}   # term -> HTTP status to respond with
+        self.delay = delay or {}     # term -> seconds before responding
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, request):
+        assert request.url.path == "/v3/api/search"
+        term = request.url.params["q"]
+        limit, offset = int(request.url.params["limit"]), int(request.url.params["offset"])
+        self.requests.append((term, limit, offset))
+
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay.get(term, 0.01))
+            timeout = request.extensions["timeout"]["read"]
+            if self.delay.get(term, 0) > timeout:
+                raise httpx.ReadTimeout("timed out", request = request)
+        finally:
+            self.in_flight -= 1
+
+        if term in self.status:
+            return httpx.Response(self.status[term], json = {"detail": "error"})
+        items = [_item(i, term) for i in range(offset, min(offset + limit, self.total))]
+        return httpx.Response(200, json = {"items": items, "limit": limit, "offset": offset, "total": self.total})
+
+
+def search(api, terms, **kwargs):
+    async def run():
+        async with httpx.AsyncClient(transport = httpx.MockTransport(api)) as client:
+            return await monarch_api_search(terms, base_url = BASE_URL, client = client, **kwargs)
+    return asyncio.run(run())
+
+
+def test_first_page_of_slimmed_results_per_term():
+    api = StandInAPI(total = 12)
+    results = search(api, ["marfan", "cystic fibrosis"], limit = 5)
+
+    assert list(results) == ["marfan", "cystic fibrosis"]
+    assert sorted(api.requests) == [("cystic fibrosis", 5, 0), ("marfan", 5, 0)]
+    assert [item["id"] for item in results["marfan"]] == [f"MONDO:{i:07d}" for i in range(5)]
+    assert set(results["marfan"][0]) == {"id", "category", "name", "in_taxon_label"}
+
+
+def test_concurrency_limit():
+    api = StandInAPI()
+    results = search(api, [f"term {i}" for i in range(10)], max_concurrency = 3)
+    assert len(results) == 10 and api.max_in_flight == 3
+
+
+def test_error_status_fails_only_that_term():
+    api = StandInAPI(status = {"bad": 503})
+    results = search(api, ["good", "bad"])
+    assert len(results["good"]) == 5
+    assert results["bad"] == {"error": "The search for this term failed with HTTP status 503."}
+
+
+def test_timeout_fails_only_that_term():
+    api = StandInAPI(delay = {"slow": 0.3})
+    results = search(api, ["slow", "fast"], timeout = 0.1)
+    assert len(results["fast"]) == 5
+    assert results["slow"] == {"error": "The search for this term timed out after 0.1 seconds."}
@@ -0,0 +1,18 @@
+from phenomics_explorer.monarch_utils import munge_monarch_graph_result, compact_monarch_data
+
+
+def _compact_graph(nodes, edges):
+    graph = munge_monarch_graph_result({"nodes": [{"data": n} for n in nodes], "edges": [{"data": e} for e in edges]})
+    data = {"result_as_graph": {"type": "graph", "data": graph}, "result_as_table": {"type": "none"}}
+    return compact_monarch_data(data)["result_as_graph"]["data"]
+
+
+def test_compact_node_with_only_unlisted_categories():
+    compact = _compact_graph([{"id": "X:1", "name": "x", "category": ["biolink:NotACategory", "biolink:AlsoNotACategory"]},
+                              {"id": "HP:1", "name": "p", "category": ["biolink:PhenotypicFeature"]}],
+                             [{"subject": "X:1", "object": "HP:1", "label": "biolink:has_phenotype"}])
+
+    assert compact["categories"] == ["biolink:NotACategory", "biolink:PhenotypicFeature"]
+    assert compact["nodes"]["columns"][:3] == ["id", "category", "name"]
+    assert [row[1] for row in compact["nodes"]["rows"]] == [0, 1]
+    assert compact["predicates"] == ["biolink:has_phenotype"]
@@ -0,0 +1,19 @@
+import json
+
+from mondo_xrefs import load_xref_table
+
+
+def _save_table(tmp_path, kg_release):
+    path = str(tmp_path / "mondo_xrefs.json")
+    with open(path, "w") as f:
+        json.dump({"kg_release": kg_release, "xrefs": {"OMIM:1": [{"mondo_id": "MONDO:0000001", "disease_name": "d"}]}}, f)
+    return path
+
+
+def test_table_for_the_current_release_is_used(tmp_path):
+    assert "OMIM:1" in load_xref_table(_save_table(tmp_path, "2025-01-01"), kg_release = "2025-01-01")
+
+
+def test_table_for_another_release_is_ignored(tmp_path, capsys):
+    assert load_xref_table(_save_table(tmp_path, "2025-01-01"), kg_release = "2025-06-01") == {}
+    assert "built for KG release 2025-01-01" in capsys.readouterr().err
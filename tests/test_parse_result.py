@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+import neo4j.time
+import neo4j.spatial
+from neo4j import Record
+from neo4j._codec.packstream import Structure
+from neo4j._codec.hydration.v2 import HydrationHandler
+
+from phenomics_explorer.neo4j_utils import _parse_neo4j_result, ResultTooLargeError
+
+
+class FakeResult:
+    """Stands in for an AsyncResult: records can only be iterated once, and entities are hydrated through one scope, as the
+    driver does (so repeated nodes are the same object, filled in if they first arrived without properties)."""
+    def __init__(self, keys, rows):
+        self._keys = keys
+        self._rows = rows
+        self.scope = HydrationHandler().new_hydration_scope()
+        self.records_read = 0
+        self.consumed = False
+        self._iterated = False
+
+    def node(self, i, **properties):
+        return self.scope.hydration_hooks[Structure](Structure(b"N", i, ["Thing"], properties, f"4:db:{i}"))
+
+    def relationship(self, j, start, end, type = "RELATED_TO", **properties):
+        return self.scope.hydration_hooks[Structure](Structure(b"R", j, start, end, type, properties,
+                                                               f"5:db:{j}", f"4:db:{start}", f"4:db:{end}"))
+
+    def keys(self):
+        return self._keys
+
+    def __bool__(self):
+        return True
+
+    def __aiter__(self):
+        assert not self._iterated, "the result was iterated more than once"
+        self._iterated = True
+        return self._records()
+
+    async def _records(self):
+        for row in self._rows:
+            self.records_read += 1
+            # values are built lazily, as records are hydrated when they are fetched
+            yield Record(zip(self._keys, row(self) if callable(row) else row))
+
+    async def consume(self):
+        self.consumed = True
+
+
+def parse(result, max_chars = None):
+    return asyncio.run(_parse_neo4j_result(result, max_chars = max_chars))
+
+
+def test_table_results_read_records_once():
+    result = FakeResult(["name", "count"], [["A1BG", 3], ["BRCA1", 5]])
+    parsed = parse(result)
+    assert result.records_read == 2
+    assert parsed["result_as_table"] == {"type": "table", "data": [{"name": "A1BG", "count": 3}, {"name": "BRCA1", "count": 5}]}
+    assert parsed["result_as_graph"] == {"type": "graph", "data": {"nodes": [], "edges": []}}
+
+
+def test_graph_results_have_an_empty_table_view():
+    rows = [lambda r: [r.node(1, id = "MONDO:1", name = "disease"), r.relationship(10, 1, 2, id = "e1"), r.node(2, id = "HP:2", symbol = "HP2")],
+            lambda r: [r.node(1, id = "MONDO:1", name = "disease"), r.relationship(11, 1, 3, id = "e2"), r.node(3, id = "HP:3")]]
+    result = FakeResult(["d", "r", "p"], rows)
+    parsed = parse(result)
+
+    assert result.records_read == 2
+    assert parsed["result_as_table"] == {"type": "table", "data": []}
+    graph = parsed["result_as_graph"]["data"]
+    assert [node["data"]["caption"] for node in graph["nodes"]] == ["disease", "HP2", "HP:3"]
+    assert [(edge["data"]["source"], edge["data"]["target"], edge["data"]["label"]) for edge in graph["edges"]] == \
+        [("MONDO:1", "HP:2", "RELATED_TO"), ("MONDO:1", "HP:3", "RELATED_TO")]
+
+
+def test_nodes_are_deduplicated_by_element_id():
+    # nodes without an "id" property are still told apart
+    result = FakeResult(["n"], [lambda r: [r.node(1, name = "a")], lambda r: [r.node(2, name = "b")], lambda r: [r.node(1, name = "a")]])
+    graph = parse(result)["result_as_graph"]["data"]
+    assert [node["data"]["name"] for node in graph["nodes"]] == ["a", "b"]
+
+
+def test_relationship_endpoints_filled_in_later():
+    # a relationship returned without its nodes carries nodes without properties, until the full nodes show up
+    rows = [lambda r: [r.relationship(10, 1, 2, id = "e1")],
+            lambda r: [r.node(1, id = "MONDO:1"), r.node(2, id = "HP:2")]]
+    result = FakeResult(["a", "b"], rows)
+    graph = parse(result)["result_as_graph"]["data"]
+    assert [node["data"]["id"] for node in graph["nodes"]] == ["MONDO:1", "HP:2"]
+    assert (graph["edges"][0]["data"]["source"], graph["edges"][0]["data"]["target"]) == ("MONDO:1", "HP:2")
+
+
+def test_oversized_results_stop_early():
+    result = FakeResult(["name"], [[f"gene {i:04d}"] for i in range(1000)])
+    with pytest.raises(ResultTooLargeError) as raised:
+        parse(result, max_chars = 500)
+    # each value is about 11 characters, so the budget is passed after ~46 rows and the rest are never read
+    assert raised.value.num_rows == result.records_read < 60
+    assert raised.value.num_chars > raised.value.max_chars == 500
+    assert result.consumed
+
+
+def test_repeated_entities_count_once_towards_the_budget():
+    # the same node in every record adds nothing after the first
+    result = FakeResult(["n"], [lambda r: [r.node(1, id = "MONDO:1", description = "x" * 100)]] * 1000)
+    graph = parse(result, max_chars = 500)["result_as_graph"]["data"]
+    assert result.records_read == 1000 and len(graph["nodes"]) == 1
+
+
+def test_table_values_are_coerced():
+    when = neo4j.time.DateTime(2024, 5, 1, 12, 30, 0)
+    row = [neo4j.time.Date(2024, 5, 1), [when, None, 1.5], {"at": neo4j.spatial.CartesianPoint((1.0, 2.0)), "n": True}]
+    parsed = parse(FakeResult(["day", "list", "map"], [row]))
+    assert parsed["result_as_table"]["data"] == [{"day": "2024-05-01",
+                                                  "list": ["2024-05-01T12:30:00.000000000", None, 1.5],
+                                                  "map": {"at": {"srid": 7203, "coordinates": [1.0, 2.0]}, "n": True}}]
+
+
+def test_table_rows_stop_at_the_first_node():
+    # a result is either a table or a graph; once a node shows up, the table view is empty
+    rows = [["a"], lambda r: [r.node(1, id = "MONDO:1")], ["b"]]
+    parsed = parse(FakeResult(["x"], rows))
+    assert parsed["result_as_table"]["data"] == []
+    assert len(parsed["result_as_graph"]["data"]["nodes"]) == 1
+
+
+def test_table_rows_of_empty_results():
+    parsed = parse(FakeResult(["x"], []))
+    assert parsed["result_as_table"] == {"type": "table", "data": []}
+    assert parsed["result_as_graph"]["data"] == {"nodes": [], "edges": []}
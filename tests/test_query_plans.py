@@ -0,0 +1,62 @@
+from phenomics_explorer.neo4j_utils import summarize_plan, add_limit
+
+
+def _op(operator, estimated_rows, details = "", children = ()):
+    return {"operatorType": f"{operator}@neo4j",
+            "arguments": {"EstimatedRows": estimated_rows, "Details": details},
+            "children": list(children)}
+
+
+def _plan(expand):
+    return _op("ProduceResults", expand["arguments"]["EstimatedRows"], children = [expand])
+
+
+def test_anchored_subclass_traversal_is_not_a_risk():
+    seek = _op("NodeIndexSeek", 1, "RANGE INDEX ns:`biolink:Disease`(id) WHERE id = $autostring_0")
+    expand = _op("VarLengthExpand(All)", 12, "(ns)<-[anon_0:`biolink:subclass_of`*0..]-(ns_subtype)", [seek])
+    assert summarize_plan(_plan(expand), 1000)["risks"] == []
+
+    # planner estimates for the subclass hierarchy are often far too high, so they don't count against a bound start node
+    expand = _op("VarLengthExpand(All)", 5000, "(ns)<-[anon_0:`biolink:subclass_of`*0..]-(ns_subtype)", [seek])
+    assert summarize_plan(_plan(expand), 1000)["risks"] == []
+
+
+def test_small_anchored_expand_is_not_a_risk():
+    scan = _op("Filter", 1, "d.id = $autostring_0", [_op("NodeByLabelScan", 25000, "d:`biolink:Disease`")])
+    expand = _op("VarLengthExpand(All)", 12, "(d)-[anon_0:`biolink:related_to`*1..]->(x)", [scan])
+    assert summarize_plan(_plan(expand), 1000)["risks"] == []
+
+
+def test_large_anchored_expand_is_a_risk():
+    scan = _op("NodeByLabelScan", 25000, "d:`biolink:Disease`")
+    expand = _op("VarLengthExpand(All)", 50000, "(d)-[anon_0:`biolink:related_to`*1..]->(x)", [scan])
+    risks = summarize_plan(_plan(expand), 1000)["risks"]
+    assert len(risks) == 1 and "50000 rows" in risks[0]
+
+
+def test_unbound_start_is_a_risk():
+    expand = _op("VarLengthExpand(All)", 12, "(a)-[anon_0:`biolink:subclass_of`*0..]->(b)", [_op("AllNodesScan", 1000)])
+    risks = summarize_plan(_plan(expand), 1000)["risks"]
+    assert len(risks) == 1 and "not bound" in risks[0]
+
+
+def test_bounded_expand_is_not_a_risk():
+    expand = _op("VarLengthExpand(All)", 50000, "(a)-[anon_0*1..3]->(b)", [_op("AllNodesScan", 1000)])
+    assert summarize_plan(_plan(expand), 1000)["risks"] == []
+
+
+def test_cartesian_product_and_row_estimates():
+    product = _op("CartesianProduct", 2e6, children = [_op("AllNodesScan", 2000), _op("AllNodesScan", 1000)])
+    summary = summarize_plan(_plan(product), 1000)
+    assert summary["too_many_rows"] and summary["estimated_rows"] == 2e6
+    assert len(summary["risks"]) == 1 and "cartesian product" in summary["risks"][0]
+
+    assert summarize_plan(None, 1000) == {"estimated_rows": 0, "too_many_rows": False, "risks": []}
+
+
+def test_add_limit():
+    assert add_limit("MATCH (n) RETURN n;", 100) == "MATCH (n) RETURN n\nLIMIT 100"
+    assert add_limit("MATCH (n) RETURN n limit 5 ", 100) == "MATCH (n) RETURN n limit 5"
+    assert add_limit("MATCH (n) RETURN n LIMIT $k", 100) == "MATCH (n) RETURN n LIMIT $k"
+    # a LIMIT in a subquery doesn't limit the result
+    assert add_limit("CALL { MATCH (n) RETURN n LIMIT 5 } RETURN n", 100).endswith("\nLIMIT 100")
@@ -0,0 +1,106 @@
+import time
+import asyncio
+
+import pytest
+from kani import ChatMessage
+from kani.engines.base import BaseEngine, Completion
+
+from rate_limiting import TokenBucket, RateLimiter, RateLimitedEngine
+
+
+def test_bucket_refills_continuously_up_to_capacity():
+    bucket = TokenBucket(per_minute = 60)
+    asyncio.run(bucket.acquire(60))
+    assert bucket.available < 1
+
+    # one unit per second
+    bucket.updated -= 3
+    bucket._refill()
+    assert 3 <= bucket.available < 3.5
+
+    bucket.updated -= 3600
+    bucket._refill()
+    assert bucket.available == 60
+
+
+async def _timed_acquire(bucket, amount):
+    started = time.monotonic()
+    await bucket.acquire(amount)
+    return time.monotonic() - started
+
+
+def test_acquire_waits_for_refill():
+    bucket = TokenBucket(per_minute = 600)  # 10 units per second
+    asyncio.run(bucket.acquire(600))
+    assert 0.09 < asyncio.run(_timed_acquire(bucket, 1)) < 0.5
+
+    # requests larger than the bucket wait for a full bucket, rather than forever
+    bucket = TokenBucket(per_minute = 60)  # 1 unit per second
+    asyncio.run(bucket.acquire(60))
+    bucket.updated -= 59.7  # 59.7 units available, 0.3 short of a full bucket
+    assert 0.25 < asyncio.run(_timed_acquire(bucket, 10 ** 6)) < 0.8
+
+
+def test_settling_charges_and_returns_tokens():
+    limiter = RateLimiter(rpm = None, tpm = 600)
+    asyncio.run(limiter.acquire(100))
+    limiter.settle(estimated_tokens = 100, actual_tokens = 400)
+    assert limiter.requests is None and limiter.tokens.available < 201
+    limiter.settle(estimated_tokens = 400, actual_tokens = 0)
+    assert limiter.tokens.available > 599
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+class FlakyEngine(BaseEngine):
+    max_context_size = 1000
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def prompt_len(self, messages, functions = None, **kwargs):
+        return 10
+
+    async def predict(self, messages, functions = None, **hyperparams):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RateLimitError("slow down")
+        return Completion(ChatMessage.assistant("ok"), prompt_tokens = 10, completion_tokens = 5)
+
+
+def test_rate_limit_errors_are_retried():
+    engine = RateLimitedEngine(FlakyEngine(failures = 2), RateLimiter(rpm = 600, tpm = None), max_retries = 3, base_delay = 0.001)
+    completion = asyncio.run(engine.predict([ChatMessage.user("hi")]))
+    assert completion.message.text == "ok"
+    assert engine.stats == {"requests": 3, "rate_limit_retries": 2}
+
+    engine = RateLimitedEngine(FlakyEngine(failures = 5), RateLimiter(rpm = 600, tpm = None), max_retries = 1, base_delay = 0.001)
+    with pytest.raises(RateLimitError):
+        asyncio.run(engine.predict([ChatMessage.user("hi")]))
+
+
+def test_experiments_run_at_most_concurrency_at_a_time(tmp_path, monkeypatch):
+    # diagnose.py needs the agents' dependencies, though the experiments themselves are stubbed out here
+    pytest.importorskip("kani_utils")
+    monkeypatch.setenv("NEO4J_URI", "bolt://localhost:7687")
+    import diagnose
+    from manifest import ExperimentManifest, plan_experiments
+
+    in_flight = []
+    peak = []
+    async def run_experiment(experiment, *args):
+        in_flight.append(1)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.pop()
+        return {"cost_est_base_rate": 0}
+    monkeypatch.setattr(diagnose, "run_experiment", run_experiment)
+
+    manifest = ExperimentManifest(str(tmp_path / "manifest.jsonl"))
+    manifest.plan(plan_experiments([f"p{i}.json" for i in range(10)], ["base"], ["eval"], str(tmp_path)))
+    progress = asyncio.run(diagnose.run_experiments(manifest, engine_factory = None, neo4j_driver = None, concurrency = 3))
+    manifest.close()
+    assert max(peak) == 3 and progress["done"] == 10
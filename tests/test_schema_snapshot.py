@@ -0,0 +1,28 @@
+import time
+import asyncio
+
+from phenomics_explorer.neo4j_utils import SchemaSnapshot
+
+
+class CountingSnapshot(SchemaSnapshot):
+    def __init__(self):
+        super().__init__(refresh_interval = 3600)
+        self.refreshes = 0
+
+    async def refresh(self, driver):
+        self.refreshes += 1
+        await asyncio.sleep(0.01)
+        self.loaded_at = time.monotonic()
+
+
+def test_concurrent_callers_share_one_refresh():
+    snapshot = CountingSnapshot()
+
+    async def load_concurrently():
+        await asyncio.gather(*[snapshot.ensure_loaded(driver = None) for _ in range(10)])
+
+    asyncio.run(load_concurrently())
+    assert snapshot.refreshes == 1
+    # a snapshot shared with another event loop still works there
+    asyncio.run(load_concurrently())
+    assert snapshot.refreshes == 1
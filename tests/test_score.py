@@ -0,0 +1,68 @@
+import os
+import json
+import asyncio
+
+import pytest
+
+pytest.importorskip("kani_utils")
+score = pytest.importorskip("score")
+
+
+def write_results(tmp_path, **results):
+    directory = tmp_path / "diagnoses" / "base_agent" / "eval_agent"
+    directory.mkdir(parents = True, exist_ok = True)
+    path = directory / "PMID_1_patient.json"
+    path.write_text(json.dumps(results))
+    return str(path)
+
+
+def test_candidates_are_scored_by_rank():
+    candidates = [f"MONDO:{i:07d}" for i in range(1, 13)]
+    assert score.score_candidates(candidates, "MONDO:0000001") == \
+        {"candidates": candidates, "top_1_score": 1, "top_3_score": 1, "top_10_score": 1}
+    assert score.score_candidates(candidates, "MONDO:0000003")["top_1_score"] == 0
+    assert score.score_candidates(candidates, "MONDO:0000004")["top_3_score"] == 0
+    assert score.score_candidates(candidates, "MONDO:0000011")["top_10_score"] == 0
+    assert score.score_candidates([], "MONDO:0000001")["top_10_score"] == 0
+
+
+def test_scored_files_are_rescored_against_the_resolved_diagnosis(tmp_path):
+    candidates = ["MONDO:0000001", "MONDO:0000002"]
+    path = write_results(tmp_path,
+                         expected_diagnosis = "OMIM:100100",
+                         expected_diagnosis_mondo = [{"mondo_id": "MONDO:0000001"}],
+                         messages = [],
+                         score = score.score_candidates(candidates, "MONDO:0000001"))
+    # the diagnosis now resolves to the second candidate; the saved candidates are rescored without calling the engine
+    xref_table = {"OMIM:100100": [{"mondo_id": "MONDO:0000002"}]}
+    row = asyncio.run(score.score_results_file(path, engine = None, xref_table = xref_table))
+
+    assert (row["top_1_score"], row["top_3_score"], row["expected_diagnosis"]) == (0, 1, "MONDO:0000002")
+    assert (row["base_agent"], row["eval_agent"]) == ("base_agent", "eval_agent")
+    with open(path) as f:
+        saved = json.load(f)
+    assert saved["score"] == score.score_candidates(candidates, "MONDO:0000002")
+    assert saved["expected_diagnosis_mondo"] == [{"mondo_id": "MONDO:0000002"}]
+
+
+def test_unchanged_scores_are_not_saved(tmp_path, monkeypatch):
+    path = write_results(tmp_path,
+                         expected_diagnosis = "OMIM:100100",
+                         expected_diagnosis_mondo = [{"mondo_id": "MONDO:0000001"}],
+                         messages = [],
+                         score = score.score_candidates(["MONDO:0000001"], "MONDO:0000001"))
+    saved = []
+    monkeypatch.setattr(score, "save_results", lambda *args: saved.append(args))
+    row = asyncio.run(score.score_results_file(path, engine = None, xref_table = {}))
+    assert row["top_1_score"] == 1 and saved == []
+
+
+def test_files_without_a_single_valid_diagnosis_are_skipped(tmp_path):
+    path = write_results(tmp_path, expected_diagnosis = "OMIM:100100", messages = [],
+                         expected_diagnosis_mondo = [{"mondo_id": "MONDO:0000001"}, {"mondo_id": "MONDO:0000002"}])
+    assert asyncio.run(score.score_results_file(path, engine = None, xref_table = {})) is None
+
+    path = write_results(tmp_path, expected_diagnosis = "OMIM:100100", messages = [],
+                         expected_diagnosis_mondo = [{"mondo_id": "OMIM:100100"}])
+    assert asyncio.run(score.score_results_file(path, engine = None, xref_table = {})) is None
+    assert os.path.exists(path)
@@ -0,0 +1,45 @@
+import json
+
+import neo4j.time
+
+from phenomics_explorer.serialization_utils import ResultEnvelope, as_envelope, dumps
+from phenomics_explorer.neo4j_utils import summarize_structure
+
+
+def _result(encoded = False):
+    # encoded = True gives the values as they should come out of the JSON text
+    rows = [{"name": f"gene {i}", "score": i / 3,
+             "added": f"2024-05-0{i + 1}" if encoded else neo4j.time.Date(2024, 5, i + 1),
+             "tags": ["a", "b"] if encoded else ("a", "b")} for i in range(5)]
+    return {"result_as_graph": {"type": "graph", "data": {"nodes": [], "edges": []}},
+            "result_as_table": {"type": "table", "data": rows}}
+
+
+def test_text_matches_the_dict_view():
+    envelope = ResultEnvelope(_result())
+    assert json.loads(envelope.text) == _result(encoded = True)
+    assert json.loads(envelope.indented_text) == _result(encoded = True)
+    assert envelope.text == dumps(dict(envelope))
+    # an envelope is still the dict it wraps, e.g. for munging and display
+    assert envelope == _result()
+
+
+def test_serialized_views_are_computed_once():
+    envelope = ResultEnvelope(_result())
+    assert envelope.text is envelope.text
+    assert envelope.summary is envelope.summary
+    assert envelope.summary == summarize_structure(_result())
+    assert json.loads(envelope.summary.text) == json.loads(dumps(summarize_structure(_result())))
+
+    counted = []
+    def count_tokens(text):
+        counted.append(text)
+        return len(text) // 4
+    assert envelope.token_len(count_tokens, key = "model-a") == envelope.token_len(count_tokens, key = "model-a")
+    envelope.token_len(count_tokens, key = "model-b")
+    assert counted == [envelope.text, envelope.text]
+
+
+def test_as_envelope_wraps_once():
+    envelope = as_envelope(_result())
+    assert isinstance(envelope, ResultEnvelope) and as_envelope(envelope) is envelope
@@ -0,0 +1,64 @@
+import os
+import json
+
+import pytest
+
+from manifest import ExperimentManifest, plan_experiments, parse_shard, in_shard
+from merge_results import merge_results
+
+
+def test_shards_partition_the_phenopackets():
+    files = [f"phenopackets/PMID_{i}_case.json" for i in range(500)]
+    shards = [[f for f in files if in_shard(f, shard, 4)] for shard in range(4)]
+
+    assert sorted(f for shard in shards for f in shard) == sorted(files)
+    assert all(len(shard) > 75 for shard in shards)
+    # assigned by file name, so the same on machines with the phenopackets elsewhere
+    assert all(in_shard(os.path.join("/data", os.path.basename(f)), 1, 4) for f in shards[1])
+
+
+def test_parse_shard():
+    assert parse_shard("2/4") == (2, 4)
+    for spec in ["4/4", "-1/4", "0/0", "1", "a/b"]:
+        with pytest.raises(ValueError):
+            parse_shard(spec)
+
+
+def _write_results(results_dir, phenopackets_files, content = "result"):
+    for experiment in plan_experiments(phenopackets_files, ["base"], ["None"], results_dir):
+        os.makedirs(os.path.dirname(experiment["output_file"]), exist_ok = True)
+        with open(experiment["output_file"], "w") as f:
+            json.dump({"phenopacket_file": experiment["phenopacket_file"], "content": content}, f)
+
+
+def test_merge_deduplicates_and_reports_conflicts_and_missing(tmp_path):
+    shard_0, shard_1, merged = (str(tmp_path / name) for name in ["shard_0", "shard_1", "merged"])
+    _write_results(shard_0, ["a.json", "b.json"])
+    # b.json was run by both shards, with the same result; c.json with different ones
+    _write_results(shard_1, ["b.json"])
+    _write_results(shard_0, ["c.json"], content = "first")
+    _write_results(shard_1, ["c.json"], content = "second")
+
+    expected = [os.path.relpath(e["output_file"], "results")
+                for e in plan_experiments(["a.json", "b.json", "c.json", "d.json"], ["base"], ["None"], "results")]
+    report = merge_results([shard_0, shard_1], merged, expected)
+
+    assert report["merged"] == 3
+    assert [os.path.basename(c["experiment"]) for c in report["conflicts"]] == ["c.json"]
+    assert [os.path.basename(m) for m in report["missing"]] == ["d.json"]
+
+    (kept,) = [e["output_file"] for e in plan_experiments(["c.json"], ["base"], ["None"], merged)]
+    with open(kept) as f:
+        assert json.load(f)["content"] == "first"
+
+    manifest = ExperimentManifest(os.path.join(merged, "manifest.jsonl"))
+    assert sorted(os.path.basename(key) for key, record in manifest.experiments.items() if record["state"] == "done") == \
+        ["a.json", "b.json", "c.json"]
+    manifest.close()
+
+    # merging again (e.g. after another shard finished) doesn't duplicate anything
+    with open(os.path.join(merged, "manifest.jsonl")) as f:
+        manifest_lines = len(f.readlines())
+    assert merge_results([shard_0, shard_1], merged, expected)["merged"] == 3
+    with open(os.path.join(merged, "manifest.jsonl")) as f:
+        assert len(f.readlines()) == manifest_lines